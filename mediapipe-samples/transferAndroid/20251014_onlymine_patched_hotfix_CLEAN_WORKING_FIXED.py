@@ -10,20 +10,78 @@ Rehab Counter — Squat (knee-angle) & Calf Raise (ground-referenced) ONLY
 使用方式：
 1) 執行本檔，先選擇動作（深蹲/提踵），再選擇使用「攝影機」或「影片」。
 2) 產生輸出於 ./output/*.mp4。
+3) 批次（無介面、多行程）：
+   python <本檔> batch --action calf_raise videos/*.mp4 [--workers N] [--out-dir DIR]
+   每支影片輸出 *.mp4 + *.json，並於 out-dir 寫入 batch_*.json 彙總與總吞吐量。
+   關鍵點會依「影片內容雜湊 + Pose/防手震設定」快取於 output/cache；重跑時略過推論，
+   加 --no-video 時連解碼都略過（只重播關鍵點、輸出 JSON）。
+   --analysis-only：只計數（不畫圖、不編碼、不 warp 畫面），吞吐量只受推論限制。
+   --adaptive 4：閒置時每 4 幀才推論一次（中間內插；--no-video 時略過的幀不解碼），動作中仍逐幀推論。
+   --segment 1:00-2:30 --segment 5:00-：只處理長影片中的運動區段（首次建立幀 / 關鍵幀索引並快取，之後定位又快又準）。
+   --codec h264 --out-scale 0.5 --out-every 2：較小的審閱用輸出（編碼在背景執行緒，不拖慢推論；batch / live / render 皆可用）。
+4) 單支長影片分塊平行（每塊一個 worker，含暖機重疊；每塊重新起 Pose 追蹤，計數可能與單一行程逐幀跑略有差異，
+   只輸出 JSON / 事件）：
+   python <本檔> chunked session.mp4 --action calf_raise [--chunk 300] [--overlap 10] [--workers N] [--strict]
+5) 多工作站即時（一台機器服務多位病患；各站獨立計數與輸出檔，--pose-workers 限制同時推論的執行緒數）：
+   python <本檔> live --action calf_raise --source 0 --source 1 [--pose-workers 2]
+   --defer-overlay：現場只錄原始畫面 + *_overlay.npz 側檔（不即時疊圖），之後再產生標註影片：
+   python <本檔> render output/live_提踵_s0_<時間>_raw.mp4 [--height 480]
+6) 門檻調參（以治療師計數為準，重用關鍵點快取）：
+   python <本檔> sweep labels.json --action calf_raise --grid A_min=6:9:0.5 --grid hold_seconds=2.5,3,3.5
+7) 效能基準（合成資料，可 --compare 舊結果）：
+   python <本檔> bench [--only stab] [--compare output/bench_舊.json]
 """
 
+import time
+_T_LAUNCH = time.perf_counter()     # 程式啟動時刻（量測「啟動 → 第一個計數幀」）
+
 import os
 import os.path
+import sys
 import math
-from collections import deque
+import glob
+import json
+import argparse
+import contextlib
+import io
+import platform
+import subprocess
+from collections import deque, OrderedDict
 import cv2
 import numpy as np
 import functools
-import mediapipe as mp
-import tkinter as tk
-from tkinter import messagebox, filedialog, simpledialog
-from PIL import Image, ImageDraw, ImageFont
-import time
+import itertools
+import hashlib
+import csv
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import importlib.metadata
+
+
+# mediapipe（import 約 1 秒，多半是 solutions 連帶載入的 matplotlib）與 tkinter 延後到真正用到時才載入：
+# 批次 / sweep / render 等路徑不必付這筆成本，GUI 流程則在選單期間由 PosePrewarm 於背景載入並預熱
+@functools.lru_cache(maxsize=None)
+def _mediapipe():
+    import mediapipe
+    return mediapipe
+
+
+# PIL（約 20 ms）只有畫 HUD / 中文字時才用；只分析不輸出畫面的路徑（--no-video、chunked 的每個 worker）不載入
+@functools.lru_cache(maxsize=None)
+def _pil():
+    from PIL import Image, ImageDraw, ImageFont
+    return Image, ImageDraw, ImageFont
+
+
+@functools.lru_cache(maxsize=None)
+def _mediapipe_version():
+    """快取鍵 / bench 用的版本字串：只讀套件 metadata，不載入 mediapipe。"""
+    try:
+        return importlib.metadata.version("mediapipe")
+    except Exception:
+        return getattr(_mediapipe(), "__version__", "?")
 
 # === GUI root (for dialogs) ===
 _tk_root = None
@@ -31,6 +89,7 @@ def _ensure_tk_root():
     global _tk_root
     if _tk_root is None:
         try:
+            import tkinter as tk
             _tk_root = tk.Tk()
             _tk_root.withdraw()
         except Exception:
@@ -43,6 +102,8 @@ def choose_input_source():
     Returns ("webcam", 0) or ("video", path) or ("cancel", None).
     """
     root = _ensure_tk_root()
+    if root:
+        from tkinter import messagebox, filedialog
     use_cam = False
     if root:
         try:
@@ -107,75 +168,388 @@ def resize_to_max_height(frame, max_h=720):
 
 
 
+# === 快取工具（影片內容雜湊 / 快取資料夾）===
+CACHE_DIR_ENV = "REHAB_CACHE_DIR"
+
+
+def cache_dir():
+    """快取資料夾：環境變數 REHAB_CACHE_DIR，預設 ./output/cache。"""
+    d = os.environ.get(CACHE_DIR_ENV) or os.path.join(os.getcwd(), "output", "cache")
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+@functools.lru_cache(maxsize=256)
+def _content_hash(path, size, mtime, chunk, samples):
+    h = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= chunk * samples:
+            h.update(f.read())
+        else:
+            for i in range(samples):
+                f.seek((size - chunk) * i // (samples - 1))
+                h.update(f.read(chunk))
+    return h.hexdigest()[:20]
+
+
+def video_content_hash(path, chunk=1 << 20, samples=8):
+    """
+    影片內容雜湊：檔案大小 + 均勻取樣 samples 段（每段 chunk bytes）。
+    長影片也只讀數 MB；同一檔案（大小 / 修改時間不變）在同一行程內只算一次。
+    """
+    st = os.stat(path)
+    return _content_hash(os.path.abspath(path), st.st_size, st.st_mtime_ns, chunk, samples)
+
+
 # === Frame-level global stabilization (affine, partial 2D) ===
+def _compose_affine(A, B):
+    """回傳 A∘B（先套 B 再套 A）的 2x3 仿射。"""
+    A3 = np.vstack([A, [0.0, 0.0, 1.0]])
+    B3 = np.vstack([B, [0.0, 0.0, 1.0]])
+    return (A3 @ B3)[:2]
+
+
+def _near_identity(A, tol_px=0.5, tol_lin=1e-3):
+    return (abs(A[0, 2]) < tol_px and abs(A[1, 2]) < tol_px
+            and abs(A[0, 0] - 1.0) < tol_lin and abs(A[1, 1] - 1.0) < tol_lin
+            and abs(A[0, 1]) < tol_lin and abs(A[1, 0]) < tol_lin)
+
+
 class GlobalStab:
-    def __init__(self, max_corners=500, quality=0.01, min_distance=8, ransac_thresh=3.0):
-        self.prev_gray = None
-        self.prev_stab = None
-        self.A = np.eye(2, 3, dtype=np.float32)  # last affine
+    """
+    全域防手震（累積仿射：目前幀 → 第一幀座標）。
+    - 動作估計在縮小的灰階影像上做（長邊 proc_max_side），結果再換算回原解析度
+    - KLT 特徵點跨幀延續追蹤，只有點數掉到 min_track_pts 以下才重新 goodFeaturesToTrack
+    - 腳架偵測：連續 static_frames 幀中位位移 < static_px 視為靜止鏡頭，
+      之後只每 static_check_every 幀估一次動作；累積仿射仍接近單位矩陣時略過 warp
+    - mode="warp"：對整張畫面 warpAffine（原行為）
+      mode="landmarks"：畫面不動，只估計仿射；由呼叫端用 landmark_transform() 把
+      33 個關鍵點換算到參考座標（detector 只需要關鍵點，省下整張 warp 與複製）
+    """
+    MODES = ("warp", "landmarks")
+
+    def __init__(self, max_corners=500, quality=0.01, min_distance=8, ransac_thresh=3.0,
+                 proc_max_side=480, min_track_pts=120, static_px=0.3, static_frames=15,
+                 static_check_every=5, mode="warp"):
+        if mode not in self.MODES:
+            raise ValueError(f"unknown stabilization mode: {mode}")
+        self.mode = mode
         self.max_corners = max_corners
         self.quality = quality
         self.min_distance = min_distance
         self.ransac_thresh = ransac_thresh
+        self.proc_max_side = int(proc_max_side)
+        self.min_track_pts = int(min_track_pts)
+        self.static_px = float(static_px)
+        self.static_frames = int(static_frames)
+        self.static_check_every = max(1, int(static_check_every))
+
+        self.prev_gray = None          # 上一個估計幀（縮小灰階、未校正）
+        self.pts = None                # 上一個估計幀上仍在追蹤的特徵點
+        self.A = np.eye(2, 3, dtype=np.float64)  # 累積仿射（全解析度）
+        self.mag = 0.0
+        self.static_count = 0
+        self.static = False
+        self.frame_idx = 0
+
+    def _small_gray(self, frame_bgr):
+        h, w = frame_bgr.shape[:2]
+        s = min(1.0, self.proc_max_side / float(max(h, w)))
+        if s < 1.0:
+            frame_bgr = cv2.resize(frame_bgr, (max(1, int(round(w * s))), max(1, int(round(h * s)))),
+                                   interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY), s
+
+    def _detect(self, gray, s):
+        return cv2.goodFeaturesToTrack(gray, maxCorners=self.max_corners, qualityLevel=self.quality,
+                                       minDistance=max(3, int(round(self.min_distance * s))))
+
+    def _restart(self, gray):
+        # not enough points / tracking lost: fall back（以目前幀為新參考）
+        self.prev_gray = gray
+        self.pts = None
+        self.A = np.eye(2, 3, dtype=np.float64)
+        self.static_count = 0
+        self.static = False
+
+    def _update_static(self, disp_px):
+        self.static_count = self.static_count + 1 if disp_px < self.static_px else 0
+        self.static = self.static_count >= self.static_frames
+
+    def track(self, frame_bgr):
+        """
+        追蹤一幀：回傳「此幀 → 上一幀」的仿射 M（全解析度 2x3）；
+        第一幀或追蹤失敗（已改以此幀重新起算）時回傳 None。
+        """
+        gray, s = self._small_gray(frame_bgr)
+        if self.prev_gray is None or gray.shape != self.prev_gray.shape:
+            self._restart(gray)
+            return None
 
-    def stabilize(self, frame_bgr):
-        gray = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY)
-        if self.prev_gray is None:
-            self.prev_gray = gray
-            self.prev_stab = frame_bgr
-            return frame_bgr, 0.0
-
-        # Features on previous stabilized frame
-        prev_pts = cv2.goodFeaturesToTrack(self.prev_gray, maxCorners=self.max_corners,
-                                           qualityLevel=self.quality, minDistance=self.min_distance)
-        if prev_pts is None or len(prev_pts) < 50:
-            # not enough points; fall back
-            self.prev_gray = gray
-            self.prev_stab = frame_bgr
-            return frame_bgr, 0.0
+        if self.pts is None or len(self.pts) < self.min_track_pts:
+            self.pts = self._detect(self.prev_gray, s)
+        if self.pts is None or len(self.pts) < 50:
+            self._restart(gray)
+            return None
 
         # Track to current raw frame
-        next_pts, st, err = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, prev_pts, None)
-        good_prev = prev_pts[st.reshape(-1) == 1]
-        good_next = next_pts[st.reshape(-1) == 1] if next_pts is not None else None
-        if good_next is None or len(good_next) < 30:
-            self.prev_gray = gray
-            self.prev_stab = frame_bgr
-            return frame_bgr, 0.0
+        next_pts, st, err = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, self.pts, None)
+        ok = st.reshape(-1) == 1 if next_pts is not None else None
+        if ok is None or ok.sum() < 30:
+            self._restart(gray)
+            return None
+        good_prev, good_next = self.pts[ok], next_pts[ok]
 
         # Estimate affine from current to previous (to align current -> prev)
         M, inliers = cv2.estimateAffinePartial2D(good_next, good_prev, method=cv2.RANSAC,
-                                                 ransacReprojThreshold=self.ransac_thresh)
+                                                 ransacReprojThreshold=max(0.5, self.ransac_thresh * s))
         if M is None:
-            self.prev_gray = gray
-            self.prev_stab = frame_bgr
-            return frame_bgr, 0.0
+            self._restart(gray)
+            return None
+
+        # 內點留著下一幀繼續追
+        keep = inliers.reshape(-1).astype(bool) if inliers is not None else np.ones(len(good_next), bool)
+        self.pts = good_next[keep].reshape(-1, 1, 2)
+        self.prev_gray = gray
 
-        h, w = gray.shape[:2]
-        stabilized = cv2.warpAffine(frame_bgr, M, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        disp = float(np.median(np.linalg.norm((good_next - good_prev).reshape(-1, 2), axis=1))) / s
+        self._update_static(disp)
+
+        M = M.astype(np.float64)
+        M[:, 2] /= s
+        return M
+
+    def estimate(self, frame_bgr):
+        """
+        更新並回傳累積仿射 self.A（目前原始幀 → 參考座標，全解析度 2x3）；
+        追蹤失敗時重置參考並回傳 None。
+        """
+        first = self.prev_gray is None
+        M = self.track(frame_bgr)
+        if M is None:
+            return self.A if first else None
+        self.A = _compose_affine(self.A, M)
+        return self.A
 
-        # Save for next round
-        self.prev_gray = cv2.cvtColor(stabilized, cv2.COLOR_BGR2GRAY)
-        self.prev_stab = stabilized
-        self.A = M.astype(np.float32)
+    def stabilize(self, frame_bgr):
+        self.frame_idx += 1
+        # 腳架模式：大多數幀直接略過估計
+        if self.static and (self.frame_idx % self.static_check_every):
+            A = self.A
+        else:
+            A = self.estimate(frame_bgr)
+            if A is None:
+                self.mag = 0.0
+                return frame_bgr, 0.0
 
         # compute shift magnitude (for HUD/debug)
-        dx = float(M[0,2]); dy = float(M[1,2])
-        mag = (dx*dx + dy*dy) ** 0.5
-        return stabilized, mag
+        dx = float(A[0, 2]); dy = float(A[1, 2])
+        self.mag = (dx*dx + dy*dy) ** 0.5
+        if self.mode == "landmarks" or _near_identity(A):
+            return frame_bgr, self.mag
+
+        h, w = frame_bgr.shape[:2]
+        stabilized = cv2.warpAffine(frame_bgr, A, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        return stabilized, self.mag
+
+    def skip_frame(self):
+        """未解碼（cap.grab）的幀：不估計，下一個解碼幀直接與上一個估計幀追蹤。"""
+        self.frame_idx += 1
+
+    def landmark_transform(self):
+        """landmarks 模式下回傳目前幀要套在關鍵點上的仿射（複本）；不需要時回傳 None。"""
+        if self.mode != "landmarks" or _near_identity(self.A):
+            return None
+        return self.A.copy()
+
+
+# === Two-pass offline stabilization (cached trajectory sidecar) ===
+STAB_PLAN_VERSION = 1
+
+
+def _affine_params(M):
+    """部分仿射 → (tx, ty, angle_rad)。"""
+    return float(M[0, 2]), float(M[1, 2]), math.atan2(float(M[1, 0]), float(M[0, 0]))
+
+
+def _moving_average(x, radius):
+    """沿第 0 軸做 (2r+1) 視窗移動平均，兩端以邊值延伸。"""
+    if radius <= 0 or len(x) == 0:
+        return x.copy()
+    k = 2 * radius + 1
+    pad = np.pad(x, ((radius, radius),) + ((0, 0),) * (x.ndim - 1), mode="edge")
+    c = np.cumsum(np.concatenate([np.zeros_like(pad[:1]), pad]), axis=0)
+    return (c[k:] - c[:-k]) / float(k)
+
+
+class StabPlan:
+    """
+    整支影片的相機運動軌跡（第一階段結果）。
+    - params: (T, 3) 每幀「此幀 → 上一幀」的 (tx, ty, angle)，以 size=(W, H) 的像素為單位
+    - corrections(radius): 軌跡做移動平均後，回傳每幀要套用的校正仿射 (T, 2, 3)
+      （只移除高頻抖動，保留刻意的平移 / 轉動）
+    """
+    def __init__(self, params, size, fps):
+        self.params = np.asarray(params, dtype=np.float64).reshape(-1, 3)
+        self.size = (int(size[0]), int(size[1]))
+        self.fps = float(fps)
+
+    def __len__(self):
+        return len(self.params)
+
+    def corrections(self, radius=15):
+        traj = np.cumsum(self.params, axis=0)
+        diff = traj - _moving_average(traj, int(radius))
+        c, s = np.cos(diff[:, 2]), np.sin(diff[:, 2])
+        out = np.empty((len(diff), 2, 3), dtype=np.float64)
+        out[:, 0, 0], out[:, 0, 1], out[:, 0, 2] = c, -s, diff[:, 0]
+        out[:, 1, 0], out[:, 1, 1], out[:, 1, 2] = s, c, diff[:, 1]
+        return out
+
+    def save(self, path):
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, version=STAB_PLAN_VERSION, params=self.params.astype(np.float32),
+                            size=np.array(self.size), fps=self.fps)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            if int(z["version"]) != STAB_PLAN_VERSION:
+                raise ValueError("stab plan version mismatch")
+            return cls(z["params"], tuple(z["size"]), float(z["fps"]))
+
+
+def compute_stab_plan(video_path, max_h=720, proc_max_side=480):
+    """
+    第一階段：完整解碼一次，在低解析度上估計每幀的相機運動（KLT 追蹤沿用 GlobalStab）。
+    座標單位為縮到 max_h 之後的畫面（與 process_video 實際處理的畫面一致）。
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+    fps = _sanitize_fps(cap.get(cv2.CAP_PROP_FPS))
+    params, size = _track_stab_params(cap, GlobalStab(proc_max_side=proc_max_side), max_h=max_h)
+    cap.release()
+    if size is None:
+        return None
+    return StabPlan(params, size, fps)
+
+
+def _track_stab_params(cap, tracker, limit=None, max_h=720):
+    """從 cap 目前位置逐幀讀（最多 limit 幀）並追蹤；回傳 (每幀「此幀 → 上一幀」的 (tx, ty, angle), 處理尺寸)。"""
+    params, size = [], None
+    while limit is None or len(params) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame, w, h, _scaled = resize_to_max_height(frame, max_h=max_h)
+        size = size or (w, h)
+        M = tracker.track(frame)
+        # 追蹤失敗視為無運動，交給平滑處理
+        params.append(_affine_params(M) if M is not None else (0.0, 0.0, 0.0))
+    return params, size
+
+
+def stab_plan_path(video_path, max_h=720, proc_max_side=480):
+    return os.path.join(cache_dir(), f"{video_content_hash(video_path)}_stab_h{int(max_h)}_p{int(proc_max_side)}.npz")
+
+
+def load_or_compute_stab_plan(video_path, max_h=720, proc_max_side=480):
+    """依影片內容雜湊讀取軌跡 sidecar；沒有就計算並寫入快取。"""
+    path = stab_plan_path(video_path, max_h, proc_max_side)
+    if os.path.exists(path):
+        try:
+            plan = StabPlan.load(path)
+            print(f"[stab] 使用快取軌跡: {path}")
+            return plan
+        except Exception as e:
+            print(f"[warn] 軌跡快取無法讀取（{e}），重新計算")
+    t0 = time.perf_counter()
+    plan = compute_stab_plan(video_path, max_h=max_h, proc_max_side=proc_max_side)
+    if plan is None:
+        return None
+    plan.save(path)
+    print(f"[stab] 第一階段完成：{len(plan)} 幀 / {time.perf_counter() - t0:.1f}s → {path}")
+    return plan
+
+
+class PrecomputedStab:
+    """
+    第二階段：依 StabPlan 的平滑軌跡校正；介面與 GlobalStab 相同（stabilize / landmark_transform）。
+    start_frame: 從影片中間開始處理時的第一幀索引。
+    """
+    def __init__(self, plan, mode="warp", start_frame=0, radius=15):
+        if mode not in GlobalStab.MODES:
+            raise ValueError(f"unknown stabilization mode: {mode}")
+        self.mode = mode
+        self.plan = plan
+        self.corr = plan.corrections(radius)
+        self.frame_idx = int(start_frame)
+        self.A = np.eye(2, 3, dtype=np.float64)
+        self.mag = 0.0
+
+    def stabilize(self, frame_bgr):
+        h, w = frame_bgr.shape[:2]
+        if 0 <= self.frame_idx < len(self.corr):
+            A = self.corr[self.frame_idx].copy()
+            A[:, 2] *= (w / float(self.plan.size[0]), h / float(self.plan.size[1]))
+        else:
+            A = np.eye(2, 3, dtype=np.float64)
+        self.frame_idx += 1
+        self.A = A
+        self.mag = float(math.hypot(A[0, 2], A[1, 2]))
+        if self.mode == "landmarks" or _near_identity(A):
+            return frame_bgr, self.mag
+        stabilized = cv2.warpAffine(frame_bgr, A, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        return stabilized, self.mag
+
+    def skip_frame(self):
+        self.frame_idx += 1
+
+    def landmark_transform(self):
+        if self.mode != "landmarks" or _near_identity(self.A):
+            return None
+        return self.A.copy()
+
+
+STAB_MODES = ("warp", "landmarks", "off")
+
+
+def make_stab(mode="warp", video_path=None, two_pass=False, start_frame=0):
+    """
+    依模式建立防手震器；"off" 回傳 None。
+    two_pass=True（需 video_path）：使用整支影片預先計算、平滑過的軌跡（有快取）。
+    """
+    if mode == "off":
+        return None
+    if two_pass and video_path:
+        plan = load_or_compute_stab_plan(video_path)
+        if plan is not None:
+            return PrecomputedStab(plan, mode=mode, start_frame=start_frame)
+        print("[warn] 無法建立兩階段軌跡，改用即時防手震")
+    return GlobalStab(mode=mode)
+
+
+def apply_affine_to_landmarks(lf, A):
+    """
+    回傳 LandmarkFrame 的新複本，x/y 以像素座標套用 2x3 仿射 A；z / visibility 不變。
+    """
+    px, py = lf.px[:, 0], lf.px[:, 1]
+    out = lf.norm.copy()
+    out[:, 0] = (A[0, 0] * px + A[0, 1] * py + A[0, 2]) / lf.W
+    out[:, 1] = (A[1, 0] * px + A[1, 1] * py + A[1, 2]) / lf.H
+    return LandmarkFrame(out, lf.W, lf.H)
 
 
 # =====================
 # 文字疊圖（含中文）
 # =====================
 
-mp_pose = mp.solutions.pose
-mp_drawing = mp.solutions.drawing_utils
-
-
 def put_chinese_text(image, text, position, font_scale=0.7, color=(255, 255, 255), thickness=2):
     """在圖片上顯示中文文字（優先 PIL，否則退回 cv2）。"""
     try:
+        Image, ImageDraw, ImageFont = _pil()
         pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
         draw = ImageDraw.Draw(pil_image)
         try:
@@ -192,12 +566,232 @@ def put_chinese_text(image, text, position, font_scale=0.7, color=(255, 255, 255
         return image
 
 
-@functools.lru_cache(maxsize=64)
-def _cached_font(path, sz):
+class _LRUCache:
+    """執行緒安全的有界 LRU（HUD 排版 / tile 快取共用）。"""
+    def __init__(self, maxsize):
+        self.maxsize = int(maxsize)
+        self._d = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            v = self._d.get(key)
+            if v is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._d.move_to_end(key)
+            return v
+
+    def put(self, key, value):
+        with self._lock:
+            self._d[key] = value
+            self._d.move_to_end(key)
+            while len(self._d) > self.maxsize:
+                self._d.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._d.clear()
+            self.hits = self.misses = 0
+
+
+# 依你的電腦環境挑一個就好；順序會自動 fallback
+_HUD_FONT_PATHS = (
+    "C:/Windows/Fonts/msjh.ttc",   # 微軟正黑
+    "C:/Windows/Fonts/msyh.ttc",   # 微軟雅黑
+    "C:/Windows/Fonts/simhei.ttf", # 黑體
+    "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _try_font(path, size):
     try:
-        return ImageFont.truetype(path, sz)
+        return _pil()[2].truetype(path, size)
     except Exception:
-        return ImageFont.load_default()
+        return None
+
+
+@functools.lru_cache(maxsize=64)
+def _load_hud_font(sz):
+    for p in _HUD_FONT_PATHS:
+        f = _try_font(p, sz)
+        if f: return f
+    return _pil()[2].load_default()
+
+
+# HUD tile 快取：相同文字/樣式的資訊框只排版、繪製一次，之後每幀只做 ROI alpha 混合
+_HUD_TILE_CACHE = _LRUCache(256)
+# 排版快取：整塊 (lines, max_width, 字級範圍, stroke) → 字級 + 換行結果 + 每行 bbox
+_HUD_LAYOUT_CACHE = _LRUCache(512)
+# 單行量測快取：(text, 字級, stroke) → textbbox；整塊只有部分行變動時，只量變動的那幾行
+_HUD_BBOX_CACHE = _LRUCache(8192)
+_MEASURE_DRAW = None   # 只用來量字的 1x1 畫布
+
+
+def _text_bbox(text, sz, stroke):
+    global _MEASURE_DRAW
+    key = (text, sz, stroke)
+    b = _HUD_BBOX_CACHE.get(key)
+    if b is not None:
+        return b
+    if _MEASURE_DRAW is None:
+        Image, ImageDraw, _ = _pil()
+        _MEASURE_DRAW = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+    font = _load_hud_font(sz)
+    # 兼容不同 Pillow 版本：textbbox 不一定支援 stroke_width
+    try:
+        b = _MEASURE_DRAW.textbbox((0, 0), text, font=font, stroke_width=stroke)
+    except TypeError:
+        b = _MEASURE_DRAW.textbbox((0, 0), text, font=font)
+    _HUD_BBOX_CACHE.put(key, b)
+    return b
+
+
+def _wrap_lines(src, sz, max_width, stroke):
+    out = []
+    for s in src:
+        if s == "":
+            out.append("")
+            continue
+        # 整行放得下（HUD 幾乎都是）→ 一次量測就結束
+        b = _text_bbox(s, sz, stroke)
+        if b[2]-b[0] <= max_width:
+            out.append(s)
+            continue
+        buf = ""
+        for ch in s:
+            test = buf + ch
+            b = _text_bbox(test, sz, stroke); tw = b[2]-b[0]
+            if tw <= max_width:
+                buf = test
+            else:
+                if buf: out.append(buf)
+                buf = ch
+        if buf: out.append(buf)
+    return out
+
+
+def layout_text_block(lines, max_width, max_font_px, min_font_px, stroke):
+    """
+    資訊框排版（結果快取）：回傳 (font_px, wrapped_lines, line_bboxes)。
+    選出 [min_font_px, max_font_px] 內換行後不超寬的最大字級。
+    """
+    key = (tuple(lines), int(max_width), int(max_font_px), int(min_font_px), int(stroke))
+    hit = _HUD_LAYOUT_CACHE.get(key)
+    if hit is not None:
+        return hit
+
+    def _too_wide(sz, wrapped):
+        for s in wrapped:
+            if s:
+                b = _text_bbox(s, sz, stroke)
+                if b[2]-b[0] > max_width:
+                    return True
+        return False
+
+    lo, hi = int(min_font_px), int(max_font_px)
+    wrapped = _wrap_lines(lines, hi, max_width, stroke)
+    if hi >= lo and not _too_wide(hi, wrapped):
+        # 最大字級就放得下（常態）→ 與二分搜尋結果相同，省下其餘字級的量測
+        best_sz, best_wrapped = hi, wrapped
+    else:
+        # 試出最大可用字體（簡單二分）
+        best_sz = lo
+        best_wrapped = _wrap_lines(lines, lo, max_width, stroke)
+        while lo <= hi:
+            mid = (lo + hi)//2
+            wrapped = _wrap_lines(lines, mid, max_width, stroke)
+            if not _too_wide(mid, wrapped):
+                best_sz, best_wrapped = mid, wrapped
+                lo = mid + 1
+            else:
+                hi = mid - 1
+
+    result = (best_sz, tuple(best_wrapped), tuple(_text_bbox(s, best_sz, stroke) for s in best_wrapped))
+    _HUD_LAYOUT_CACHE.put(key, result)
+    return result
+
+
+def _norm_margin(m):
+    if isinstance(m, (tuple, list)) and len(m) == 2:
+        return int(m[0]), int(m[1])
+    return int(m), int(m)
+
+
+def _anchor_xy(W, H, bw, bh, anchor, margin_xy):
+    mx, my = margin_xy
+    ax = anchor[0].lower() if anchor else 'l'
+    ay = anchor[1].lower() if len(anchor) > 1 else 't'
+    x = mx if ax == 'l' else (W - mx - bw if ax == 'r' else (W - bw)//2)
+    y = my if ay == 't' else (H - my - bh if ay == 'b' else (H - bh)//2)
+    return int(x), int(y)
+
+
+def _render_text_tile(lines, max_width, color, bg_color, max_font_px, min_font_px, line_gap, stroke):
+    """
+    在小 RGBA tile 上排版並畫出資訊框（背景 + 文字）。
+    回傳 (premul_bgr, inv_alpha, box_w, box_h)：premul_bgr 為預乘 alpha 的 BGR（float32），
+    inv_alpha = 1 - alpha；box_w/box_h 為背景框大小（定位用，tile 可能因字形略大於框）。
+    """
+    font_px, best_wrapped, line_boxes = layout_text_block(lines, max_width, max_font_px, min_font_px, stroke)
+    best_font = _load_hud_font(font_px)
+
+    # 計尺寸（同時記下字形實際延伸範圍，tile 要大到裝得下）
+    line_sizes = [(b[2]-b[0], b[3]-b[1]) for b in line_boxes]
+    block_w = max([w for w, _ in line_sizes], default=0)
+    block_h = sum(h for _,h in line_sizes) + line_gap*max(0, len(line_sizes)-1)
+    box_w, box_h = block_w + 16, block_h + 12
+
+    tile_w, tile_h = box_w + 1, box_h + 1
+    yy = 6
+    for b, (w, h) in zip(line_boxes, line_sizes):
+        tile_w = max(tile_w, 8 + b[2] + 1)
+        tile_h = max(tile_h, yy + b[3] + 1)
+        yy += h + line_gap
+
+    # 背景以預乘 alpha 填入；文字以 paste-with-mask 蓋上 → 結果等同直接畫在整張畫面上
+    a = bg_color[3] if len(bg_color) == 4 else 160
+    bg = tuple(int(round(c * a / 255.0)) for c in bg_color[:3]) + (a,)
+    Image, ImageDraw, _ = _pil()
+    tile = Image.new('RGBA', (tile_w, tile_h), (0, 0, 0, 0))
+    tdraw = ImageDraw.Draw(tile)
+    tdraw.rectangle((0, 0, box_w, box_h), fill=bg)
+
+    # 畫字
+    yy = 6
+    xx = 8
+    fill = tuple(color[:3]) + (255,)
+    for s, (w, h) in zip(best_wrapped, line_sizes):
+        try:
+            tdraw.text((xx, yy), s, font=best_font, fill=fill, stroke_width=stroke, stroke_fill=(0, 0, 0, 255))
+        except TypeError:
+            tdraw.text((xx, yy), s, font=best_font, fill=fill)
+        yy += h + line_gap
+
+    arr = np.asarray(tile, dtype=np.float32)
+    premul_bgr = np.ascontiguousarray(arr[..., 2::-1])
+    inv_alpha = 1.0 - arr[..., 3:4] / 255.0
+    return premul_bgr, inv_alpha, box_w, box_h
+
+
+def _blend_tile(image, premul_bgr, inv_alpha, x, y):
+    """把預乘 alpha tile 混合進 image 的 (x, y) 位置（就地修改，只動 tile 覆蓋的 ROI）。"""
+    H, W = image.shape[:2]
+    th, tw = premul_bgr.shape[:2]
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(W, x + tw), min(H, y + th)
+    if x0 >= x1 or y0 >= y1:
+        return
+    roi = image[y0:y1, x0:x1]
+    p = premul_bgr[y0-y:y1-y, x0-x:x1-x]
+    ia = inv_alpha[y0-y:y1-y, x0-x:x1-x]
+    roi[...] = (p + roi * ia + 0.5).astype(np.uint8)
+
 
 def draw_text_block(image, lines, anchor='lt', margin=16, max_width=None,
                     color=(0, 255, 0), bg_color=(0, 0, 0, 160),
@@ -205,124 +799,34 @@ def draw_text_block(image, lines, anchor='lt', margin=16, max_width=None,
     """
     穩定版：自動換行資訊框。
     - 支援 margin=int 或 (x, y)
-    - 優先用 Pillow；失敗則退回 OpenCV + put_chinese_text（不會整塊消失）
-    """
-    # ---- utils ----
-    def _norm_margin(m):
-        if isinstance(m, (tuple, list)) and len(m) == 2:
-            return int(m[0]), int(m[1])
-        return int(m), int(m)
-
-    def _anchor_xy(W, H, bw, bh, anchor, margin_xy):
-        mx, my = margin_xy
-        ax = anchor[0].lower() if anchor else 'l'
-        ay = anchor[1].lower() if len(anchor) > 1 else 't'
-        x = mx if ax == 'l' else (W - mx - bw if ax == 'r' else (W - bw)//2)
-        y = my if ay == 't' else (H - my - bh if ay == 'b' else (H - bh)//2)
-        return int(x), int(y)
-
-    # ---- Pillow route ----
+    - 優先用 Pillow 畫在小 tile 上，只混合進資訊框所在 ROI（不做整張畫面 PIL 來回轉換）；
+      相同內容的 tile 跨幀重用。失敗則退回 OpenCV + put_chinese_text（不會整塊消失）
+    - 就地修改 image 並回傳
+    """
+    # ---- Pillow tile route ----
     try:
-        @functools.lru_cache(maxsize=64)
-        def _cached_font(path, size):
-            try:
-                return ImageFont.truetype(path, size)
-            except Exception:
-                return None
-
-        def _load_font(sz: int):
-            # 依你的電腦環境挑一個就好；順序會自動 fallback
-            paths = [
-                "C:/Windows/Fonts/msjh.ttc",   # 微軟正黑
-                "C:/Windows/Fonts/msyh.ttc",   # 微軟雅黑
-                "C:/Windows/Fonts/simhei.ttf", # 黑體
-                "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
-                "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
-            ]
-            for p in paths:
-                f = _cached_font(p, sz)
-                if f: return f
-            return ImageFont.load_default()
-
-        pil = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        W, H = pil.size
+        H, W = image.shape[:2]
         mx, my = _norm_margin(margin)
         if max_width is None:
             max_width = max(50, W - 2*mx)
 
-        draw = ImageDraw.Draw(pil, 'RGBA')
-
-        # 兼容不同 Pillow 版本：textbbox 不一定支援 stroke_width
-        def _textbbox(text, font):
-            try:
-                return draw.textbbox((0, 0), text, font=font, stroke_width=stroke)
-            except TypeError:
-                return draw.textbbox((0, 0), text, font=font)
-
         # 字串正規化
         if isinstance(lines, str):
             lines = lines.split('\n')
-        lines = ["" if l is None else str(l) for l in lines]
-
-        # 試出最大可用字體（簡單二分）
-        lo, hi = int(min_font_px), int(max_font_px)
-        best_font = _load_font(lo)
-        def _wrap(font, src):
-            out = []
-            for s in src:
-                if s == "":
-                    out.append("")
-                    continue
-                buf = ""
-                for ch in s:
-                    test = buf + ch
-                    b = _textbbox(test, font); tw = b[2]-b[0]
-                    if tw <= max_width:
-                        buf = test
-                    else:
-                        if buf: out.append(buf)
-                        buf = ch
-                if buf: out.append(buf)
-            return out
-
-        best_wrapped = _wrap(best_font, lines)
-        while lo <= hi:
-            mid = (lo + hi)//2
-            f = _load_font(mid)
-            wrapped = _wrap(f, lines)
-            too_wide = any((_textbbox(s, f)[2]-_textbbox(s, f)[0]) > max_width for s in wrapped if s)
-            if not too_wide:
-                best_font, best_wrapped = f, wrapped
-                lo = mid + 1
-            else:
-                hi = mid - 1
-
-        # 計尺寸
-        line_sizes = []
-        block_w = 0
-        for s in best_wrapped:
-            b = _textbbox(s, best_font)
-            w, h = (b[2]-b[0], b[3]-b[1])
-            line_sizes.append((w, h))
-            if w > block_w: block_w = w
-        block_h = sum(h for _,h in line_sizes) + line_gap*max(0, len(line_sizes)-1)
-
-        # 定位＋背景
-        x, y = _anchor_xy(W, H, block_w+16, block_h+12, anchor, (mx, my))
-        bg_box = (x, y, x + block_w + 16, y + block_h + 12)
-        draw.rectangle(bg_box, fill=(bg_color[0], bg_color[1], bg_color[2], bg_color[3] if len(bg_color)==4 else 160))
-
-        # 畫字
-        yy = y + 6
-        xx = x + 8
-        for s, (w, h) in zip(best_wrapped, line_sizes):
-            try:
-                draw.text((xx, yy), s, font=best_font, fill=color, stroke_width=stroke, stroke_fill=(0,0,0))
-            except TypeError:
-                draw.text((xx, yy), s, font=best_font, fill=color)
-            yy += h + line_gap
-
-        return cv2.cvtColor(np.array(pil), cv2.COLOR_RGB2BGR)
+        lines = tuple("" if l is None else str(l) for l in lines)
+
+        key = (lines, int(max_width), tuple(color), tuple(bg_color),
+               int(max_font_px), int(min_font_px), int(line_gap), int(stroke))
+        tile = _HUD_TILE_CACHE.get(key)
+        if tile is None:
+            tile = _render_text_tile(lines, max_width, color, bg_color, max_font_px, min_font_px, line_gap, stroke)
+            _HUD_TILE_CACHE.put(key, tile)
+
+        premul_bgr, inv_alpha, box_w, box_h = tile
+        # 定位
+        x, y = _anchor_xy(W, H, box_w, box_h, anchor, (mx, my))
+        _blend_tile(image, premul_bgr, inv_alpha, x, y)
+        return image
 
     except Exception:
         # ---- OpenCV fallback（永不炸）----
@@ -357,48 +861,274 @@ def draw_text_block(image, lines, anchor='lt', margin=16, max_width=None,
 # ===============
 
 def calculate_angle(a, b, c):
-    a = np.array(a); b = np.array(b); c = np.array(c)
+    # 逐元素運算（不經 BLAS 的 dot/norm），與向量版 joint_angles_deg() 逐位元一致
+    bax, bay = a[0] - b[0], a[1] - b[1]
+    bcx, bcy = c[0] - b[0], c[1] - b[1]
+    denom = (math.sqrt(bax * bax + bay * bay) * math.sqrt(bcx * bcx + bcy * bcy)) + 1e-8
+    cosine = float(np.clip((bax * bcx + bay * bcy) / denom, -1.0, 1.0))
+    return float(np.degrees(np.arccos(cosine)))
+
+
+def joint_angles_deg(a, b, c):
+    """calculate_angle 的向量版：a/b/c 為 (..., 2)，回傳 (...) 夾角（度）。"""
     ba = a - b
     bc = c - b
-    denom = (np.linalg.norm(ba) * np.linalg.norm(bc)) + 1e-8
-    cosine = float(np.clip(np.dot(ba, bc) / denom, -1.0, 1.0))
-    return float(np.degrees(np.arccos(cosine)))
+    denom = (np.sqrt(ba[..., 0] * ba[..., 0] + ba[..., 1] * ba[..., 1]) *
+             np.sqrt(bc[..., 0] * bc[..., 0] + bc[..., 1] * bc[..., 1])) + 1e-8
+    cosine = np.clip((ba[..., 0] * bc[..., 0] + ba[..., 1] * bc[..., 1]) / denom, -1.0, 1.0)
+    return np.degrees(np.arccos(cosine))
 
 
-def get_landmark_dict(landmarks):
-    d = {}
-    for lm in mp_pose.PoseLandmark:
-        i = lm.value
-        pt = landmarks[i]
-        d[lm.name.lower()] = (pt.x, pt.y, pt.z, pt.visibility)
-    return d
+# 關節角：名稱 → (a, b, c) 關鍵點索引，夾角在 b
+JOINT_ANGLE_IDS = {
+    "knee_left": (23, 25, 27),      # hip-knee-ankle
+    "knee_right": (24, 26, 28),
+    "ankle_left": (25, 27, 31),     # knee-ankle-foot_index
+    "ankle_right": (26, 28, 32),
+}
+_JOINT_TRIPLETS = np.array(list(JOINT_ANGLE_IDS.values()))
+_SHOULDERS, _HIPS = [11, 12], [23, 24]
+
+
+def pose_joint_angles(lms, size=None):
+    """
+    一次算出兩側膝角、踝角與軀幹傾角（度）。
+    lms: (33, 4) 單幀或 (T, 33, 4) 整段；size=(W, H) 時以像素座標計算（長寬比正確），
+    預設用正規化座標（與 detector 的 calculate_angle 相同，逐位元一致）。
+    回傳 {JOINT_ANGLE_IDS 各名稱..., "trunk_tilt"}，每項形狀為 lms.shape[:-2]；
+    trunk_tilt 為髖中點→肩中點相對畫面垂直向上的夾角，正值偏向 +x（判斷人是否站直 / 地面是否水平用）。
+    """
+    xy = np.asarray(lms)[..., :2].astype(np.float64)
+    if size is not None:
+        xy = xy * (float(size[0]), float(size[1]))
+    pts = xy[..., _JOINT_TRIPLETS, :]                       # (..., K, 3, 2)
+    ang = joint_angles_deg(pts[..., 0, :], pts[..., 1, :], pts[..., 2, :])
+    out = dict(zip(JOINT_ANGLE_IDS, np.moveaxis(ang, -1, 0)))
+    up = xy[..., _SHOULDERS, :].mean(axis=-2) - xy[..., _HIPS, :].mean(axis=-2)
+    out["trunk_tilt"] = np.degrees(np.arctan2(up[..., 0], -up[..., 1]))
+    return out
+
+
+class LandmarkFrame:
+    """
+    一幀 33 個關鍵點：推論後只轉換一次，之後 detector / 平滑 / 繪圖 / 快取都讀同一份陣列。
+    - norm: (33, 4) float32 [x, y, z, visibility]（正規化座標）
+    - px:   (33, 2) 像素座標 = norm[:, :2] × (W, H)；以 float64 計算，
+            與逐點 lm.x * W 及向量化評分（score_calf）逐位元一致
+    """
+    __slots__ = ("norm", "px", "W", "H", "_angles")
+
+    def __init__(self, norm, W, H):
+        self.norm = np.ascontiguousarray(norm, dtype=np.float32).reshape(33, 4)
+        self.W, self.H = int(W), int(H)
+        self.px = self.norm[:, :2].astype(np.float64) * (self.W, self.H)
+        self._angles = None
+
+    @classmethod
+    def from_landmarks(cls, landmark_list, W, H):
+        """NormalizedLandmarkList（Pose 輸出）→ LandmarkFrame；None 照樣回傳 None。"""
+        if landmark_list is None:
+            return None
+        return cls(landmarks_to_array(landmark_list), W, H)
+
+    def xy(self, ids):
+        """指定關鍵點的正規化 (x, y)，Python float 串列。"""
+        return self.norm[ids, :2].tolist()
+
+    def angles(self):
+        """pose_joint_angles（正規化座標）；同一幀只算一次。"""
+        if self._angles is None:
+            self._angles = pose_joint_angles(self.norm)
+        return self._angles
+
+    def landmark_list(self):
+        """轉回 NormalizedLandmarkList（給需要 protobuf 的外部工具）。"""
+        return landmarks_from_array(self.norm)
+
+
+# ==============================
+# 回合事件紀錄（JSONL / CSV；取代逐回合 print）
+# ==============================
+
+REP_EVENT_FIELDS = ("video", "station", "action", "frame", "t", "side", "rep", "outcome",
+                    "min_deg", "base_deg", "peak_deg", "hold_s")
+
+
+class RepEventSink:
+    """
+    回合事件寫檔：一回合一筆，JSONL 或 CSV（依副檔名，或 fmt 指定；CSV 欄位為 REP_EVENT_FIELDS）。
+    - emit() 只放進記憶體緩衝，滿 buffer 筆或 flush() / close() 時一次寫出（批次不被主控台 I/O 卡住）
+    - 檔案超過 max_bytes 時輪替：path → path.1 → ... → path.<backups>（同 logging.RotatingFileHandler）
+    - 執行緒安全（多工作站可共用同一個 sink）
+    """
+    def __init__(self, path, fmt=None, buffer=256, max_bytes=32 << 20, backups=5):
+        self.path = path
+        self.fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+        if self.fmt not in ("jsonl", "csv"):
+            raise ValueError(f"unknown event format: {self.fmt}")
+        self.buffer = max(1, int(buffer))
+        self.max_bytes = int(max_bytes)
+        self.backups = max(1, int(backups))
+        self.written = 0
+        self._buf = []
+        self._f = None
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def emit(self, record):
+        with self._lock:
+            self._buf.append(record)
+            if len(self._buf) >= self.buffer:
+                self._write_locked()
+
+    def _open(self):
+        self._f = open(self.path, "a", encoding="utf-8", newline="")
+        if self.fmt == "csv" and self._f.tell() == 0:
+            csv.writer(self._f).writerow(REP_EVENT_FIELDS)
+
+    def _write_locked(self):
+        if not self._buf:
+            return
+        if self._f is None:
+            self._open()
+        if self.fmt == "csv":
+            csv.DictWriter(self._f, REP_EVENT_FIELDS, extrasaction="ignore").writerows(self._buf)
+        else:
+            self._f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in self._buf))
+        self._f.flush()
+        self.written += len(self._buf)
+        self._buf = []
+        if self._f.tell() >= self.max_bytes:
+            self._rotate_locked()
+
+    def _rotate_locked(self):
+        self._f.close()
+        self._f = None
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def flush(self):
+        with self._lock:
+            self._write_locked()
+
+    def close(self):
+        with self._lock:
+            self._write_locked()
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+
+class RepEventLog:
+    """
+    把一個 detector 的回合結果送進 RepEventSink。
+    fields 為固定欄位（video / action / station ...）；管線每幀以 at(idx, t) 更新目前位置，
+    frame 記為 frame_offset + idx（從影片中間開始時仍是原始影片幀號）。
+    """
+    def __init__(self, sink, frame_offset=0, **fields):
+        self.sink = sink
+        self.frame_offset = int(frame_offset)
+        self.fields = fields
+        self.frame = self.t = None
+
+    def at(self, idx, t):
+        self.frame, self.t = self.frame_offset + idx, t
+
+    def rep(self, **rec):
+        rec = {k: (round(v, 3) if isinstance(v, float) else v) for k, v in rec.items()}
+        self.sink.emit(dict(self.fields, frame=self.frame, t=None if self.t is None else round(self.t, 3), **rec))
+
+
+class _RingMean:
+    """
+    固定大小環形緩衝 + 累計和：每次 push 為 O(K)，不必重新加總整個視窗。
+    累計和的浮點誤差會隨 push 次數累積（長時間錄影會漂移），所以每繞一圈（size 次 push）
+    以緩衝依時間順序重新加總一次；_trailing_mean 以同樣的分段方式計算，結果逐位元一致。
+    """
+    __slots__ = ("buf", "total", "n", "i")
+
+    def __init__(self, size, shape):
+        self.buf = np.zeros((size,) + shape)
+        self.total = np.zeros(shape)
+        self.n = 0
+        self.i = 0
+
+    def push(self, p):
+        if self.n == len(self.buf):
+            self.total += p - self.buf[self.i]      # 加入新值、扣掉被擠出的舊值（_trailing_mean 同一順序）
+        else:
+            self.total += p
+            self.n += 1
+        self.buf[self.i] = p
+        self.i = (self.i + 1) % len(self.buf)
+        if self.i == 0:     # 剛繞完一圈：buf[0..size) 正好依時間順序
+            self.total = np.add.accumulate(self.buf, axis=0)[-1]
+        return self.total / self.n
+
+
+class _OneEuro:
+    __slots__ = ("x", "dx", "t")
+
+    def __init__(self):
+        self.x = self.dx = self.t = None
 
 
 class LandmarkSmoother:
-    def __init__(self, smoothing_size=5):
-        self.smoothing_size = smoothing_size
-        self.right_hip_history, self.right_knee_history, self.right_ankle_history = [], [], []
-        self.left_hip_history, self.left_knee_history, self.left_ankle_history = [], [], []
-
-    def _smooth(self, hist, p):
-        if p is None:
-            return p
-        hist.append(p)
-        if len(hist) > self.smoothing_size:
-            hist.pop(0)
-        xs = [q[0] for q in hist]
-        ys = [q[1] for q in hist]
-        return [sum(xs) / len(xs), sum(ys) / len(ys)]
-
-    def smooth_right_leg(self, hip, knee, ankle):
-        return self._smooth(self.right_hip_history, hip), \
-               self._smooth(self.right_knee_history, knee), \
-               self._smooth(self.right_ankle_history, ankle)
-
-    def smooth_left_leg(self, hip, knee, ankle):
-        return self._smooth(self.left_hip_history, hip), \
-               self._smooth(self.left_knee_history, knee), \
-               self._smooth(self.left_ankle_history, ankle)
+    """
+    關鍵點平滑；每個 key（如 "left" / "right"）一組獨立歷史，一次處理該組全部關節 (K, 2)。
+    - mode="mean"：最近 smoothing_size 幀的移動平均（環形緩衝 + 累計和）
+    - mode="one_euro"：One-Euro 濾波；移動越快截止頻率越高，靜止時去抖、深蹲底部轉折延遲較小。
+      min_cutoff / beta / d_cutoff 以正規化座標／秒計；沒有時間戳時以 1/fps 為間隔。
+    """
+    MODES = ("mean", "one_euro")
+
+    def __init__(self, smoothing_size=5, mode="mean", fps=30.0, min_cutoff=1.0, beta=10.0, d_cutoff=1.0):
+        if mode not in self.MODES:
+            raise ValueError(f"unknown smoothing mode: {mode}")
+        self.smoothing_size = int(smoothing_size)
+        self.mode = mode
+        self.fps = float(fps)
+        self.min_cutoff, self.beta, self.d_cutoff = float(min_cutoff), float(beta), float(d_cutoff)
+        self._state = {}
+
+    def clone_empty(self):
+        """同參數、沒有歷史的新 smoother。"""
+        return LandmarkSmoother(self.smoothing_size, self.mode, self.fps, self.min_cutoff, self.beta, self.d_cutoff)
+
+    def reset(self):
+        self._state.clear()
+
+    def smooth(self, key, pts, t=None):
+        """pts: (K, 2)（串列或陣列）；t: 時間戳（秒，one_euro 用）。回傳平滑後 (K, 2) float64 陣列。"""
+        p = np.asarray(pts, dtype=np.float64)
+        st = self._state.get(key)
+        if self.mode == "mean":
+            if st is None:
+                st = self._state[key] = _RingMean(self.smoothing_size, p.shape)
+            return st.push(p)
+        if st is None:
+            st = self._state[key] = _OneEuro()
+        return self._one_euro(st, p, t)
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        r = 2.0 * math.pi * cutoff * dt
+        return r / (r + 1.0)
+
+    def _one_euro(self, st, p, t):
+        if st.x is None:
+            st.x, st.dx, st.t = p.copy(), np.zeros_like(p), t
+            return st.x.copy()
+        dt = 1.0 / self.fps if (t is None or st.t is None or t <= st.t) else (t - st.t)
+        st.t = t
+        a_d = self._alpha(self.d_cutoff, dt)
+        st.dx = a_d * ((p - st.x) / dt) + (1.0 - a_d) * st.dx
+        a = self._alpha(self.min_cutoff + self.beta * np.abs(st.dx), dt)
+        st.x = a * p + (1.0 - a) * st.x
+        return st.x.copy()
 
 
 # =====================================
@@ -416,7 +1146,7 @@ class SquatKneeAngleThresholdDetector:
                  succ_min_deg=95.0, succ_max_deg=135.0,
                  fail_min_deg=136.0, fail_max_deg=162.0,
                  ema_alpha=0.35, standard_deg=135.0,  # standard_deg 只用於顯示
-                 vis_thr=0.6, smooth_N=5):
+                 vis_thr=0.6, smooth_N=5, smooth_mode="mean", euro_min_cutoff=1.0, euro_beta=10.0):
         
         self.stand_up_deg = float(stand_up_deg)
         self.succ_min_deg, self.succ_max_deg = float(succ_min_deg), float(succ_max_deg)
@@ -438,7 +1168,10 @@ class SquatKneeAngleThresholdDetector:
         self.touched_success = False
         self.touched_fail = False
 
-        self.landmark_smoother = LandmarkSmoother(smoothing_size=self.SMOOTHING_SIZE)
+        # smooth_mode="one_euro" 時 euro_* 為 One-Euro 參數；取樣率由 make_detector 設為來源 fps
+        self.landmark_smoother = LandmarkSmoother(smoothing_size=self.SMOOTHING_SIZE, mode=smooth_mode,
+                                                  min_cutoff=euro_min_cutoff, beta=euro_beta)
+        self.events = None      # RepEventLog；設定後回合結果寫檔，不再 print
             
     def draw_overlay(self, frame, W, H):
         try:
@@ -459,26 +1192,41 @@ class SquatKneeAngleThresholdDetector:
         except Exception:
             return frame
             
-    def _best_knee_triplet(self, landmarks):
-        lk = landmarks[mp_pose.PoseLandmark.LEFT_KNEE.value] if landmarks else None
-        rk = landmarks[mp_pose.PoseLandmark.RIGHT_KNEE.value] if landmarks else None
-        lv = lk.visibility if lk is not None else 0.0
-        rv = rk.visibility if rk is not None else 0.0
-        side = "left" if lv >= rv else "right"
-        def L(name):
-            idx = getattr(mp_pose.PoseLandmark, f"{side.upper()}_{name}".upper()).value
-            p = landmarks[idx]
-            return [p.x, p.y]
-        hip = L("hip"); knee = L("knee"); ankle = L("ankle")
-        return side, hip, knee, ankle
-
-    def process_frame(self, landmarks, frame, W, H):
+    # (hip, knee, ankle) 關鍵點索引
+    LEG_IDS = {"left": [23, 25, 27], "right": [24, 26, 28]}
+
+    def calibration(self):
+        """深蹲不需校正（介面同 CalfRaiseDetector）。"""
+        return {}
+
+    def seed_calibration(self, calib):
+        pass
+
+    def _best_knee_side(self, landmarks):
+        """landmarks: LandmarkFrame；取膝蓋可見度較高的一側。"""
+        vis = landmarks.norm[:, 3]
+        return "left" if vis[25] >= vis[26] else "right"
+
+    def is_idle(self, landmarks, W, H, margin_deg=6.0):
+        """
+        可降低推論頻率的狀態（AdaptivePoseScheduler 用，不更新任何狀態）：
+        未在回合中，且平滑膝角與本幀膝角都比入回合門檻 fail_max_deg 高出 margin_deg 以上（站直）。
+        """
+        gate = self.fail_max_deg + margin_deg
+        if self.in_rep or (self.prev_deg is not None and self.prev_deg < gate):
+            return False
         try:
-            side, hip, knee, ankle = self._best_knee_triplet(landmarks)
-            if side == "left":
-                hip, knee, ankle = self.landmark_smoother.smooth_left_leg(hip, knee, ankle)
-            else:
-                hip, knee, ankle = self.landmark_smoother.smooth_right_leg(hip, knee, ankle)
+            side = self._best_knee_side(landmarks)
+            return bool(landmarks.angles()["knee_" + side] >= gate)
+        except Exception:
+            return False
+
+    def process_frame(self, landmarks, frame, W, H, t=None):
+        """landmarks: LandmarkFrame。t: 擷取時刻（秒）；只有 One-Euro 平滑會用到。"""
+        try:
+            side = self._best_knee_side(landmarks)
+            hip, knee, ankle = self.landmark_smoother.smooth(
+                side, landmarks.norm[self.LEG_IDS[side], :2], t=t).tolist()
 
             raw = calculate_angle(hip, knee, ankle)
 
@@ -513,8 +1261,11 @@ class SquatKneeAngleThresholdDetector:
                     else:
                         outcome = "IGNORED"
 
-                    print(f"[SQUAT LOG] min={self.min_angle_this_rep:.1f}°  outcome={outcome}  "
-                        f"succ={self.success}  fail={self.fail}")
+                    if self.events is not None:
+                        self.events.rep(side=side, outcome=outcome, min_deg=self.min_angle_this_rep)
+                    else:
+                        print(f"[SQUAT LOG] min={self.min_angle_this_rep:.1f}°  outcome={outcome}  "
+                            f"succ={self.success}  fail={self.fail}")
 
                     # 重置回合
                     self.in_rep = False
@@ -522,6 +1273,9 @@ class SquatKneeAngleThresholdDetector:
                     self.touched_success = False
                     self.touched_fail = False
 
+            if frame is None:   # 純分析（關鍵點重播）：不畫圖
+                return frame
+
             # 疊圖（保留你原本的資訊塊格式）
             total = self.success + self.fail
             rate = (self.success / total * 100.0) if total > 0 else 0.0
@@ -542,6 +1296,10 @@ class SquatKneeAngleThresholdDetector:
         total = self.success + self.fail
         return self.success, self.fail, total
 
+    def hud_values(self):
+        """(狀態, HUD 角度或 None)：延後疊圖側檔逐幀記錄用。"""
+        return ("IN-REP" if self.in_rep else "IDLE"), self.prev_deg
+
 
 # =============================================
 # 動作 2：提踵（地面參考 toe→heel 角 + 分級）
@@ -568,7 +1326,7 @@ class CalfSide:
                  fail_min_deg=5.0, fail_max_deg=7.4,
                  hold_seconds=3.0, angle_noise_max=60.0, idle_threshold=8.0,
                  ema_alpha=0.35, calib_frames=20, calib_jitter_px=4.0,
-                 enforce_toe_ground=False, toe_ground_max_h=6.0):
+                 enforce_toe_ground=False, toe_ground_max_h=6.0, raise_enter_deg=15.0):
         """
         enforce_toe_ground: True 時，若 toe 也離基準線過遠，暫停本回合計數（避免前腳掌離地 / 跳步）
         toe_ground_max_h: toe 到基準線的最大允許垂距（像素）
@@ -595,13 +1353,14 @@ class CalfSide:
         self.rest_frames = 0         # 連續處於「休息」（低角度）狀態的幀數
         self.can_raise = False       # 是否允許進入 RAISING（必須先休息夠久才 True）
         # Robust gating
-        self.RAISE_ENTER_DEG = 15.0  # between fail and success
+        self.RAISE_ENTER_DEG = raise_enter_deg  # between fail and success
         self.MIN_RISE_FRAMES = 4
         
         
         # ===== 新增：每回合紀錄與流水號 =====
         self.rep_base_deg = 0.0   # 進入 RAISING 當下的「基準角度」
         self.rep_id = 0          # 流水號
+        self.events = None       # RepEventLog；設定後回合結果寫檔，不再 print
         self.reset(hard=True)
 
     # ---------- public APIs ----------
@@ -609,6 +1368,10 @@ class CalfSide:
     def _log_outcome(self, kind: str, fps: float):
         self.rep_id += 1
         hold_s = self.hold_frames / max(1.0, fps)
+        if self.events is not None:
+            self.events.rep(side=self.side, rep=self.rep_id, outcome=kind, base_deg=float(self.rep_base_deg),
+                            peak_deg=float(self.rep_peak_deg), hold_s=hold_s)
+            return
         print(
             f"[CALF LOG] #{self.rep_id:03d} "
             f"base={self.rep_base_deg:.1f}°  "
@@ -637,12 +1400,16 @@ class CalfSide:
 
 
 
-    def feed(self, lms, W, H, fps):
-        """每幀呼叫：lms=results.pose_landmarks.landmark, W/H 影像大小, fps 幀率"""
+    def feed(self, lms, W, H, fps, dt=None):
+        """
+        每幀呼叫：lms=LandmarkFrame（像素座標取 lms.px）, W/H 影像大小, fps 幀率。
+        dt: 與上一幀的實際間隔（秒，即時擷取時刻差）；提供時保持計時依實際時間累加
+        （hold_frames 以 fps 換算成「等效幀數」），掉幀也不會讓保持秒數變短。
+        """
+        step = 1 if dt is None else dt * fps
+        HOLD_EPS = 1e-6     # dt 累加的浮點誤差（逐幀計數時 hold_frames 為整數，不受影響）
         idx_toe, idx_heel = self._idxs()
-        toe  = lms[idx_toe]; heel = lms[idx_heel]
-        toe_px  = (toe.x * W,  toe.y * H)
-        heel_px = (heel.x * W, heel.y * H)
+        toe_px, heel_px = map(tuple, lms.px[[idx_toe, idx_heel]].tolist())
 
         # ----- Calibration: build baseline when toe/heel vertical jitter is small -----
         if not self.baseline_ready:
@@ -690,7 +1457,7 @@ class CalfSide:
                 # suspend this frame's counting (keep state but don't progress)
                 return self._ema(0.0), self._dbg(fps, h_heel=h_heel, h_toe=h_toe, suspended=True)
 
-        theta = math.degrees(math.atan2(h_heel, self.L))
+        theta = float(np.degrees(np.arctan2(h_heel, self.L)))   # 與 score_calf() 的向量版同一實作
         if theta > self.ANGLE_NOISE_MAX:
             theta = self.ANGLE_NOISE_MAX
 
@@ -745,7 +1512,7 @@ class CalfSide:
             # 1) 進入成功區 → 切到 HOLDING，開始用 hold_frames 計時
             if deg >= self.SUCCESS_MIN_DEG:
                 self.state = "HOLDING"
-                self.hold_frames = 1
+                self.hold_frames = step
                 self.entered_success_zone = True
                 self.rep_peak_deg = max(self.rep_peak_deg, deg)
             else:
@@ -754,7 +1521,7 @@ class CalfSide:
 
                 # 2a) 小幅度區 (5~7.4°)：在 RAISING 也要計「維持幀數」
                 if self.FAIL_MIN_DEG <= deg <= self.FAIL_MAX_DEG:
-                    self.hold_frames += 1
+                    self.hold_frames += step
                 else:
                     # 只要離開小幅度區，清零小幅度的 hold 計數（避免斷續堆疊）
                     self.hold_frames = 0
@@ -763,7 +1530,7 @@ class CalfSide:
                 if deg < self.IDLE_THRESHOLD:
                     if (not self.outcome_done) and (not self.entered_success_zone) and (self.raising_frames >= self.MIN_RISE_FRAMES):
                         need = int(self.HOLD_SECONDS * fps)
-                        if (self.FAIL_MIN_DEG <= self.rep_peak_deg <= self.FAIL_MAX_DEG) and (self.hold_frames >= need):
+                        if (self.FAIL_MIN_DEG <= self.rep_peak_deg <= self.FAIL_MAX_DEG) and (self.hold_frames >= need - HOLD_EPS):
                             self.rep_fail += 1
                             self._log_outcome("FAIL_SMALL_KEPT", fps)
                             self.outcome_done = True
@@ -776,12 +1543,12 @@ class CalfSide:
 
         elif self.state == "HOLDING":
             if deg >= self.SUCCESS_MIN_DEG:
-                self.hold_frames += 1
+                self.hold_frames += step
             else:
                 # 離開成功區（放下） → 只結算一次
                 need = int(self.HOLD_SECONDS * fps)
                 if not self.outcome_done:
-                    if (self.hold_frames >= need) and (self.SUCCESS_MIN_DEG <= self.rep_peak_deg <= self.SUCCESS_MAX_DEG):
+                    if (self.hold_frames >= need - HOLD_EPS) and (self.SUCCESS_MIN_DEG <= self.rep_peak_deg <= self.SUCCESS_MAX_DEG):
                         # 規則(成功)：7.5~45° 持續≥3s
                         self.rep_success += 1
                         self._log_outcome("SUCCESS", fps)
@@ -806,6 +1573,32 @@ class CalfSide:
 
         return deg, self._dbg(fps, h_heel=h_heel, h_toe=h_toe)
 
+    def is_idle(self, lms, W, H, margin_deg=3.0):
+        """
+        可降低推論頻率的狀態（不更新任何狀態）：已校正、處於 IDLE / COOLDOWN，
+        EMA 與本幀腳跟角都比休息門檻低 margin_deg 以上，且前腳掌貼地。
+        """
+        if not self.baseline_ready or self.state not in ("IDLE", "COOLDOWN"):
+            return False
+        gate = self.IDLE_THRESHOLD - margin_deg
+        if self.ema_deg is not None and self.ema_deg > gate:
+            return False
+        ax, ay = self.toe_base_px
+        bx, by = self.heel_base_px
+        AB = math.hypot(bx - ax, by - ay)
+        if AB < 1.0:
+            return False
+
+        idx_toe, idx_heel = self._idxs()
+        (tx, ty), (hx, hy) = lms.px[[idx_toe, idx_heel]].tolist()
+
+        def h(px, py):   # 到基準線的垂距（像素），同 feed()
+            return abs((px - ax) * (by - ay) - (py - ay) * (bx - ax)) / AB
+
+        if self.ENFORCE_TOE_GROUND and h(tx, ty) > self.TOE_GROUND_MAX_H:
+            return False
+        return math.degrees(math.atan2(h(hx, hy), self.L)) <= gate
+
     # ---------- helpers ----------
     def _idxs(self):
         if self.side == "left":
@@ -855,15 +1648,22 @@ class CalfRaiseDetector:
     改版：以基準腳底線 + heel 垂距角 θ=atan2(h/L)。
     成功 20–90° 且連續 ≥3 秒；失敗 10–<20°（且 RAISING 至少 MIN_RISE_FRAMES 幀）。
     """
-    def __init__(self, A_min=20.0, A_max=90.0, hold_seconds=3.0, ema_alpha=0.35, standard_deg=None):
+    MAX_GAP_S = 0.25    # 擷取時刻差超過此值視為中斷
+
+    def __init__(self, A_min=20.0, A_max=90.0, hold_seconds=3.0, ema_alpha=0.35, standard_deg=None,
+                 raise_enter_deg=15.0, calib_frames=45):
         self.A_min = float(A_min)
         self.A_max = float(A_max)
         self.hold_seconds = float(hold_seconds)
         self.alpha = float(ema_alpha)
         self.standard_deg = float(standard_deg) if (standard_deg is not None) else (0.5 * (self.A_min + self.A_max))
+        self.raise_enter_deg = float(raise_enter_deg)
+        self.calib_frames = int(round(calib_frames))
         self.side = None
         self._t_last = None
+        self._t_cap = None      # 上一幀的擷取時刻（process_frame 有給 t 時）
         self.calf = None
+        self.events = None      # RepEventLog；選邊時交給 CalfSide
         self.fixed_fps = None   # ← 新增：若外部已知來源 fps，就填進來用它
         self.last_info = {'state': 'CALIB', 'deg': None, 'hold_s': 0.0, 'ok': 0, 'ng': 0, 'baseline_ready': False, 'L_px': None}
 
@@ -877,32 +1677,70 @@ class CalfRaiseDetector:
         self._t_last = t
         return dt
 
-    def _pick_side(self, ld):
-        def score(side):
+    def _pick_side(self, norm):
+        """norm: (33, 4) 關鍵點陣列；取 heel + foot_index 可見度總和較高的一側。"""
+        vis = norm[:, 3].tolist()
+        def score(heel, toe):
             s = 0.0
-            for k in (f"{side}_heel", f"{side}_foot_index"):
-                p = ld.get(k)
-                s += (p[3] if (p and len(p) >= 4 and p[3] is not None) else 0.0)
+            for i in (heel, toe):
+                s += vis[i]
             return s
-        return "left" if score("left") >= score("right") else "right"
+        return "left" if score(L_HEEL, L_TOE) >= score(R_HEEL, R_TOE) else "right"
+
+    def calibration(self):
+        """已建立腳底基準時回傳 {"side", "toe_base_px", "heel_base_px", "L"}（可交給 seed_calibration）；否則 None。"""
+        c = self.calf
+        if c is None or not c.baseline_ready:
+            return None
+        return {"side": self.side, "toe_base_px": list(c.toe_base_px), "heel_base_px": list(c.heel_base_px),
+                "L": float(c.L)}
 
-    def process_frame(self, landmarks, frame, W, H):
+    def seed_calibration(self, calib):
+        """
+        直接採用別處建立的腳底基準，不再自行校正（長影片分塊處理：後面各塊沿用從影片開頭校正的結果，
+        與從頭逐幀跑時相同）。需在 events 設定之後呼叫。
+        """
+        self.side = calib["side"]
+        self.calf = c = self._make_side(self.side)
+        c.events = self.events
+        c.toe_base_px, c.heel_base_px = tuple(calib["toe_base_px"]), tuple(calib["heel_base_px"])
+        c.L = float(calib["L"])
+        c.baseline_ready, c.state, c.calib_deg = True, "IDLE", 0.0
+
+    def _make_side(self, side):
+        return CalfSide(side,
+                        success_min_deg=self.A_min, success_max_deg=self.A_max,
+                        fail_min_deg=5.0, fail_max_deg=7.4,     # ←← 正確
+                        hold_seconds=self.hold_seconds, ema_alpha=self.alpha,
+                        idle_threshold=8.0,
+                        enforce_toe_ground=True,
+                        calib_frames=self.calib_frames, calib_jitter_px=6.0,
+                        raise_enter_deg=self.raise_enter_deg)
+
+    def process_frame(self, landmarks, frame, W, H, t=None):
+        """
+        landmarks: LandmarkFrame。
+        t: 擷取時刻（秒，即時模式）；提供時保持秒數依實際時間累加，不受掉幀影響。
+        """
         try:
-            ld = get_landmark_dict(landmarks)
             if self.side is None:
-                self.side = self._pick_side(ld)
-                self.calf = CalfSide(self.side,
-                     success_min_deg=self.A_min, success_max_deg=self.A_max,
-                     fail_min_deg=5.0, fail_max_deg=7.4,     # ←← 正確
-                     hold_seconds=self.hold_seconds, ema_alpha=self.alpha,
-                     idle_threshold=8.0,
-                     enforce_toe_ground=True,
-                     calib_frames=45, calib_jitter_px=6.0)
+                self.side = self._pick_side(landmarks.norm)
+                self.calf = self._make_side(self.side)
+                self.calf.events = self.events
             # 若外部有提供固定 fps（攝影機或影片檔），優先用它；否則退回 Δt 估計
             fps_used = (self.fixed_fps if (self.fixed_fps and self.fixed_fps > 0) 
                         else 1.0 / max(1e-3, self._dt()))
-            deg, info = self.calf.feed(landmarks, W, H, fps_used)
+            dt = None
+            if t is not None:
+                if self._t_cap is not None:
+                    dt = t - self._t_cap
+                    if not (0.0 <= dt <= self.MAX_GAP_S):   # 人離開畫面等長間隔：只算一幀，不灌進保持時間
+                        dt = 1.0 / fps_used
+                self._t_cap = t
+            deg, info = self.calf.feed(landmarks, W, H, fps_used, dt=dt)
             self.last_info = info if isinstance(info, dict) else self.last_info
+            if frame is None:   # 純分析（關鍵點重播）：不畫圖
+                return frame
 
             # 上方主 HUD
             total = info['ok'] + info['ng']
@@ -932,8 +1770,8 @@ class CalfRaiseDetector:
             if self.calf:
                 if self.side == "left": toe_idx, heel_idx = 31, 29
                 else: toe_idx, heel_idx = 32, 30
-                toe, heel = landmarks[toe_idx], landmarks[heel_idx]
-                toe_pt, heel_pt  = (int(toe.x*W), int(toe.y*H)), (int(heel.x*W), int(heel.y*H))
+                (tx, ty), (hx, hy) = landmarks.px[[toe_idx, heel_idx]].tolist()
+                toe_pt, heel_pt  = (int(tx), int(ty)), (int(hx), int(hy))
                 cv2.circle(frame, toe_pt, 5, (0,255,255), -1)
                 cv2.circle(frame, heel_pt, 5, (255,255,0), -1)
                 if self.calf.baseline_ready:
@@ -959,6 +1797,10 @@ class CalfRaiseDetector:
             pass
         return frame
 
+    def is_idle(self, landmarks, W, H):
+        """尚未選邊 / 校正中一律視為忙碌（校正需要每幀的真實抖動）。"""
+        return self.calf is not None and self.calf.is_idle(landmarks, W, H)
+
     def draw_overlay(self, frame, W, H):
         info = getattr(self, "last_info", None) or {}
         angle_txt = "--" if (info.get('deg') is None) else f"{info['deg']:.1f}°"
@@ -992,11 +1834,284 @@ class CalfRaiseDetector:
         total = ok + ng
         return ok, ng, total
 
+    def hud_values(self):
+        info = getattr(self, "last_info", None) or {}
+        return info.get("state", "?"), info.get("deg")
+
+# ===============================
+# 離線整段評分（向量化，與逐幀 detector 結果一致）
+# ===============================
+# 關鍵點已在手（PoseTrack / (T, 33, 4) 陣列）時，不必逐幀呼叫 process_frame：
+# 角度、EMA、回合邊界都以陣列運算求得。所有浮點運算與逐幀版相同順序，
+# 因此成功/失敗回合清單與 replay_pose_track() 完全一致。
+
+def _ema_series(v, alpha):
+    """
+    逐位元等同逐幀 `e = alpha*v + (1-alpha)*e` 的 EMA（第一幀 e=v）。
+    遞迴式無法在不改變捨入的前提下向量化，這裡用 itertools.accumulate 逐項計算。
+    """
+    a, b = alpha, (1 - alpha)
+    return np.fromiter(itertools.accumulate(np.asarray(v, dtype=np.float64).tolist(),
+                                            lambda e, x: a * x + b * e), dtype=np.float64, count=len(v))
+
+
+def _trailing_mean(seq, n):
+    """
+    LandmarkSmoother（mean）的向量版：每列取「含自己在內最近 n 列」的平均。
+    與 _RingMean 同樣分成每 n 列一段：段首從上一段重新加總的視窗和起算，逐列累加 (新值 − 被擠出的舊值)，
+    段尾再以該段依序重新加總；np.add.accumulate 依序相加，逐位元一致。
+    """
+    x = np.asarray(seq, dtype=np.float64)
+    M = len(x)
+    B = -(-M // n)
+    seg = np.zeros((B * n,) + x.shape[1:])
+    seg[:M] = x
+    seg = seg.reshape((B, n) + x.shape[1:])
+    total = np.add.accumulate(seg, axis=1)      # 第 0 段即累計和；total[k, -1] 為第 k 段重新加總的視窗和
+    if B > 1:
+        d = np.concatenate([total[:-1, -1:], seg[1:] - seg[:-1]], axis=1)
+        total[1:, :-1] = np.add.accumulate(d, axis=1)[:, 1:-1]
+    return total.reshape((B * n,) + x.shape[1:])[:M] / np.minimum(np.arange(1, M + 1), n)[:, None]
+
+
+def _score_result(reps):
+    ok = sum(1 for r in reps if r["outcome"] == "SUCCESS")
+    ng = sum(1 for r in reps if r["outcome"].startswith("FAIL"))
+    return {"success": ok, "fail": ng, "total": ok + ng, "reps": reps}
+
+
+def _first_index(mask_fn, n, start, chunk=256):
+    """mask_fn(lo, hi) 回傳 [lo, hi) 的布林遮罩；分段（倍增）找出 >= start 的第一個 True，找不到回傳 None。"""
+    lo = start
+    while lo < n:
+        hi = min(n, lo + chunk)
+        nz = np.flatnonzero(mask_fn(lo, hi))
+        if len(nz):
+            return lo + int(nz[0])
+        lo, chunk = hi, chunk * 2
+    return None
+
+
+def score_squat(lms, detector=None, frames=None):
+    """
+    深蹲整段評分。lms: (N, 33, 4) 有偵測到人的幀（即 detector 實際會收到的幀）；
+    frames: 對應的原始幀號（預設 0..N-1）。參數取自 detector（預設同 make_detector）。
+    回傳 {"success", "fail", "total", "reps": [{"frame", "side", "outcome", "min_deg"}]}。
+    """
+    det = detector or make_detector("squat_hip_height", 30.0)[0]
+    N = len(lms)
+    frames = np.arange(N) if frames is None else np.asarray(frames)
+    if N == 0:
+        return _score_result([])
+
+    left_ids, right_ids = det.LEG_IDS["left"], det.LEG_IDS["right"]
+    pts = np.asarray(lms)[:, left_ids + right_ids].astype(np.float64)     # 只轉需要的 6 個點
+    left = pts[:, 1, 3] >= pts[:, 4, 3]
+    legs = np.empty((N, 3, 2))
+    sm = det.landmark_smoother
+    for side, mask, cols in (("left", left, slice(0, 3)), ("right", ~left, slice(3, 6))):
+        # 兩腳各自一組平滑歷史，只在被選中的幀更新
+        seq = pts[mask, cols, :2]
+        if not len(seq):
+            continue
+        if sm.mode == "mean":
+            legs[mask] = _trailing_mean(seq.reshape(-1, 6), sm.smoothing_size).reshape(-1, 3, 2)
+        else:       # One-Euro 為遞迴濾波，逐幀跑一個同參數的新 smoother
+            ref = sm.clone_empty()
+            legs[mask] = [ref.smooth(side, p) for p in seq]
+    raw = joint_angles_deg(legs[:, 0], legs[:, 1], legs[:, 2])
+    cur = _ema_series(raw, det.alpha)
+
+    # 遲滯：cur<=fail_max 進入回合、cur>=stand_up 結算；兩者都成立的幀視為單幀回合
+    enter = cur <= det.fail_max_deg
+    leave = cur >= det.stand_up_deg
+    last = np.where(enter | leave, np.arange(N), -1)
+    np.maximum.accumulate(last, out=last)
+    after = np.where(last >= 0, (enter & ~leave)[np.maximum(last, 0)], False)
+    before = np.concatenate(([False], after[:-1]))
+    during = before | enter
+    starts = np.flatnonzero(during & ~before)
+    ends = np.flatnonzero(during & leave)
+    starts = starts[:len(ends)]                 # 最後一個未站回的回合不結算
+
+    succ = (det.succ_min_deg <= cur) & (cur <= det.succ_max_deg)
+    fail = (det.fail_min_deg <= cur) & (cur <= det.fail_max_deg)
+    cs_s = np.concatenate(([0], np.cumsum(succ)))
+    cs_f = np.concatenate(([0], np.cumsum(fail)))
+    bounds = np.empty(2 * len(starts), dtype=np.intp)
+    bounds[0::2], bounds[1::2] = starts, ends + 1
+    mins = np.minimum.reduceat(np.append(cur, np.inf), bounds)[0::2] if len(starts) else []
+
+    reps = []
+    for s, e, m in zip(starts.tolist(), ends.tolist(), list(mins)):
+        if cs_s[e + 1] > cs_s[s]:
+            outcome = "SUCCESS"
+        elif cs_f[e + 1] > cs_f[s]:
+            outcome = "FAIL_RANGE_136_162"
+        else:
+            outcome = "IGNORED"
+        reps.append({"frame": int(frames[e]), "side": "left" if left[e] else "right", "outcome": outcome,
+                     "min_deg": float(m)})
+    return _score_result(reps)
+
+
+def score_calf(lms, W, H, fps, detector=None, frames=None):
+    """
+    提踵整段評分。lms/frames 同 score_squat；W/H 為關鍵點換算像素的畫面大小，fps 為來源 fps。
+    回傳 {"success", "fail", "total", "reps": [{"frame", "side", "rep", "outcome", "base_deg", "peak_deg", "hold_s"}]}。
+    """
+    det = detector or make_detector("calf_raise", fps)[0]
+    lms = np.asarray(lms)
+    N = len(lms)
+    frames = np.arange(N) if frames is None else np.asarray(frames)
+    if N == 0:
+        return _score_result([])
+
+    side = det._pick_side(lms[0])
+    cs = det._make_side(side)
+    toe_i, heel_i = cs._idxs()
+    foot = lms[:, [toe_i, heel_i], :2].astype(np.float64)
+    tx, ty = foot[:, 0, 0] * W, foot[:, 0, 1] * H
+    hx, hy = foot[:, 1, 0] * W, foot[:, 1, 1] * H
+
+    # ----- 校正：滑動視窗內 toe/heel 垂直抖動都小於門檻的第一個視窗 -----
+    CF = cs.CALIB_FRAMES
+    win = np.lib.stride_tricks.sliding_window_view
+
+    def still(lo, hi):                          # 以 [lo, hi) 各幀結尾的視窗
+        sl = slice(lo - CF + 1, hi)
+        return ((np.ptp(win(hy[sl], CF), axis=1) < cs.CALIB_JITTER_PX) &
+                (np.ptp(win(ty[sl], CF), axis=1) < cs.CALIB_JITTER_PX))
+
+    mid, q0, b0 = CF // 2, 0, None
+    while True:
+        e = _first_index(still, N, q0 + CF - 1)   # q0：佇列（重新）開始累積的幀
+        if e is None:
+            break
+        sl = slice(e - CF + 1, e + 1)
+        heel_base = (float(np.sort(hx[sl])[mid]), float(np.sort(hy[sl])[mid]))
+        toe_base = (float(np.sort(tx[sl])[mid]), float(np.sort(ty[sl])[mid]))
+        L = cs._dist(toe_base, heel_base)
+        if L >= 1.0:
+            b0 = e
+            break
+        q0 = e + 1
+    if b0 is None:
+        return _score_result([])
+
+    # ----- 基準建立後：heel 到基準線的垂距角（與 CalfSide.feed 相同的運算） -----
+    ax, ay = toe_base
+    bx, by = heel_base
+    ABx, ABy = (bx - ax), (by - ay)
+    AB = math.hypot(ABx, ABy)
+    hx, hy, tx, ty, frames = hx[b0 + 1:], hy[b0 + 1:], tx[b0 + 1:], ty[b0 + 1:], frames[b0 + 1:]
+    h_heel = np.abs((hx - ax) * ABy - (hy - ay) * ABx) / AB
+    if cs.ENFORCE_TOE_GROUND:
+        susp = np.abs((tx - ax) * ABy - (ty - ay) * ABx) / AB > cs.TOE_GROUND_MAX_H
+    else:
+        susp = np.zeros(len(hx), dtype=bool)
+    theta = np.minimum(np.degrees(np.arctan2(h_heel, L)), cs.ANGLE_NOISE_MAX)
+    v = np.where(susp, 0.0, theta)              # 暫停計數的幀仍以 0° 更新 EMA
+    deg = _ema_series(v, cs.EMA_ALPHA)
+    act = np.flatnonzero(~susp)                 # 會走到狀態機的幀
+    d = deg[act]
+    A = len(act)
+
+    a, bcoef = cs.EMA_ALPHA, (1 - cs.EMA_ALPHA)
+    REST_NEED = max(3, int(0.20 * fps))
+    need = int(cs.HOLD_SECONDS * fps)
+    C = max(1, int(0.15 * fps))
+
+    def cooldown_patch(k_first, k_last):
+        """
+        COOLDOWN 倒數幀在逐幀版中會再做一次 _ema(ema)（數值可能差 1 ulp），
+        從該處往後重算 EMA，直到與原序列逐位元重合為止（通常只需數幀）。
+        """
+        blend = set(act[k_first:k_last + 1].tolist())
+        last_blend = max(blend)
+        i = int(act[k_first])
+        e = deg[i - 1]
+        n = len(deg)
+        while i < n:
+            x = a * v[i] + bcoef * e
+            if i > last_blend and x == deg[i]:
+                break
+            deg[i] = x
+            e = (a * x + bcoef * x) if i in blend else x
+            i += 1
+        lo, hi = np.searchsorted(act, [act[k_first], i])
+        d[lo:hi] = deg[act[lo:hi]]
+
+    def rest_ready(lo, hi, start):
+        # 自 start 起連續 REST_NEED 幀 deg <= IDLE_THRESHOLD 的結尾幀
+        base = max(start, lo - REST_NEED + 1)
+        low = np.concatenate(([0], np.cumsum(d[base:hi] <= cs.IDLE_THRESHOLD)))
+        k = np.arange(lo, hi)
+        ok = k - REST_NEED + 1 >= start
+        j = np.clip(k - REST_NEED + 1 - base, 0, None)
+        return ok & (low[k - base + 1] - low[j] == REST_NEED)
+
+    reps = []
+    rest_from = 0
+    while True:
+        j = _first_index(lambda lo, hi: rest_ready(lo, hi, rest_from), A, rest_from + REST_NEED - 1)
+        if j is None:
+            break
+        r = _first_index(lambda lo, hi: d[lo:hi] >= cs.RAISE_ENTER_DEG, A, j)
+        if r is None:
+            break
+        k1 = _first_index(lambda lo, hi: (d[lo:hi] >= cs.SUCCESS_MIN_DEG) | (d[lo:hi] < cs.IDLE_THRESHOLD), A, r + 1)
+        if k1 is None:
+            break
+        outcome = None
+        if d[k1] >= cs.SUCCESS_MIN_DEG:         # RAISING → HOLDING
+            s = _first_index(lambda lo, hi: d[lo:hi] < cs.SUCCESS_MIN_DEG, A, k1 + 1)
+            if s is None:
+                break
+            hold = s - k1
+            peak = float(d[r:s + 1].max())
+            if hold >= need and cs.SUCCESS_MIN_DEG <= peak <= cs.SUCCESS_MAX_DEG:
+                outcome = "SUCCESS"
+            elif peak > cs.SUCCESS_MIN_DEG:
+                outcome = "FAIL_SHORT_HOLD"
+        else:                                    # RAISING 中跌回休息區
+            s = k1
+            small = (cs.FAIL_MIN_DEG <= d[r + 1:s + 1]) & (d[r + 1:s + 1] <= cs.FAIL_MAX_DEG)
+            out_of_zone = np.flatnonzero(~small)
+            hold = len(small) - (int(out_of_zone[-1]) + 1 if len(out_of_zone) else 0)
+            peak = float(d[r:s + 1].max())
+            if (s - r + 1 >= cs.MIN_RISE_FRAMES and cs.FAIL_MIN_DEG <= peak <= cs.FAIL_MAX_DEG
+                    and hold >= need):
+                outcome = "FAIL_SMALL_KEPT"
+        if outcome is not None:
+            reps.append({"frame": int(frames[act[s]]), "side": side, "rep": len(reps) + 1, "outcome": outcome,
+                         "base_deg": 0.0, "peak_deg": peak,     # 校正完成後 calib_deg 固定為 0°
+                         "hold_s": hold / max(1.0, fps)})
+        if s + 1 < A:
+            cooldown_patch(s + 1, min(s + C, A - 1))
+        rest_from = s + C + 2                   # 冷卻結束那幀 rest 歸零，下一幀起重新累積
+    return _score_result(reps)
+
+
+def score_session(track, selected_action, detector=None):
+    """以 PoseTrack 整段評分（不解碼、不推論、不逐幀呼叫 detector）。"""
+    present = np.flatnonzero(track.present)
+    lms = track.landmarks[present]
+    if selected_action == "squat_hip_height":
+        return score_squat(lms, detector, frames=present)
+    if selected_action == "calf_raise":
+        W, H = track.size
+        return score_calf(lms, W, H, track.fps, detector, frames=present)
+    raise ValueError(f"未知動作: {selected_action}")
+
+
 # ===============================
 # UI：只保留 深蹲 / 提踵 兩項
 # ===============================
 
 def select_action_group():
+    import tkinter as tk
+    from tkinter import messagebox, filedialog
     root = tk.Tk()
     root.title("動作識別系統（僅：深蹲 / 提踵）")
     root.geometry("420x300")
@@ -1064,13 +2179,1334 @@ def select_action_group():
     return action, video_path
 
 
+# ==============================
+# 共用：Pose / Detector 建立
+# ==============================
+
+POSE_KWARGS = dict(static_image_mode=False, model_complexity=1, smooth_landmarks=True,
+                   min_detection_confidence=0.5, min_tracking_confidence=0.5, enable_segmentation=False)
+
+ACTION_NAMES = {
+    "squat_hip_height": "深蹲 (角度法)",
+    "calf_raise": "提踵 (地面參考)",
+}
+
+VIDEO_EXTS = (".mp4", ".mov", ".avi", ".mkv", ".wmv")
+
+
+def make_pose(**overrides):
+    """依 POSE_KWARGS 建 Pose；overrides 覆寫個別參數（例如 static_image_mode=True 的單張探測用 Pose）。"""
+    return _mediapipe().solutions.pose.Pose(**dict(POSE_KWARGS, **overrides))
+
+
+def _since_launch():
+    return round(time.perf_counter() - _T_LAUNCH, 3)
+
+
+class PosePrewarm:
+    """
+    背景執行緒預先載入 mediapipe、建好 Pose，並以空白畫面推論一次（第一次 process 才初始化 graph），
+    讓使用者還在選單 / 對話框時模型就已就緒。take() 取走 Pose（必要時等候），之後由呼叫端 close()。
+    """
+    def __init__(self, size=(1280, 720)):
+        self.size = size
+        self.pose = self.error = None
+        self.ready_s = self.warm_s = self.wait_s = None
+        self._thread = threading.Thread(target=self._run, name="pose-prewarm", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        t0 = time.perf_counter()
+        try:
+            pose = make_pose()
+            pose.process(np.zeros((self.size[1], self.size[0], 3), np.uint8))
+            pose.reset()        # 空白畫面不留追蹤狀態
+            self.pose = pose
+        except Exception as e:
+            self.error = e
+        self.warm_s = round(time.perf_counter() - t0, 3)
+        self.ready_s = _since_launch()
+
+    def take(self):
+        """等預熱完成並取走 Pose；預熱失敗時當場建立。"""
+        t0 = time.perf_counter()
+        self._thread.join()
+        self.wait_s = round(time.perf_counter() - t0, 3)
+        pose, self.pose = self.pose, None
+        if pose is None:
+            print(f"[warn] Pose 預熱失敗（{self.error!r}），改為當場建立")
+            pose = make_pose()
+        return pose
+
+    def close(self):
+        """沒有取走（例如使用者取消）時釋放預熱好的 Pose。"""
+        self._thread.join()
+        if self.pose is not None:
+            self.pose.close()
+            self.pose = None
+
+    def stats(self):
+        return {"warm_s": self.warm_s, "ready_s": self.ready_s, "wait_s": self.wait_s}
+
+
+# 各動作 detector 的預設門檻（make_detector 與 sweep 共用）
+DETECTOR_PARAMS = {
+    "squat_hip_height": dict(
+        stand_up_deg=170.0,
+        succ_min_deg=95.0, succ_max_deg=135.0,
+        fail_min_deg=136.0, fail_max_deg=162.0,
+        ema_alpha=0.35, standard_deg=135.0,
+        smooth_mode="mean", euro_min_cutoff=1.0, euro_beta=10.0,
+    ),
+    # 先沿用先前的 1/2 角度縮放（俯視壓縮）
+    "calf_raise": dict(A_min=7.5, A_max=45.0, hold_seconds=3.0, ema_alpha=0.35, standard_deg=15.0,
+                       raise_enter_deg=15.0, calib_frames=45),
+}
+
+
+def make_detector(selected_action, fps, params=None):
+    """
+    依動作建立 detector；params 可覆寫 DETECTOR_PARAMS 的部分門檻。
+    回傳 (detector, action_name)，未知動作回傳 (None, None)。
+    """
+    if selected_action not in DETECTOR_PARAMS:
+        return None, None
+    kwargs = dict(DETECTOR_PARAMS[selected_action], **(params or {}))
+    if selected_action == "squat_hip_height":
+        detector = SquatKneeAngleThresholdDetector(**kwargs)
+        detector.landmark_smoother.fps = fps   # One-Euro 沒有時間戳時以來源 fps 計間隔
+    else:
+        detector = CalfRaiseDetector(**kwargs)
+        detector.fixed_fps = fps   # 使用來源（攝影機/影片檔）固有 fps 計秒
+    return detector, ACTION_NAMES[selected_action]
+
+
+def _sanitize_fps(fps):
+    try:
+        fps = float(fps)
+        if fps <= 0 or fps > 120:
+            fps = 30.0
+    except Exception:
+        fps = 30.0
+    return fps
+
+
+def _seek_to(cap, start_sec):
+    """依序嘗試 POS_MSEC → POS_FRAMES → 逐幀略過，定位到 start_sec。"""
+    if start_sec <= 0:
+        return
+    fps_probe = cap.get(cv2.CAP_PROP_FPS) or 0
+    frame_idx = int(start_sec * fps_probe) if fps_probe > 0 else None
+    ok_seek = False
+    if cap.set(cv2.CAP_PROP_POS_MSEC, start_sec * 1000.0):
+        ok_seek = True
+    if not ok_seek and frame_idx is not None:
+        ok_seek = cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+    if not ok_seek and fps_probe > 0:
+        target = max(0, frame_idx or 0); skipped = 0
+        while skipped < target:
+            ret_skip, _ = cap.read()
+            if not ret_skip: break
+            skipped += 1
+        print(f"[info] 手動略過 {skipped} 幀以達到起始時間 {start_sec:.3f}s")
+    else:
+        print(f"[info] 起始時間已定位到 {start_sec:.3f}s")
+
+
+VIDEO_INDEX_VERSION = 2   # 2: 關鍵幀依顯示順序的幀號記錄（有 B 幀時與封包順序不同）
+
+
+class VideoIndex:
+    """
+    影片的幀 / 關鍵幀索引（依內容雜湊快取於 cache_dir()，每支影片只建一次）：
+    - t:         (N,) float64 每幀時間（秒，遞增）
+    - keyframes: (K,) int 關鍵幀的幀號（遞增，含 0）
+    以原始封包模式（CAP_PROP_FORMAT=-1）掃一遍：只解封裝、不解碼，長影片也只要一下子。
+    seek() 先跳到目標前最近的關鍵幀（落在關鍵幀上的定位是準的），再 grab 到目標幀，
+    不再依賴不一定準的 POS_MSEC，也不必從頭逐幀讀。
+    """
+    def __init__(self, t, keyframes, fps):
+        self.t = np.asarray(t, dtype=np.float64)
+        keyframes = np.unique(np.asarray(keyframes, dtype=np.int64))
+        self.keyframes = keyframes if len(keyframes) and keyframes[0] == 0 else np.concatenate(([0], keyframes))
+        self.fps = float(fps)
+
+    def __len__(self):
+        return len(self.t)
+
+    @classmethod
+    def build(cls, video_path):
+        """掃描封包建立索引；後端不支援原始封包模式時回傳 None（呼叫端改用 _seek_to）。"""
+        key_prop = getattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME", None)
+        if key_prop is None:
+            return None
+        cap = cv2.VideoCapture(video_path)
+        try:
+            if not cap.isOpened() or not cap.set(cv2.CAP_PROP_FORMAT, -1):
+                return None
+            fps = _sanitize_fps(cap.get(cv2.CAP_PROP_FPS) or 30.0)
+            t, keys = [], []
+            while cap.grab():
+                if cap.get(key_prop):
+                    keys.append(len(t))
+                t.append((cap.get(cv2.CAP_PROP_POS_MSEC) or 0.0) / 1000.0)
+        finally:
+            cap.release()
+        if not t:
+            return None
+        # 封包是解碼順序（有 B 幀時時間戳不遞增），排序後即顯示順序；
+        # 關鍵幀記的是封包序號，要經同一個排序換成顯示順序的幀號
+        t = np.asarray(t, dtype=np.float64)
+        order = np.argsort(t, kind="stable")
+        rank = np.empty(len(t), dtype=np.int64)
+        rank[order] = np.arange(len(t))
+        return cls(t[order], rank[keys], fps)
+
+    @classmethod
+    def load_or_build(cls, video_path):
+        path = os.path.join(cache_dir(), f"{video_content_hash(video_path)}_index.npz")
+        if os.path.exists(path):
+            try:
+                with np.load(path) as z:
+                    if int(z["version"]) == VIDEO_INDEX_VERSION:
+                        return cls(z["t"], z["keyframes"], float(z["fps"]))
+            except Exception as e:
+                print(f"[warn] 影格索引無法讀取（{e}），重新建立")
+        index = cls.build(video_path)
+        if index is not None:
+            tmp = path + ".tmp.npz"
+            np.savez(tmp, version=VIDEO_INDEX_VERSION, t=index.t, keyframes=index.keyframes, fps=index.fps)
+            os.replace(tmp, path)
+        return index
+
+    def frame_at(self, sec):
+        """時間 sec 起的第一幀（t >= sec，容許 1 ms 誤差）；超過結尾回傳 len(self)。"""
+        return int(np.searchsorted(self.t, float(sec) - 1e-3, side="left"))
+
+    def frame_range(self, start_sec=0.0, end_sec=None):
+        """[start_sec, end_sec) → [start_frame, end_frame)；end_sec=None 表示到結尾。"""
+        return self.frame_at(start_sec), (len(self) if end_sec is None else self.frame_at(end_sec))
+
+    def keyframe_before(self, frame):
+        return int(self.keyframes[np.searchsorted(self.keyframes, frame, side="right") - 1])
+
+    def seek(self, cap, frame):
+        """讓剛開啟的 cap 下一次 read() 取得第 frame 幀；回傳是否確認定位正確。"""
+        kf = self.keyframe_before(frame)
+        if kf and not cap.set(cv2.CAP_PROP_POS_FRAMES, kf):
+            kf = 0
+        for _ in range(frame - kf):
+            if not cap.grab():
+                return False
+        return int(round(cap.get(cv2.CAP_PROP_POS_FRAMES) or 0)) == frame
+
+    def seek_verified(self, cap, frame):
+        """
+        seek()；確認失敗時改用 _seek_to（時間定位），再依 POS_FRAMES 往後 grab 補到 frame。
+        回傳是否確認定位正確；False 時呼叫端不可在這個位置上繼續處理（幀號與時間都會錯）。
+        """
+        if self.seek(cap, frame):
+            return True
+        print(f"[warn] 以關鍵幀定位到第 {frame} 幀失敗，改用時間定位")
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        _seek_to(cap, float(self.t[min(frame, len(self) - 1)]))
+        pos = int(round(cap.get(cv2.CAP_PROP_POS_FRAMES) or 0))
+        while pos < frame and cap.grab():
+            pos += 1
+        return int(round(cap.get(cv2.CAP_PROP_POS_FRAMES) or 0)) == frame
+
+
+def parse_segments(specs):
+    """
+    ["1:00-2:30", "5:00-"] 或 "1:00-2:30,5:00-" → [(60.0, 150.0), (300.0, None)]（[start, end) 秒，依起點排序）。
+    時間格式同 parse_timecode；結尾留空表示到影片結尾。
+    """
+    if isinstance(specs, str):
+        specs = [specs]
+    segments = []
+    for spec in specs:
+        for part in str(spec).split(","):
+            part = part.strip()
+            if not part:
+                continue
+            start_text, sep, end_text = part.partition("-")
+            if not sep:
+                raise ValueError(f"區段格式錯誤（應為 START-END 或 START-）: {part}")
+            start = parse_timecode(start_text)
+            end = parse_timecode(end_text) if end_text.strip() else None
+            if end is not None and end <= start:
+                raise ValueError(f"區段結尾必須晚於起點: {part}")
+            segments.append((start, end))
+    segments.sort(key=lambda seg: seg[0])
+    for (s0, e0), (s1, _e1) in zip(segments, segments[1:]):
+        if e0 is None or e0 > s1:
+            raise ValueError(f"區段重疊: {s0}s 與 {s1}s")
+    return segments
+
+
+def _segment_tag(start_sec, end_sec):
+    end = "end" if end_sec is None else f"{end_sec:g}s"
+    return f"{start_sec:g}s-{end}"
+
+
+# ==============================
+# 分段管線（decode → stabilize → pose → render → encode）
+# ==============================
+
+_PIPE_END = object()
+
+
+class FramePacket:
+    """在管線各段之間傳遞的單幀資料。"""
+    __slots__ = ("idx", "t", "born_ns", "frame", "W", "H", "stab_mag", "stab_A", "raw_landmarks", "landmarks")
+
+    def __init__(self, idx, frame, t=0.0, size=None):
+        self.idx = idx
+        self.t = t              # 影片時間（秒）
+        self.born_ns = time.perf_counter_ns()   # 讀入時刻（StageTimer 算端到端延遲）
+        self.frame = frame      # None = 未解碼（cap.grab 略過的幀），此時大小取 size=(W, H)
+        self.W, self.H = size if frame is None else (frame.shape[1], frame.shape[0])
+        self.stab_mag = 0.0
+        self.stab_A = None      # landmarks 模式的防手震仿射（None = 不需換算）
+        self.raw_landmarks = None  # 推論原始結果 LandmarkFrame（None = 未偵測；畫骨架用，與畫面像素對齊）
+        self.landmarks = None   # 給 detector 的 LandmarkFrame（已套防手震；None = 未偵測）
+
+
+def read_packets(cap, skip=None, size=None, limit=None):
+    """
+    逐幀讀取 cap，產生 FramePacket（管線的 decode 段）。
+    skip(idx) 為 True 的幀只 cap.grab()（解封裝但不解碼成影像），packet.frame=None、大小為 size=(W, H)。
+    limit: 最多讀幾幀（區段結尾）；None = 到影片結尾。
+    """
+    idx = 0
+    while limit is None or idx < limit:
+        if skip is not None and skip(idx):
+            if not cap.grab():
+                break
+            frame = None
+        else:
+            ret, frame = cap.read()
+            if not ret:
+                break
+        yield FramePacket(idx, frame, t=(cap.get(cv2.CAP_PROP_POS_MSEC) or 0.0) / 1000.0, size=size)
+        idx += 1
+
+
+class LatestFrameGrabber:
+    """
+    即時來源專用的擷取執行緒：不停 cap.read()，只保留最新一幀與其擷取時刻。
+    - 還沒被取走就被新幀覆蓋的舊幀計入 dropped（處理跟不上相機時直接跳到最新畫面，
+      不會去消化驅動緩衝裡越積越舊的幀）
+    - 迭代產生 FramePacket：t = 擷取時刻（秒，自開始擷取起算），born_ns = 擷取當下，
+      因此 StageTimer 的 latency 是「擷取 → 輸出」的真實延遲
+    搭配 StagePipeline(maxsize=1) 使用，段間佇列也不囤舊幀。
+    """
+    def __init__(self, cap):
+        self.cap = cap
+        self.captured = self.dropped = 0
+        self._cond = threading.Condition()
+        self._slot = None           # (frame, t_ns)
+        self._done = False
+        self._stop = threading.Event()
+        self._t0 = time.perf_counter_ns()
+        self._thread = threading.Thread(target=self._run, name="capture", daemon=True)
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                ok, frame = self.cap.read()
+                t_ns = time.perf_counter_ns()
+                if not ok:
+                    break
+                with self._cond:
+                    if self._slot is not None:
+                        self.dropped += 1
+                    self._slot = (frame, t_ns)
+                    self.captured += 1
+                    self._cond.notify()
+        finally:
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+    def __iter__(self):
+        if not self._thread.is_alive() and not self._done:
+            self._thread.start()
+        idx = 0
+        while True:
+            with self._cond:
+                while self._slot is None and not self._done:
+                    self._cond.wait(0.1)
+                if self._slot is None:
+                    return
+                frame, t_ns = self._slot
+                self._slot = None
+            pkt = FramePacket(idx, frame, t=(t_ns - self._t0) / 1e9)
+            pkt.born_ns = t_ns
+            idx += 1
+            yield pkt
+
+    def stop(self):
+        """停止擷取執行緒（在 cap.release() 之前呼叫）。"""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=2.0)
+
+    def stats(self):
+        return {"captured": self.captured, "dropped": self.dropped,
+                "drop_pct": round(100.0 * self.dropped / self.captured, 1) if self.captured else 0.0}
+
+
+class StagePipeline:
+    """
+    每段一條執行緒，段與段之間以有界佇列串接（背壓：最慢的一段決定整體速度）。
+    - source: 可迭代物件，於獨立執行緒中產生 packet
+    - stages: [(name, fn), ...]；fn(packet) 回傳 packet / None（丟棄或暫存）/ list（多個）；
+      fn 若有 flush()，source 結束後呼叫一次，送出暫存的 packet
+    - 每段單執行緒、FIFO → 輸出順序與 detector 狀態更新順序都與逐幀版本相同
+    - threaded=False：同一串 stage 在呼叫端執行緒內逐幀執行（除錯 / 已用多行程吃滿核心時）
+    - timer: StageTimer；提供時 source 記為 "decode"，各段以自己的名稱計時
+    迭代本物件即在呼叫端依序取得最後一段的輸出（可在主執行緒做 imshow / waitKey）。
+    """
+    def __init__(self, source, stages, maxsize=4, threaded=True, timer=None):
+        if timer is not None:
+            source = timer.wrap_iter("decode", source)
+            stages = [(name, timer.wrap(name, fn)) for name, fn in stages]
+        self.source = source
+        self.stages = list(stages)
+        self.maxsize = int(maxsize)
+        self.threaded = threaded
+        self._stop = threading.Event()
+        self._error = None
+        self._threads = []
+
+    @staticmethod
+    def _emit(out):
+        if out is None:
+            return ()
+        if isinstance(out, list):
+            return out
+        return (out,)
+
+    def _fail(self, e):
+        if self._error is None:
+            self._error = e
+        self._stop.set()
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return _PIPE_END
+
+    def _run_source(self, q_out):
+        try:
+            for pkt in self.source:
+                if not self._put(q_out, pkt):
+                    return
+        except Exception as e:
+            self._fail(e)
+            return
+        self._put(q_out, _PIPE_END)
+
+    def _run_stage(self, fn, q_in, q_out):
+        try:
+            while True:
+                item = self._get(q_in)
+                if item is _PIPE_END:
+                    break
+                for out in self._emit(fn(item)):
+                    if not self._put(q_out, out):
+                        return
+            if self._stop.is_set():
+                return
+            for out in self._emit(self._flush(fn)):
+                if not self._put(q_out, out):
+                    return
+        except Exception as e:
+            self._fail(e)
+            return
+        self._put(q_out, _PIPE_END)
+
+    def _start(self):
+        queues = [queue.Queue(maxsize=self.maxsize) for _ in range(len(self.stages) + 1)]
+        self._threads = [threading.Thread(target=self._run_source, args=(queues[0],),
+                                          name="pipe-decode", daemon=True)]
+        for i, (name, fn) in enumerate(self.stages):
+            self._threads.append(threading.Thread(target=self._run_stage, args=(fn, queues[i], queues[i + 1]),
+                                                  name=f"pipe-{name}", daemon=True))
+        for t in self._threads:
+            t.start()
+        return queues[-1]
+
+    @staticmethod
+    def _flush(fn):
+        flush = getattr(fn, "flush", None)
+        return flush() if flush is not None else None
+
+    def _run_batch(self, batch, first):
+        for _name, fn in self.stages[first:]:
+            batch = [out for p in batch for out in self._emit(fn(p))]
+        return batch
+
+    def _iter_inline(self):
+        for pkt in self.source:
+            yield from self._run_batch([pkt], 0)
+        for i, (_name, fn) in enumerate(self.stages):
+            yield from self._run_batch(list(self._emit(self._flush(fn))), i + 1)
+
+    def __iter__(self):
+        if not self.threaded:
+            yield from self._iter_inline()
+            return
+        q_last = self._start()
+        try:
+            while True:
+                item = self._get(q_last)
+                if item is _PIPE_END:
+                    break
+                yield item
+        finally:
+            self.close()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        """中止（或收尾）所有段並等待執行緒結束；可重複呼叫。"""
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=5.0)
+        self._threads = []
+
+
+class StageTimer:
+    """
+    管線各段耗時量測（低開銷：每筆只做 deque.append 與一次分桶累加）。
+    - rolling：最近 window 筆，供即時 p50/p95/p99 與除錯 HUD
+    - 整段：對數分桶直方圖（約 6% 解析度）+ 次數/總和/最大值，供 session 結束時輸出 profile
+    每個名稱只由單一執行緒寫入（管線每段一條執行緒），新名稱註冊時才上鎖。
+    """
+    _MIN_MS, _MAX_MS, _BUCKETS = 1e-3, 1e4, 280
+    _LOG_STEP = math.log(_MAX_MS / _MIN_MS) / _BUCKETS
+    NON_STAGE = ("latency", "pose_queue", "encode_wait")   # 端到端延遲 / 池排隊、等編碼佇列（已含在 pose / encode 內）：不算在瓶頸判斷內
+
+    def __init__(self, window=300):
+        self.window = int(window)
+        self._lock = threading.Lock()
+        self._roll = {}
+        self._hist = {}
+        self._stats = {}                     # name -> [n, sum_ns, max_ns]
+        self._ticks = deque(maxlen=self.window)
+        self.t_start = time.perf_counter_ns()
+        self.frames = 0
+        self._hud, self._hud_at = None, 0
+
+    def _register(self, name):
+        with self._lock:
+            if name not in self._roll:
+                self._hist[name] = [0] * (self._BUCKETS + 1)
+                self._stats[name] = [0, 0, 0]
+                self._roll[name] = deque(maxlen=self.window)
+        return self._roll[name]
+
+    def record(self, name, dt_ns):
+        roll = self._roll.get(name) or self._register(name)
+        roll.append(dt_ns)
+        st = self._stats[name]
+        st[0] += 1
+        st[1] += dt_ns
+        if dt_ns > st[2]:
+            st[2] = dt_ns
+        ms = dt_ns / 1e6
+        b = 0 if ms <= self._MIN_MS else min(self._BUCKETS, int(math.log(ms / self._MIN_MS) / self._LOG_STEP) + 1)
+        self._hist[name][b] += 1
+
+    def wrap(self, name, fn):
+        """回傳計時版的 fn（管線 stage 用）。"""
+        def timed(*args):
+            t0 = time.perf_counter_ns()
+            try:
+                return fn(*args)
+            finally:
+                self.record(name, time.perf_counter_ns() - t0)
+        if hasattr(fn, "flush"):
+            timed.flush = self.wrap(name, fn.flush)
+        return timed
+
+    def wrap_iter(self, name, iterable):
+        """計時每次 next()（管線 decode 段用）。"""
+        it = iter(iterable)
+        while True:
+            t0 = time.perf_counter_ns()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self.record(name, time.perf_counter_ns() - t0)
+            yield item
+
+    def tick(self, pkt=None):
+        """主執行緒每輸出一幀呼叫一次；有 pkt 時一併記錄端到端延遲（讀入 → 輸出）。"""
+        now = time.perf_counter_ns()
+        self._ticks.append(now)
+        self.frames += 1
+        if pkt is not None and pkt.born_ns:
+            self.record("latency", now - pkt.born_ns)
+
+    def rolling_fps(self):
+        if len(self._ticks) < 2:
+            return 0.0
+        return (len(self._ticks) - 1) * 1e9 / max(1, self._ticks[-1] - self._ticks[0])
+
+    def snapshot(self):
+        """{name: {"p50_ms", "p95_ms", "p99_ms", "mean_ms", "n"}}（rolling 視窗）。"""
+        out = {}
+        for name in list(self._roll):
+            ms = np.fromiter(list(self._roll[name]), dtype=np.float64) / 1e6
+            if len(ms) == 0:
+                continue
+            p50, p95, p99 = np.percentile(ms, (50, 95, 99))
+            out[name] = {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3),
+                         "p99_ms": round(float(p99), 3), "mean_ms": round(float(ms.mean()), 3), "n": len(ms)}
+        return out
+
+    def hud_lines(self, every=15):
+        """除錯 HUD 文字；每 every 幀才重算一次（文字不變時 draw_text_block 走快取）。"""
+        if self._hud is None or self.frames - self._hud_at >= every:
+            lines = [f"timing {self.rolling_fps():5.1f} fps (last {len(self._ticks)})   p50 / p95 / p99 ms"]
+            for name, s in self.snapshot().items():
+                lines.append(f"{name:<10s} {s['p50_ms']:7.2f} {s['p95_ms']:7.2f} {s['p99_ms']:7.2f}")
+            self._hud, self._hud_at = lines, self.frames
+        return self._hud
+
+    def _hist_percentile(self, name, q):
+        """直方圖百分位：回傳所在分桶的上緣（不超過實測最大值）。"""
+        hist = self._hist[name]
+        n = sum(hist)
+        if n == 0:
+            return None
+        target, acc = q / 100.0 * n, 0
+        for b, c in enumerate(hist):
+            acc += c
+            if acc >= target:
+                hi = self._MIN_MS * math.exp(b * self._LOG_STEP)
+                return round(min(hi, self._stats[name][2] / 1e6), 3)
+        return None
+
+    def profile(self, **meta):
+        """整段 session 的耗時摘要；busy_pct 接近 100 的段就是拖慢整體的瓶頸。"""
+        wall_ns = max(1, time.perf_counter_ns() - self.t_start)
+        stages = {}
+        for name, (n, total, mx) in list(self._stats.items()):
+            if n == 0:
+                continue
+            stages[name] = {
+                "n": n,
+                "mean_ms": round(total / n / 1e6, 3),
+                "p50_ms": self._hist_percentile(name, 50),
+                "p95_ms": self._hist_percentile(name, 95),
+                "p99_ms": self._hist_percentile(name, 99),
+                "max_ms": round(mx / 1e6, 3),
+                "total_s": round(total / 1e9, 3),
+                "busy_pct": round(100.0 * total / wall_ns, 1),
+            }
+        busy = {k: v["busy_pct"] for k, v in stages.items() if k not in self.NON_STAGE}
+        return {
+            "meta": meta,
+            "wall_s": round(wall_ns / 1e9, 3),
+            "frames": self.frames,
+            "fps": round(self.frames * 1e9 / wall_ns, 2),
+            "bottleneck": max(busy, key=busy.get) if busy else None,
+            "stages": stages,
+            "rolling": self.snapshot(),
+        }
+
+    def dump(self, path, **meta):
+        prof = self.profile(**meta)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(prof, f, ensure_ascii=False, indent=2)
+        return prof
+
+
+def _draw_timing_hud(image, timer, anchor="rb", landmarks=None):
+    lines = timer.hud_lines()
+    if landmarks is not None:
+        a = landmarks.angles()
+        lines = lines + [f"knee L/R {a['knee_left']:.0f}/{a['knee_right']:.0f}  "
+                         f"ankle L/R {a['ankle_left']:.0f}/{a['ankle_right']:.0f}  trunk {a['trunk_tilt']:+.0f}"]
+    return draw_text_block(image, lines, anchor=anchor, margin=16, color=(0, 255, 255),
+                           max_font_px=14, min_font_px=11, line_gap=3, stroke=2)
+
+
+# 同 mp.solutions.pose.POSE_CONNECTIONS（排序後；畫圖順序固定）。直接列出，畫骨架不必載入 mediapipe
+POSE_CONNECTIONS = [(0, 1), (0, 4), (1, 2), (2, 3), (3, 7), (4, 5), (5, 6), (6, 8), (9, 10), (11, 12), (11, 13),
+                    (11, 23), (12, 14), (12, 24), (13, 15), (14, 16), (15, 17), (15, 19), (15, 21), (16, 18),
+                    (16, 20), (16, 22), (17, 19), (18, 20), (23, 24), (23, 25), (24, 26), (25, 27), (26, 28),
+                    (27, 29), (27, 31), (28, 30), (28, 32), (29, 31), (30, 32)]
+_POSE_LINE_COLOR, _POSE_POINT_COLOR, _POSE_BORDER_COLOR = (245, 66, 230), (245, 117, 66), (224, 224, 224)
+
+
+def _draw_pose(image, lf):
+    """
+    以 LandmarkFrame 畫骨架（取代 mp_drawing.draw_landmarks，不必轉回 protobuf）：
+    同樣略過 visibility < 0.5 與畫面外的點、同樣的像素換算與顏色 / 粗細 / 外框。
+    """
+    h, w = image.shape[:2]
+    norm = lf.norm
+    x, y = norm[:, 0].astype(np.float64), norm[:, 1].astype(np.float64)
+    ok = (norm[:, 3] >= 0.5) & (x >= 0) & (x <= 1) & (y >= 0) & (y <= 1)
+    pts = np.stack([np.minimum(np.floor(x * w), w - 1), np.minimum(np.floor(y * h), h - 1)], 1).astype(int).tolist()
+    for a, b in POSE_CONNECTIONS:
+        if ok[a] and ok[b]:
+            cv2.line(image, pts[a], pts[b], _POSE_LINE_COLOR, 2)
+    for i in np.flatnonzero(ok).tolist():
+        cv2.circle(image, pts[i], 3, _POSE_BORDER_COLOR, 2)
+        cv2.circle(image, pts[i], 2, _POSE_POINT_COLOR, 2)
+
+
+# 輸出影片編碼：名稱 → (fourcc, 副檔名, VideoWriter 後端)
+VIDEO_CODECS = {
+    "mp4v": ("mp4v", ".mp4", cv2.CAP_FFMPEG),           # 預設，到處都能播
+    "h264": ("avc1", ".mp4", cv2.CAP_FFMPEG),           # 同畫質檔案小得多；ffmpeg 沒有 H.264 編碼器時退回 mp4v
+    "mjpg": ("MJPG", ".avi", cv2.CAP_OPENCV_MJPEG),     # 逐幀 JPEG，編碼最輕、可調 quality，檔案大
+    "ffv1": ("FFV1", ".avi", cv2.CAP_FFMPEG),           # 無損（延後疊圖的原始錄影需要逐幀精準時）
+}
+
+
+class AsyncVideoWriter:
+    """
+    背景執行緒編碼的輸出影片（取代在 encode 段同步呼叫 cv2.VideoWriter.write）。
+    - write(frame) 只複製一份放進有界佇列（maxsize 幀）；佇列滿時才阻塞呼叫端（背壓），
+      阻塞次數 / 時間記在 stats()，有 timer 時另記為 "encode_wait"；編碼執行緒的實際耗時記為 "encoder"
+    - codec: VIDEO_CODECS 的名稱；開不起來時退回 mp4v。副檔名隨 codec 調整，實際路徑見 self.path
+    - quality: 0–100，只有支援的後端（mjpg）有效，stats() 的 quality_applied 標示是否生效
+    - scale: 輸出縮放（在編碼執行緒縮圖）；every: 每 N 幀寫一幀（fps 同除以 N，時長不變；審閱用副本）
+    release() 會等佇列寫完才關檔。
+    """
+    def __init__(self, path, fps, size, codec="mp4v", quality=None, scale=1.0, every=1, maxsize=8, timer=None):
+        if codec not in VIDEO_CODECS:
+            raise ValueError(f"未知 codec: {codec}（可用: {', '.join(VIDEO_CODECS)}）")
+        W, H = int(size[0]), int(size[1])
+        self.scale = float(scale or 1.0)
+        self.size = (W, H) if self.scale == 1.0 else \
+            (max(2, int(round(W * self.scale / 2)) * 2), max(2, int(round(H * self.scale / 2)) * 2))
+        self.every = max(1, int(every))
+        self.fps = float(fps) / self.every
+        self.quality = quality
+        self.codec, self.path, self._vw = self._open(path, codec)
+        self.quality_applied = quality is not None and bool(self._vw.set(cv2.VIDEOWRITER_PROP_QUALITY,
+                                                                          float(quality)))
+        self.timer = timer
+        self._q = queue.Queue(maxsize=max(1, int(maxsize)))
+        self.frames_in = self.frames_written = 0
+        self.stalls, self._stall_ns, self.max_depth, self._encode_ns = 0, 0, 0, 0
+        self.error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="video-writer", daemon=True)
+        self._thread.start()
+
+    def _open(self, path, codec):
+        for name in dict.fromkeys((codec, "mp4v")):
+            fourcc, ext, api = VIDEO_CODECS[name]
+            out_path = os.path.splitext(path)[0] + ext
+            vw = cv2.VideoWriter(out_path, api, cv2.VideoWriter_fourcc(*fourcc), self.fps, self.size)
+            if vw.isOpened():
+                if name != codec:
+                    print(f"[warn] 無法以 {codec} 編碼，改用 {name}")
+                return name, out_path, vw
+            vw.release()
+        raise IOError(f"無法建立輸出影片: {path}")
+
+    def _run(self):
+        interp = cv2.INTER_AREA if self.scale < 1.0 else cv2.INTER_LINEAR
+        while True:
+            frame = self._q.get()
+            if frame is None:
+                return
+            if self.error is not None:
+                continue        # 出錯後只清空佇列，不讓呼叫端卡住
+            t0 = time.perf_counter_ns()
+            try:
+                if (frame.shape[1], frame.shape[0]) != self.size:
+                    frame = cv2.resize(frame, self.size, interpolation=interp)
+                self._vw.write(frame)
+                self.frames_written += 1
+            except Exception as e:
+                self.error = e
+            dt = time.perf_counter_ns() - t0
+            self._encode_ns += dt
+            if self.timer is not None:
+                self.timer.record("encoder", dt)
+
+    def write(self, frame):
+        if self.error is not None:
+            raise self.error
+        i = self.frames_in
+        self.frames_in += 1
+        if i % self.every:
+            return
+        frame = frame.copy()    # 呼叫端之後可能在同一張畫面上畫預覽 HUD
+        try:
+            self._q.put_nowait(frame)
+        except queue.Full:
+            t0 = time.perf_counter_ns()
+            self._q.put(frame)
+            dt = time.perf_counter_ns() - t0
+            self.stalls += 1
+            self._stall_ns += dt
+            if self.timer is not None:
+                self.timer.record("encode_wait", dt)
+        self.max_depth = max(self.max_depth, self._q.qsize())
+
+    def release(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._q.put(None)
+        self._thread.join()
+        self._vw.release()
+
+    def stats(self):
+        return {"codec": self.codec, "path": self.path, "size": list(self.size), "fps": round(self.fps, 3),
+                "every": self.every, "quality": self.quality, "quality_applied": self.quality_applied,
+                "frames_in": self.frames_in, "frames_written": self.frames_written,
+                "queue_max": self._q.maxsize, "max_depth": self.max_depth,
+                "stalls": self.stalls, "stall_ms": round(self._stall_ns / 1e6, 3),
+                "encode_ms_mean": round(self._encode_ns / 1e6 / self.frames_written, 3) if self.frames_written else None,
+                "bytes": os.path.getsize(self.path) if self._closed and os.path.exists(self.path) else None,
+                "error": repr(self.error) if self.error else None}
+
+
+def _pose_stage(pose):
+    def run(pkt):
+        image = cv2.cvtColor(pkt.frame, cv2.COLOR_BGR2RGB)
+        image.flags.writeable = False
+        # 每幀唯一一次 protobuf → 陣列轉換
+        lms = pkt.raw_landmarks = LandmarkFrame.from_landmarks(pose.process(image).pose_landmarks, pkt.W, pkt.H)
+        if lms is not None and pkt.stab_A is not None:
+            lms = apply_affine_to_landmarks(lms, pkt.stab_A)
+        pkt.landmarks = lms
+        return pkt
+    return run
+
+
+def _cached_pose_stage(track):
+    """以 PoseTrack 取代推論（快取命中時）；骨架用與畫面對齊的 raw，防手震位移取自快取。"""
+    def run(pkt):
+        pkt.landmarks = track.landmark_frame(pkt.idx)
+        pkt.raw_landmarks = track.raw_landmark_frame(pkt.idx)
+        if pkt.idx < len(track):
+            pkt.stab_mag = float(track.stab_mag[pkt.idx])
+        return pkt
+    return run
+
+
+def _lerp_landmarks(a, b, w):
+    """兩個 LandmarkFrame 之間線性內插（w=0 → a, 1 → b）；任一端沒有人則為 None。"""
+    if a is None or b is None:
+        return None
+    return LandmarkFrame(a.norm + np.float32(w) * (b.norm - a.norm), a.W, a.H)
+
+
+class AdaptivePoseScheduler:
+    """
+    依 detector 狀態調整推論頻率的 pose 段（取代 _pose_stage）：
+    - detector.is_idle(landmarks, W, H) 為 True（提踵 IDLE/COOLDOWN 且腳跟貼地、深蹲未入回合且站直）
+      → 每 max_stride 幀推論一次；其餘（CALIB / RAISING / HOLDING / in_rep）每幀推論
+    - 兩個關鍵幀之間的幀先暫存，等下一個關鍵幀推論完，以線性內插補上關鍵點後依序送出（順序不變）
+    - 要不要補推論得在關鍵幀進追蹤圖「之前」決定：上一個關鍵幀 idle 且暫存幀都有畫面時，
+      先以另一個 static_image_mode 的 probe Pose 看關鍵幀（不動 video mode 圖的追蹤 ROI / 平滑狀態）；
+      probe 判定已離開 idle（動作在區間內開始）→ 暫存幀逐幀補推論，再推論關鍵幀，
+      追蹤圖看到的幀號嚴格遞增；回合的起點因此仍是真實推論結果
+    - wants_frame(idx)：decode 段據此決定是否只 cap.grab()。只 grab 的幀沒有畫面、無法補推論，
+      動作在這種區間內開始時只能內插（最多 max_stride - 1 幀，下一個關鍵幀起即逐幀推論）；
+      這類幀數（以及 probe 判為 idle、追蹤圖結果卻不是的區間）記在 stats() 的 "unrefined"
+    - probe: static_image_mode 的 Pose；None 時第一次需要才以 make_pose 建立，close() 一併關閉
+    detector 在下游 render 段更新；管線並行時狀態最多落後佇列深度幾幀，只會讓全速多維持幾幀。
+    """
+    def __init__(self, pose, detector, max_stride=4, probe=None):
+        self.infer = _pose_stage(pose)
+        self.probe = probe
+        self._own_probe = probe is None
+        self._probe_stage = None
+        self.detector = detector
+        self.max_stride = max(1, int(max_stride))
+        self.stride = 1
+        self.key = None             # 上一個關鍵幀
+        self.key_idle = False
+        self.pending = []
+        self.frames = self.inferred = self.probed = self.refined = self.unrefined = 0
+
+    def wants_frame(self, idx):
+        return self.key is None or idx - self.key.idx >= self.stride
+
+    def _infer(self, pkt):
+        self.inferred += 1
+        return self.infer(pkt)
+
+    def _probe_idle(self, pkt):
+        """以 probe Pose 單張推論關鍵幀並判斷 idle；結果稍後會被追蹤圖的推論覆寫。"""
+        if self._probe_stage is None:
+            if self.probe is None:
+                self.probe = make_pose(static_image_mode=True)
+            self._probe_stage = _pose_stage(self.probe)
+        self.probed += 1
+        return self._is_idle(self._probe_stage(pkt))
+
+    def _is_idle(self, pkt):
+        if pkt.landmarks is None:   # 畫面中持續沒有人也算 idle；人剛出現/消失則否
+            return self.key is not None and self.key.landmarks is None
+        return bool(self.detector.is_idle(pkt.landmarks, pkt.W, pkt.H))
+
+    def _resolve(self, key):
+        gap, self.pending = self.pending, []
+        refine = False
+        if gap and all(p.frame is not None for p in gap):
+            refine = not self.key_idle or not self._probe_idle(key)
+        if refine:
+            for p in gap:
+                self._infer(p)
+            self.refined += len(gap)
+        self._infer(key)
+        idle = self._is_idle(key)
+        if gap and not refine:
+            if not (idle and self.key_idle):
+                self.unrefined += len(gap)
+            a = self.key
+            for p in gap:
+                w = (p.idx - a.idx) / float(key.idx - a.idx)
+                p.raw_landmarks = _lerp_landmarks(a.raw_landmarks, key.raw_landmarks, w)
+                if p.stab_A is not None and p.raw_landmarks is not None:
+                    p.landmarks = apply_affine_to_landmarks(p.raw_landmarks, p.stab_A)
+                else:
+                    p.landmarks = _lerp_landmarks(a.landmarks, key.landmarks, w)
+        self.key, self.key_idle = key, idle
+        self.stride = self.max_stride if idle else 1
+        gap.append(key)
+        return gap
+
+    def __call__(self, pkt):
+        self.frames += 1
+        if pkt.frame is None or not self.wants_frame(pkt.idx):
+            self.pending.append(pkt)
+            return None
+        return self._resolve(pkt)
+
+    def flush(self):
+        """串流結束：尾端暫存幀以最後一幀（有畫面時）為關鍵幀補齊，否則沿用上一個關鍵幀的結果。"""
+        if not self.pending:
+            return None
+        tail = self.pending[-1]
+        if tail.frame is not None:
+            self.pending.pop()
+            return self._resolve(tail)
+        gap, self.pending = self.pending, []
+        for p in gap:
+            p.raw_landmarks, p.landmarks = self.key.raw_landmarks, self.key.landmarks
+        return gap
+
+    def stats(self):
+        return {"max_stride": self.max_stride, "frames": self.frames, "inferred": self.inferred,
+                "probed": self.probed, "refined": self.refined, "unrefined": self.unrefined,
+                "ratio": round(self.inferred / self.frames, 3) if self.frames else 0.0}
+
+    def close(self):
+        """關閉自己建立的 probe Pose（外部傳入的 probe 由呼叫端負責）。"""
+        if self._own_probe and self.probe is not None:
+            self.probe.close()
+            self.probe = None
+        self._probe_stage = None
+
+
+def _stab_stage(stab, max_h=None):
+    """decode 之後的第一段：（可選）縮到 max_h，再做防手震；stab=None 表示關閉。"""
+    def run(pkt):
+        frame = pkt.frame
+        if frame is None:       # 未解碼的幀：只讓防手震的幀序前進
+            if stab is not None:
+                stab.skip_frame()
+            return pkt
+        if max_h is not None:
+            # 若輸入過大，先縮到高度 max_h 再做防手震（4K 不必在原解析度上估計/warp）
+            frame, pkt.W, pkt.H, _scaled = resize_to_max_height(frame, max_h=max_h)
+        if stab is not None:
+            frame, pkt.stab_mag = stab.stabilize(frame)
+            pkt.stab_A = stab.landmark_transform()
+        pkt.frame = frame
+        return pkt
+    return run
+
+
+# ==============================
+# Pose 關鍵點快取（影片內容雜湊 + Pose 參數 + 防手震設定）
+# ==============================
+
+POSE_CACHE_VERSION = 2     # 2: 另存與畫面像素對齊的 raw 關鍵點（landmarks 防手震模式）
+
+
+def landmarks_to_array(landmark_list):
+    """NormalizedLandmarkList → (33, 4) float32 [x, y, z, visibility]。"""
+    return np.array([(lm.x, lm.y, lm.z, lm.visibility) for lm in landmark_list.landmark], dtype=np.float32)
+
+
+def landmarks_from_array(arr):
+    """(33, 4) 陣列 → NormalizedLandmarkList（給需要 protobuf 的外部工具）。"""
+    from mediapipe.framework.formats import landmark_pb2
+    out = landmark_pb2.NormalizedLandmarkList()
+    for x, y, z, v in arr.tolist():
+        out.landmark.add(x=x, y=y, z=z, visibility=v)
+    return out
+
+
+class PoseTrack:
+    """
+    一支影片（自 start_frame 起）逐幀的 pose 結果：
+    - landmarks: (T, 33, 4) float32，已套用防手震（即 detector 實際收到的座標）
+    - present:   (T,) bool，該幀是否偵測到人
+    - t:         (T,) float64，影片時間（秒）
+    - stab_mag:  (T,) float32，防手震位移（HUD 用）
+    - size=(W, H)：關鍵點換算像素時的畫面大小；fps：來源 fps
+    - raw:       (T, 33, 4) 推論原始結果（與未校正畫面像素對齊，畫骨架用）；
+                 None = 同 landmarks（warp / off 模式，畫面本身已校正）
+    """
+    def __init__(self, landmarks, present, t, stab_mag, size, fps, start_frame=0, raw=None):
+        self.landmarks = np.asarray(landmarks, dtype=np.float32).reshape(-1, 33, 4)
+        self.raw = None if raw is None or not len(raw) else np.asarray(raw, dtype=np.float32).reshape(-1, 33, 4)
+        self.present = np.asarray(present, dtype=bool)
+        self.t = np.asarray(t, dtype=np.float64)
+        self.stab_mag = np.asarray(stab_mag, dtype=np.float32)
+        self.size = (int(size[0]), int(size[1]))
+        self.fps = float(fps)
+        self.start_frame = int(start_frame)
+
+    def __len__(self):
+        return len(self.present)
+
+    def landmark_frame(self, i):
+        if 0 <= i < len(self.present) and self.present[i]:
+            return LandmarkFrame(self.landmarks[i], *self.size)
+        return None
+
+    def raw_landmark_frame(self, i):
+        """畫骨架用的關鍵點（與畫面像素對齊）。"""
+        if self.raw is None:
+            return self.landmark_frame(i)
+        if 0 <= i < len(self.present) and self.present[i]:
+            return LandmarkFrame(self.raw[i], *self.size)
+        return None
+
+    def joint_angles(self, pixels=True):
+        """整段的 pose_joint_angles（預設以像素座標）；沒偵測到人的幀為 NaN。"""
+        out = pose_joint_angles(self.landmarks, self.size if pixels else None)
+        for v in out.values():
+            v[~self.present] = np.nan
+        return out
+
+    def save(self, path):
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, version=POSE_CACHE_VERSION, landmarks=self.landmarks, present=self.present,
+                            t=self.t, stab_mag=self.stab_mag, size=np.array(self.size), fps=self.fps,
+                            start_frame=self.start_frame,
+                            raw=np.zeros((0, 33, 4), np.float32) if self.raw is None else self.raw)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            if int(z["version"]) != POSE_CACHE_VERSION:
+                raise ValueError("pose cache version mismatch")
+            return cls(z["landmarks"], z["present"], z["t"], z["stab_mag"], tuple(z["size"]),
+                       float(z["fps"]), int(z["start_frame"]), raw=z["raw"])
+
+
+class PoseTrackRecorder:
+    """pose 段依序收集每幀結果，結束時組成 PoseTrack。"""
+    def __init__(self):
+        self.landmarks, self.present, self.t, self.stab_mag = [], [], [], []
+        self.raw = {}           # 只記與 landmarks 不同的幀（landmarks 防手震模式）
+        self.size = None
+
+    def add(self, pkt):
+        if pkt.raw_landmarks is not pkt.landmarks and pkt.raw_landmarks is not None:
+            self.raw[len(self.present)] = pkt.raw_landmarks.norm
+        if pkt.landmarks is not None:
+            self.landmarks.append(pkt.landmarks.norm)
+            self.present.append(True)
+        else:
+            self.landmarks.append(np.zeros((33, 4), np.float32))
+            self.present.append(False)
+        self.t.append(pkt.t)
+        self.stab_mag.append(pkt.stab_mag)
+        self.size = self.size or (pkt.W, pkt.H)
+
+    def build(self, fps, start_frame=0):
+        lm = np.stack(self.landmarks) if self.landmarks else np.zeros((0, 33, 4), np.float32)
+        raw = None
+        if self.raw:
+            raw = lm.copy()
+            for i, norm in self.raw.items():
+                raw[i] = norm
+        return PoseTrack(lm, self.present, self.t, self.stab_mag, self.size or (0, 0), fps, start_frame, raw=raw)
+
+
+def pose_cache_path(video_path, start_sec=0.0, stab_mode="warp", stab_two_pass=False, max_h=720,
+                    adaptive_stride=1, end_sec=None, chunking=None):
+    """
+    快取檔路徑：內容雜湊 + (Pose 參數, 防手震設定, 處理解析度, 起點 / 終點) 的摘要。
+    adaptive_stride > 1（部分幀為內插）與 chunking=(chunk_s, overlap_s)（分塊平行推論後串接）
+    各自另存一份，不與單一行程逐幀推論的快取混用。
+    """
+    spec = {
+        "v": POSE_CACHE_VERSION,
+        "mediapipe": _mediapipe_version(),
+        "pose": POSE_KWARGS,
+        "stab": stab_mode, "stab_two_pass": bool(stab_two_pass),
+        "max_h": int(max_h), "start": round(float(start_sec), 3),
+    }
+    if int(adaptive_stride) > 1:
+        spec["adaptive_stride"] = int(adaptive_stride)
+    if end_sec is not None:
+        spec["end"] = round(float(end_sec), 3)
+    if chunking is not None:
+        spec["chunking"] = [round(float(v), 3) for v in chunking]
+    digest = hashlib.sha1(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:12]
+    return os.path.join(cache_dir(), f"{video_content_hash(video_path)}_pose_{digest}.npz")
+
+
+def load_pose_track(path):
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return PoseTrack.load(path)
+    except Exception as e:
+        print(f"[warn] 關鍵點快取無法讀取（{e}），重新推論")
+        return None
+
+
+def _emit_score_events(sink, track, score, **fields):
+    """score_session 的回合結果寫進 RepEventSink（與逐幀 detector 的事件同格式）。"""
+    log = RepEventLog(sink, frame_offset=track.start_frame, **fields)
+    for r in score["reps"]:
+        log.at(r["frame"], float(track.t[r["frame"]]))
+        log.rep(**{k: v for k, v in r.items() if k != "frame"})
+
+
+def replay_pose_track(track, detector):
+    """不解碼、不推論：直接把快取的關鍵點依序餵給 detector（逐幀版；整段評分請用 score_session）。"""
+    W, H = track.size
+    for i in np.flatnonzero(track.present):
+        detector.process_frame(track.landmark_frame(int(i)), None, W, H)
+
+
+OVERLAY_SIDECAR_VERSION = 1
+
+
+def overlay_sidecar_path(video_path):
+    """延後疊圖錄影的側檔：<原始影片>_overlay.npz。"""
+    return os.path.splitext(video_path)[0] + "_overlay.npz"
+
+
+class OverlaySidecar:
+    """
+    延後疊圖的逐幀側檔（第 i 筆對應原始錄影第 i 幀）：
+    - track: PoseTrack（detector 實際收到的關鍵點、畫骨架用的 raw、t、stab_mag、size、fps）
+    - counts: (T, 2) int32 該幀處理後的成功 / 失敗數；state: (T,) 狀態字串；deg: (T,) float32 HUD 角度（NaN = 無）
+    - action；footer: 右下角文字；clock: 錄影時 detector 是否收到擷取時刻 t（重播時照做）
+    """
+    def __init__(self, track, counts, state, deg, action, footer, clock=True):
+        self.track = track
+        self.counts = np.asarray(counts, dtype=np.int32).reshape(-1, 2)
+        self.state = np.asarray(state, dtype=str)
+        self.deg = np.asarray(deg, dtype=np.float32)
+        self.action = action
+        self.footer = list(footer)
+        self.clock = bool(clock)
+
+    def __len__(self):
+        return len(self.track)
+
+    def raw_frame(self, i):
+        return self.track.raw_landmark_frame(i)
+
+    def save(self, path):
+        tr = self.track
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, version=OVERLAY_SIDECAR_VERSION, landmarks=tr.landmarks, present=tr.present,
+                            t=tr.t, stab_mag=tr.stab_mag, size=np.array(tr.size), fps=tr.fps,
+                            raw=np.zeros((0, 33, 4), np.float32) if tr.raw is None else tr.raw,
+                            counts=self.counts, state=self.state, deg=self.deg, action=self.action,
+                            footer=np.array(self.footer), clock=self.clock)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            if int(z["version"]) != OVERLAY_SIDECAR_VERSION:
+                raise ValueError("overlay sidecar version mismatch")
+            track = PoseTrack(z["landmarks"], z["present"], z["t"], z["stab_mag"], tuple(z["size"]), float(z["fps"]),
+                              raw=z["raw"])
+            return cls(track, z["counts"], z["state"], z["deg"], str(z["action"]),
+                       [str(x) for x in z["footer"]], bool(z["clock"]))
+
+
+class OverlaySidecarRecorder:
+    """即時管線的 analyze 段逐幀呼叫 add(pkt, detector)（detector 已處理本幀之後）。"""
+    def __init__(self, action, footer, clock=True):
+        self.action, self.footer, self.clock = action, list(footer), clock
+        self.poses = PoseTrackRecorder()
+        self.counts, self.state, self.deg = [], [], []
+
+    def add(self, pkt, detector):
+        self.poses.add(pkt)
+        ok, ng, _ = detector.get_counts()
+        state, deg = detector.hud_values()
+        self.counts.append((ok, ng))
+        self.state.append(state)
+        self.deg.append(np.nan if deg is None else deg)
+
+    def build(self, fps):
+        return OverlaySidecar(self.poses.build(fps), np.array(self.counts, np.int32).reshape(-1, 2), self.state, self.deg,
+                              self.action, self.footer, self.clock)
+
+
+def _raw_video_opts(video_opts):
+    """延後疊圖的原始錄影要逐幀對應側檔：拿掉 every（抽幀）。"""
+    video_opts = dict(video_opts or {})
+    if int(video_opts.pop("every", 1) or 1) != 1:
+        print("[warn] 延後疊圖的原始錄影需逐幀對應側檔，忽略抽幀設定")
+    return video_opts
+
+
+def _draw_live_overlay(image, landmarks, raw_landmarks, detector, t, footer):
+    """即時錄影的疊圖：骨架 → detector HUD（同時更新狀態）→ draw_overlay → 右下角文字。render_overlay 事後重現共用。"""
+    H, W = image.shape[:2]
+    if landmarks:
+        _draw_pose(image, raw_landmarks)
+        image = detector.process_frame(landmarks, image, W, H, t=t)
+    image = detector.draw_overlay(image, W, H)
+    return draw_text_block(image, footer, anchor='rb', margin=16, color=(0, 255, 0), max_font_px=20,
+                           min_font_px=14, line_gap=4, stroke=2)
+
+
+def _draw_live_preview(image, detector, footer):
+    """延後疊圖模式的預覽：只畫一行計數（不進錄影），省下即時疊圖的成本。"""
+    ok, ng, total = detector.get_counts()
+    state, deg = detector.hud_values()
+    lines = [f"成功 {ok}  失敗 {ng}  總數 {total}  {state}  {'--' if deg is None else f'{deg:.1f}°'}"] + footer[-1:]
+    return draw_text_block(image, lines, anchor='rb', margin=16, color=(0, 255, 0), max_font_px=20,
+                           min_font_px=14, line_gap=4, stroke=2)
+
+
+def render_overlay(video_path, sidecar_path=None, out_path=None, height=None, show=False, video_opts=None):
+    """
+    延後疊圖：讀原始錄影 + 側檔，重播 detector 畫出與即時錄影相同的疊圖（不推論，速度不受即時限制）。
+    - detector 以錄影時的解析度與擷取時刻重播，狀態與計數與現場一致；逐幀與側檔的 counts 比對，不一致列在 "mismatch"
+    - height: 輸出高度（預設 = 錄影解析度）；疊圖畫完後由編碼執行緒整張縮放（優先於 video_opts 的 scale）
+    - out_path: 預設 <原始影片>_rendered.mp4；各段耗時另存 <輸出檔>_timing.json
+    - video_opts: 輸出影片設定（見 AsyncVideoWriter）
+    回傳摘要 dict；影片 / 側檔無法開啟時回傳 None。
+    """
+    sidecar_path = sidecar_path or overlay_sidecar_path(video_path)
+    try:
+        sc = OverlaySidecar.load(sidecar_path)
+    except Exception as e:
+        print(f"無法讀取側檔: {sidecar_path}（{e}）")
+        return None
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"無法開啟影片: {video_path}")
+        return None
+
+    W, H = sc.track.size
+    fps = sc.track.fps
+    video_opts = dict(video_opts or {})
+    if height:
+        video_opts["scale"] = float(height) / H
+    timer = StageTimer()
+    out = AsyncVideoWriter(out_path or os.path.splitext(video_path)[0] + "_rendered.mp4", fps, (W, H), timer=timer,
+                           **video_opts)
+    out_path = out.path
+    detector, _ = make_detector(sc.action, fps)
+    detector.events = RepEventLog(_ListSink())      # 回合已在錄影時記錄過；重播不再 print [... LOG]
+    mismatch = []
+
+    def render(pkt):
+        i = pkt.idx
+        image = pkt.frame
+        if (pkt.W, pkt.H) != (W, H):
+            image = cv2.resize(image, (W, H), interpolation=cv2.INTER_LINEAR)
+        t = float(sc.track.t[i]) if sc.clock else None
+        image = _draw_live_overlay(image, sc.track.landmark_frame(i), sc.raw_frame(i), detector, t, sc.footer)
+        if detector.get_counts()[:2] != tuple(sc.counts[i].tolist()):
+            mismatch.append(i)
+        pkt.frame = image
+        return pkt
+
+    def encode(pkt):
+        out.write(pkt.frame)
+        return pkt
+
+    t0 = time.perf_counter()
+    pipe = StagePipeline(read_packets(cap, limit=len(sc)), [("render", render), ("encode", encode)], timer=timer)
+    try:
+        for pkt in pipe:
+            timer.tick(pkt)
+            if show:
+                cv2.imshow("Rehab Render", pkt.frame)
+                if (cv2.waitKey(1) & 0xFF) in (27, ord('q'), ord('Q')):
+                    break
+    finally:
+        pipe.close()
+        cap.release(); out.release()
+        if show:
+            cv2.destroyAllWindows()
+
+    elapsed = time.perf_counter() - t0
+    prof = timer.dump(os.path.splitext(out_path)[0] + "_timing.json", source=video_path, action=sc.action,
+                      src_fps=fps, size=[W, H], encoder=out.stats())
+    ok, ng, total = detector.get_counts()
+    result = {"video": video_path, "sidecar": sidecar_path, "outfile": out_path, "action": sc.action,
+              "frames": prof["frames"], "sidecar_frames": len(sc), "success": ok, "fail": ng, "total": total,
+              "elapsed_s": round(elapsed, 3), "fps": prof["fps"], "speedup": round(prof["fps"] / fps, 2),
+              "mismatch": len(mismatch), "first_mismatch": mismatch[0] if mismatch else None,
+              "encoder": out.stats()}
+    if mismatch:
+        print(f"[warn] 重播計數與側檔不一致：{len(mismatch)} 幀（第一幀 {mismatch[0]}）")
+    print(f"已輸出: {out_path}（{prof['frames']} 幀，{prof['fps']:.1f} fps ≈ 即時 ×{result['speedup']}）")
+    return result
+
+
 # ==============================
 # 即時攝影機錄影（僅兩動作）
 # ==============================
 
-def run_live_record(selected_action):
+def run_live_record(selected_action, stab_mode="warp", debug_hud=False, defer_overlay=False, video_opts=None,
+                    pose=None, startup=None):
+    """
+    即時錄影；預覽中按 D 切換各段耗時 HUD（不會錄進影片），結束時輸出 *_timing.json。
+    defer_overlay: 錄影只寫原始畫面（*_raw.mp4）+ 逐幀側檔（*_raw_overlay.npz：關鍵點、detector 狀態、HUD 數值），
+    現場不畫疊圖、預覽只顯示計數；標註影片事後以 render_overlay 產生。
+    video_opts: 輸出影片設定（見 AsyncVideoWriter）；編碼在背景執行緒，不拖住推論。
+    pose: 外部提供（已預熱）的 Pose，不會在此關閉；None 則自建。
+    startup: 啟動階段的量測（PosePrewarm.stats() 等）；本函式補上「啟動 → 第一幀 / 第一個計數幀」秒數，
+    一併寫進 *_timing.json 的 meta.startup。
+    """
     cap = cv2.VideoCapture(0)
-    stab = GlobalStab()
+    stab = make_stab(stab_mode)
     if not cap.isOpened():
         print("Error: 無法開啟攝影機(0)")
         return
@@ -1080,90 +3516,691 @@ def run_live_record(selected_action):
 
     frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 1280)
     frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 720)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    try:
-        fps = float(fps)
-        if fps <= 0 or fps > 120:
-            fps = 30.0
-    except Exception:
-        fps = 30.0
+    fps = _sanitize_fps(cap.get(cv2.CAP_PROP_FPS))
 
-    if selected_action == "squat_hip_height":
-        detector = SquatKneeAngleThresholdDetector(
-    stand_up_deg=170.0,
-    succ_min_deg=95.0, succ_max_deg=135.0,
-    fail_min_deg=136.0, fail_max_deg=162.0,
-    ema_alpha=0.35, standard_deg=135.0
-)
-        action_name = "深蹲 (角度法)"
-    elif selected_action == "calf_raise":
-        # 先沿用先前的 1/2 角度縮放（俯視壓縮）
-        detector = CalfRaiseDetector(A_min=7.5, A_max=45.0, hold_seconds=3.0, ema_alpha=0.35, standard_deg=15.0)
-        detector.fixed_fps = fps   # ← 新增：使用攝影機回報或 fallback 後的 fps
-        action_name = "提踵 (地面參考)"
-    else:
+    detector, action_name = make_detector(selected_action, fps)
+    if detector is None:
         print(f"未知動作: {selected_action}")
         cap.release(); return
 
     ts = cv2.getTickCount()
     out_dir = os.path.join(os.getcwd(), "output"); os.makedirs(out_dir, exist_ok=True)
-    outfile = os.path.join(out_dir, f"live_{action_name}_{int(ts)}.mp4")
+    outfile = os.path.join(out_dir, f"live_{action_name}_{int(ts)}{'_raw' if defer_overlay else ''}.mp4")
 
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(outfile, fourcc, fps, (frame_width, frame_height))
+    timer = StageTimer()
+    if defer_overlay:
+        video_opts = _raw_video_opts(video_opts)
+    out = AsyncVideoWriter(outfile, fps, (frame_width, frame_height), timer=timer, **(video_opts or {}))
+    outfile = out.path
 
-    pose = mp_pose.Pose(static_image_mode=False, model_complexity=1, smooth_landmarks=True,
-                        min_detection_confidence=0.5, min_tracking_confidence=0.5, enable_segmentation=False)
+    own_pose = pose is None
+    if own_pose:
+        pose = make_pose()
+    startup = dict(startup or {}, pipeline_start_s=_since_launch())
+    events = RepEventSink(os.path.splitext(outfile)[0] + "_events.jsonl", buffer=1)   # 即時：每回合立即落檔
+    log = detector.events = RepEventLog(events, video="camera:0", action=selected_action)
 
     print(f"攝影機解析度: {frame_width}x{frame_height} @ {fps:.1f}fps")
     print(f"輸出檔案: {outfile}")
-    print("按 Q 或 ESC 結束")
+    print("按 Q 或 ESC 結束（D：耗時 HUD）")
+
+    footer = [f"{action_name} - 即時錄影", "LIVE REC ● 按 Q/ESC 結束"]
+    sidecar = OverlaySidecarRecorder(selected_action, footer) if defer_overlay else None
+
+    def render(pkt):
+        log.at(pkt.idx, pkt.t)
+        pkt.frame = _draw_live_overlay(pkt.frame, pkt.landmarks, pkt.raw_landmarks, detector, pkt.t, footer)
+        return pkt
+
+    def analyze(pkt):
+        # 延後疊圖：只更新 detector 並記錄側檔，畫面原樣寫出
+        log.at(pkt.idx, pkt.t)
+        if pkt.landmarks:
+            detector.process_frame(pkt.landmarks, None, pkt.W, pkt.H, t=pkt.t)
+        sidecar.add(pkt, detector)
+        return pkt
+
+    def encode(pkt):
+        out.write(pkt.frame)
+        return pkt
+
+    # --- stabilize frame before pose detection ---
+    # 擷取獨立一條執行緒、只留最新幀；段間佇列 1 格，處理永遠拿最新的畫面
+    grabber = LatestFrameGrabber(cap)
+    pipe = StagePipeline(grabber, [("stabilize", _stab_stage(stab)), ("pose", _pose_stage(pose)),
+                                   ("analyze", analyze) if defer_overlay else ("render", render),
+                                   ("encode", encode)], maxsize=1, timer=timer)
+    try:
+        for pkt in pipe:
+            timer.tick(pkt)
+            if "first_frame_s" not in startup:
+                startup["first_frame_s"] = _since_launch()
+            if pkt.landmarks and "first_counted_s" not in startup:
+                startup["first_counted_s"] = _since_launch()
+                print(f"啟動 → 第一個計數幀: {startup['first_counted_s']:.2f}s")
+            t0 = time.perf_counter_ns()
+            view = _draw_live_preview(pkt.frame, detector, footer) if defer_overlay else pkt.frame
+            view = _draw_timing_hud(view, timer, anchor='rt', landmarks=pkt.landmarks) if debug_hud else view   # encode 已寫出，畫上去不會進影片
+            cv2.imshow("Rehab Live", view)
+            key = cv2.waitKey(1) & 0xFF
+            timer.record("display", time.perf_counter_ns() - t0)
+            if key in (27, ord('q'), ord('Q')):
+                break
+            if key in (ord('d'), ord('D')):
+                debug_hud = not debug_hud
+    finally:
+        pipe.close()
+        grabber.stop()
+        if own_pose:
+            pose.close()
+        events.close()
+        cap.release(); out.release(); cv2.destroyAllWindows()
+
+    print(f"已儲存: {outfile}（回合事件: {events.path}）")
+    if sidecar is not None:
+        sidecar_path = overlay_sidecar_path(outfile)
+        sidecar.build(fps).save(sidecar_path)
+        print(f"疊圖側檔: {sidecar_path}（標註影片: python <本檔> render {outfile}）")
+    timing_path = os.path.splitext(outfile)[0] + "_timing.json"
+    capture = grabber.stats()
+    prof = timer.dump(timing_path, source="camera:0", action=selected_action, src_fps=fps,
+                      size=[frame_width, frame_height], stab_mode=stab_mode, capture=capture,
+                      defer_overlay=defer_overlay, encoder=out.stats(), startup=startup)
+    print(f"耗時分析: {timing_path}（{prof['fps']:.1f} fps，瓶頸: {prof['bottleneck']}，"
+          f"丟棄舊幀 {capture['dropped']}/{capture['captured']}）")
 
-    while True:
-        ret, frame = cap.read()
-        # --- stabilize frame before pose detection ---
-        _stab_mag = 0.0
-        if ret:
-            frame, _stab_mag = stab.stabilize(frame)
-        if not ret:
-            break
 
-        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        image.flags.writeable = False
-        results = pose.process(image)
-        image.flags.writeable = True
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+# ==============================
+# 多攝影機即時（pose 推論執行緒池限制同時推論數）
+# ==============================
 
-        if results.pose_landmarks:
-            ld = get_landmark_dict(results.pose_landmarks.landmark)
-            mp_drawing.draw_landmarks(image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
-                                    mp_drawing.DrawingSpec(color=(245,117,66), thickness=2, circle_radius=2),
-                                    mp_drawing.DrawingSpec(color=(245,66,230), thickness=2, circle_radius=2))
-            image = detector.process_frame(results.pose_landmarks.landmark, image, frame_width, frame_height)
+class PoseWorkerPool:
+    """
+    固定大小的 pose 推論執行緒池：限制多個工作站「同時」推論的數量（CPU 上限），不共用模型。
+    - 每個 worker 是單執行緒 executor；工作站固定分配給負載最少的 worker（sticky），
+      同一站的幀依序在同一條執行緒上推論
+    - Pose 圖仍是每站一份（在 worker 執行緒內建立）：影片模式的追蹤 / 平滑狀態綁在圖裡，
+      不能跨攝影機共用；記憶體與模型載入隨工作站數成長，池大小只決定同時推論的數量
+    """
+    def __init__(self, size=None):
+        self.size = max(1, int(size or max(1, (os.cpu_count() or 1) // 2)))
+        self._execs = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"pose-{i}") for i in range(self.size)]
+        self._graphs = [{} for _ in range(self.size)]      # worker -> {station: (Pose, _pose_stage)}
+        self._assigned = {}
+        self._lock = threading.Lock()
+        self.graph_count = 0        # 建過的 Pose 圖數（= 有推論過的工作站數）
+
+    def assign(self, station):
+        with self._lock:
+            if station not in self._assigned:
+                load = [0] * self.size
+                for w in self._assigned.values():
+                    load[w] += 1
+                self._assigned[station] = load.index(min(load))
+            return self._assigned[station]
+
+    def _run(self, w, station, pkt, submitted_ns, timer):
+        if timer is not None:
+            timer.record("pose_queue", time.perf_counter_ns() - submitted_ns)
+        graphs = self._graphs[w]
+        if station not in graphs:
+            pose = make_pose()
+            graphs[station] = (pose, _pose_stage(pose))
+            with self._lock:
+                self.graph_count += 1
+        return graphs[station][1](pkt)
+
+    def stage(self, station, timer=None):
+        """回傳該工作站的 pose 段（送進池並等待結果）；timer 另記池內排隊時間 "pose_queue"。"""
+        w = self.assign(station)
+        ex = self._execs[w]
+
+        def run(pkt):
+            return ex.submit(self._run, w, station, pkt, time.perf_counter_ns(), timer).result()
+        return run
+
+    def _close_graphs(self, w):
+        for pose, _stage in self._graphs[w].values():
+            pose.close()
+        self._graphs[w].clear()
+
+    def close(self):
+        for w, ex in enumerate(self._execs):
+            ex.submit(self._close_graphs, w).result()
+            ex.shutdown(wait=True)
+
+
+def parse_live_source(src):
+    """"0" / "1" → 攝影機索引；其他（檔案路徑、rtsp:// 等 URL）原樣交給 cv2.VideoCapture。"""
+    src = str(src).strip()
+    return int(src) if src.isdigit() else src
+
+
+class LiveStation:
+    """
+    一個工作站：自己的來源 / detector / 防手震 / 輸出影片 / StageTimer / Pose 圖，推論排進 PoseWorkerPool。
+    管線與 run_live_record 相同；另有一條取用執行緒把最新一幀交給主執行緒的拼貼預覽。
+    defer_overlay: 只錄原始畫面 + 側檔（見 run_live_record），預覽只畫計數。
+    """
+    def __init__(self, sid, source, selected_action, pool, stab_mode="warp", out_dir=None, tag=None, events=None,
+                 defer_overlay=False, video_opts=None):
+        self.sid, self.source = sid, source
+        self.cap = cv2.VideoCapture(source)
+        if not self.cap.isOpened():
+            raise IOError(f"無法開啟來源: {source}")
+        if isinstance(source, int):
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+        self.W = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 1280)
+        self.H = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 720)
+        self.fps = _sanitize_fps(self.cap.get(cv2.CAP_PROP_FPS))
+        self.selected_action, self.stab_mode = selected_action, stab_mode
+        self.detector, self.action_name = make_detector(selected_action, self.fps)
+        self.log = None
+        if events is not None:
+            self.log = self.detector.events = RepEventLog(events, video=str(source), station=sid,
+                                                          action=selected_action)
+
+        out_dir = out_dir or os.path.join(os.getcwd(), "output")
+        os.makedirs(out_dir, exist_ok=True)
+        self.outfile = os.path.join(out_dir, f"live_{self.action_name}_s{sid}_{tag or int(time.time())}"
+                                             f"{'_raw' if defer_overlay else ''}.mp4")
+        self.timer = StageTimer()
+        if defer_overlay:
+            video_opts = _raw_video_opts(video_opts)
+        self.out = AsyncVideoWriter(self.outfile, self.fps, (self.W, self.H), timer=self.timer, **(video_opts or {}))
+        self.outfile = self.out.path
+
+        self.latest = None      # 最新一幀（已寫出），主執行緒拼貼預覽用
+        self.error = None
+        # 攝影機 / 串流只處理最新幀；影片檔當作重播來源，逐幀讀取不丟幀
+        self.grabber = None if (isinstance(source, str) and os.path.isfile(source)) else LatestFrameGrabber(self.cap)
+        self.footer = [f"{self.action_name} - 工作站 {sid}", "LIVE REC ●"]
+        self.sidecar = None
+        if defer_overlay:
+            self.sidecar = OverlaySidecarRecorder(selected_action, self.footer, clock=self.grabber is not None)
+        stages = [("stabilize", _stab_stage(make_stab(stab_mode))), ("pose", pool.stage(sid, self.timer)),
+                  ("analyze", self._analyze) if defer_overlay else ("render", self._render),
+                  ("encode", self._encode)]
+        if self.grabber is not None:
+            self.pipe = StagePipeline(self.grabber, stages, maxsize=1, timer=self.timer)
+        else:
+            self.pipe = StagePipeline(read_packets(self.cap), stages, timer=self.timer)
+        self._thread = threading.Thread(target=self._consume, name=f"station-{sid}", daemon=True)
+
+    def _render(self, pkt):
+        if self.log is not None:
+            self.log.at(pkt.idx, pkt.t)
+        t = pkt.t if self.grabber is not None else None
+        pkt.frame = _draw_live_overlay(pkt.frame, pkt.landmarks, pkt.raw_landmarks, self.detector, t, self.footer)
+        return pkt
+
+    def _analyze(self, pkt):
+        if self.log is not None:
+            self.log.at(pkt.idx, pkt.t)
+        if pkt.landmarks:
+            t = pkt.t if self.grabber is not None else None
+            self.detector.process_frame(pkt.landmarks, None, pkt.W, pkt.H, t=t)
+        self.sidecar.add(pkt, self.detector)
+        return pkt
+
+    def _encode(self, pkt):
+        self.out.write(pkt.frame)
+        return pkt
+
+    def _consume(self):
+        try:
+            for pkt in self.pipe:
+                self.timer.tick(pkt)
+                self.latest = pkt.frame if self.sidecar is None else \
+                    _draw_live_preview(pkt.frame, self.detector, self.footer)
+        except Exception as e:
+            self.error = e
+
+    def start(self):
+        self._thread.start()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def status_line(self):
+        lat = self.timer.snapshot().get("latency", {})
+        ok, ng, total = self.detector.get_counts()
+        return (f"S{self.sid} {self.timer.rolling_fps():4.1f}/{self.fps:.0f}fps "
+                f"lat {lat.get('p50_ms', 0):.0f}/{lat.get('p95_ms', 0):.0f}ms  ok {ok} ng {ng}")
+
+    def stop(self):
+        self.pipe.close()
+        self._thread.join(timeout=5.0)
+        if self.grabber is not None:
+            self.grabber.stop()
+        self.cap.release()
+        self.out.release()
+        if self.sidecar is not None:
+            self.sidecar.build(self.fps).save(overlay_sidecar_path(self.outfile))
+
+    def summary(self):
+        """停止後呼叫：寫 <輸出檔>_timing.json，回傳計數與 FPS / 延遲摘要。"""
+        prof = self.timer.dump(os.path.splitext(self.outfile)[0] + "_timing.json", source=str(self.source),
+                               station=self.sid, action=self.selected_action, src_fps=self.fps,
+                               size=[self.W, self.H], stab_mode=self.stab_mode,
+                               capture=self.grabber.stats() if self.grabber is not None else None,
+                               defer_overlay=self.sidecar is not None, encoder=self.out.stats())
+        lat = prof["stages"].get("latency", {})
+        ok, ng, total = self.detector.get_counts()
+        return {"station": self.sid, "source": str(self.source), "outfile": self.outfile,
+                "sidecar": overlay_sidecar_path(self.outfile) if self.sidecar is not None else None,
+                "success": ok, "fail": ng, "total": total, "frames": prof["frames"],
+                "fps": prof["fps"], "src_fps": self.fps,
+                "latency_p50_ms": lat.get("p50_ms"), "latency_p95_ms": lat.get("p95_ms"),
+                "pose_queue_p95_ms": prof["stages"].get("pose_queue", {}).get("p95_ms"),
+                "encoder": self.out.stats(),
+                "bottleneck": prof["bottleneck"],
+                # 處理速度跟不上來源 → 計時（以來源 fps 換算秒數）會比實際時間慢
+                "behind": prof["fps"] < 0.9 * self.fps,
+                "capture": self.grabber.stats() if self.grabber is not None else None,
+                "error": repr(self.error) if self.error else None}
+
+
+def _tile_views(frames, tile_w=640, cols=None):
+    """把各站畫面縮成同寬後拼成格狀（無畫面的站以黑底代替）。"""
+    cols = cols or int(math.ceil(math.sqrt(len(frames))))
+    tile_h = tile_w * 9 // 16
+    tiles = []
+    for f in frames:
+        if f is None:
+            tiles.append(np.zeros((tile_h, tile_w, 3), np.uint8))
+        else:
+            tiles.append(cv2.resize(f, (tile_w, tile_h), interpolation=cv2.INTER_AREA))
+    while len(tiles) % cols:
+        tiles.append(np.zeros((tile_h, tile_w, 3), np.uint8))
+    return np.vstack([np.hstack(tiles[i:i + cols]) for i in range(0, len(tiles), cols)])
 
 
-        image = detector.draw_overlay(image, frame_width, frame_height)
+def run_live_stations(sources, selected_action, pose_workers=None, stab_mode="warp", out_dir=None, show=True,
+                      debug_hud=False, duration=None, defer_overlay=False, video_opts=None):
+    """
+    多個來源同時即時錄影計數：每站各自的 detector、Pose 圖與輸出檔；同時推論的數量以 pose_workers 限制。
+    - defer_overlay: 各站只錄原始畫面 + 疊圖側檔，標註影片事後以 render_overlay 產生
+    - video_opts: 各站輸出影片設定（見 AsyncVideoWriter）
+    - 預覽為各站拼貼（Q/ESC 結束，D 切換各站 FPS / 延遲列）；show=False 時以 duration 秒數或來源結束為止
+    - 結束時輸出 live_<ts>.json：各站計數、實際 FPS、端到端延遲 p50/p95、是否跟不上來源 fps
+    """
+    out_dir = out_dir or os.path.join(os.getcwd(), "output")
+    tag = time.strftime("%Y%m%d_%H%M%S")
+    pool = PoseWorkerPool(pose_workers)
+    events = RepEventSink(os.path.join(out_dir, f"live_{tag}_events.jsonl"), buffer=1)   # 各站共用，帶 station 欄位
+    stations = []
+    try:
+        for sid, src in enumerate(sources):
+            stations.append(LiveStation(sid, parse_live_source(src), selected_action, pool, stab_mode=stab_mode,
+                                        out_dir=out_dir, tag=tag, events=events, defer_overlay=defer_overlay,
+                                        video_opts=video_opts))
+    except IOError as e:
+        print(f"Error: {e}")
+        for st in stations:
+            st.stop()
+        pool.close()
+        events.close()
+        return None
+
+    print(f"{len(stations)} 個工作站，pose worker × {pool.size}")
+    for st in stations:
+        print(f"  S{st.sid}: {st.source}  {st.W}x{st.H} @ {st.fps:.1f}fps → {st.outfile}")
+    if show:
+        print("按 Q 或 ESC 結束（D：各站 FPS / 延遲）")
+    for st in stations:
+        st.start()
+
+    t0 = time.perf_counter()
+    last_report = t0
+    try:
+        while any(st.running for st in stations):
+            now = time.perf_counter()
+            if duration is not None and now - t0 >= duration:
+                break
+            if show:
+                view = _tile_views([st.latest for st in stations])
+                if debug_hud:
+                    view = draw_text_block(view, [st.status_line() for st in stations], anchor='lt', margin=8,
+                                           color=(0, 255, 255), max_font_px=14, min_font_px=11, line_gap=3, stroke=2)
+                cv2.imshow("Rehab Live (multi)", view)
+                key = cv2.waitKey(15) & 0xFF
+                if key in (27, ord('q'), ord('Q')):
+                    break
+                if key in (ord('d'), ord('D')):
+                    debug_hud = not debug_hud
+            else:
+                time.sleep(0.05)
+            if now - last_report >= 5.0:
+                print("  ".join(st.status_line() for st in stations))
+                last_report = now
+    finally:
+        for st in stations:
+            st.stop()
+        pool.close()
+        events.close()
+        if show:
+            cv2.destroyAllWindows()
+
+    report = {"action": selected_action, "pose_workers": pool.size, "pose_graphs": pool.graph_count,
+              "stab_mode": stab_mode, "events": events.path,
+              "defer_overlay": defer_overlay,
+              "elapsed_s": round(time.perf_counter() - t0, 3), "stations": [st.summary() for st in stations]}
+    os.makedirs(out_dir, exist_ok=True)
+    report_path = os.path.join(out_dir, f"live_{tag}.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for r in report["stations"]:
+        flag = "  ← 跟不上來源" if r["behind"] else ""
+        print(f"S{r['station']}: 成功 {r['success']} 失敗 {r['fail']}  {r['fps']:.1f}/{r['src_fps']:.0f} fps  "
+              f"延遲 p50/p95 {r['latency_p50_ms']}/{r['latency_p95_ms']} ms{flag}")
+    print(f"工作站報告: {report_path}")
+    return report
 
-        image = draw_text_block(image, [f"{action_name} - 即時錄影", "LIVE REC ● 按 Q/ESC 結束"],
-                                 anchor='rb', margin=16, color=(0, 255, 0), max_font_px=20, min_font_px=14, line_gap=4, stroke=2)
 
-        cv2.imshow("Rehab Live", image)
-        out.write(image)
+# ==============================
+# 影片檔案處理主流程
+# ==============================
 
-        key = cv2.waitKey(1) & 0xFF
-        if key in (27, ord('q'), ord('Q')):
-            break
+def process_video(video_path, selected_action, start_sec=0.0, pose=None, out_dir=None, show=True,
+                  pipelined=True, stab_mode="warp", stab_two_pass=False, write_video=True, use_pose_cache=True,
+                  debug_hud=False, adaptive_stride=1, events=None, end_sec=None, analysis_only=False,
+                  video_opts=None):
+    """
+    單支影片處理（GUI 與批次共用）。
+    - analysis_only: 只要計數與回合事件：不預覽、不畫圖、不輸出影片（管線只剩 decode → 防手震 → pose → detector），
+      且 stab_mode="warp" 改用 "landmarks"（只換算關鍵點，不 warp 整張畫面）。
+    - start_sec / end_sec: 只處理 [start_sec, end_sec)（end_sec=None 到結尾）；以 VideoIndex 精準定位，
+      end_sec 有指定時輸出檔名帶區段。多個區段請用 process_segments。
+    - pose: 外部提供的 mediapipe Pose（批次 worker 重用、GUI 預熱）；None 則自建並於結束時關閉。
+    - show: False 時不開預覽視窗（無介面批次）。
+    - pipelined: True 時 decode / stabilize / pose / render / encode 各自一條執行緒並行。
+    - stab_mode: "warp"（校正整張畫面）/ "landmarks"（只校正關鍵點，畫面不動）/ "off"。
+    - stab_two_pass: 先整支影片估計並平滑相機軌跡（依內容雜湊快取），再依軌跡校正。
+    - write_video: False 時不輸出標註影片。
+    - video_opts: 輸出影片設定 {codec, quality, scale, every, maxsize}，傳給 AsyncVideoWriter（背景執行緒編碼）；
+      編碼統計（背壓、檔案大小）放在結果的 "encoder"。
+    - use_pose_cache: 讀寫關鍵點快取；命中時略過推論，且若不需畫面（show/write_video 皆 False）連解碼都略過。
+    - debug_hud: 預覽視窗顯示各段耗時（預覽中按 D 切換；不寫入輸出影片）。
+    - adaptive_stride: > 1 時依 detector 狀態調整推論頻率（AdaptivePoseScheduler）：閒置時每 N 幀推論一次、
+      其餘幀內插；不需畫面時略過的幀只 cap.grab() 不解碼（此時管線改為單執行緒，狀態才不會落後）。
+      有命中逐幀推論的快取時直接用它。推論統計放在結果的 "inference"。
+    - events: RepEventSink；提供時每個回合寫一筆事件（影片、原始幀號、時間、側、角度、保持秒數、結果），
+      不再 print 到主控台。
+    各段耗時摘要放在結果的 "timing"；有輸出影片時完整 profile 另存 <輸出檔>_timing.json。
+    回傳結果 dict；影片無法開啟時回傳 None。
+    """
+    if not os.path.exists(video_path):
+        print(f"無法開啟影片: {video_path}")
+        return None
+    if analysis_only:
+        show = write_video = False
+        if stab_mode == "warp":
+            stab_mode = "landmarks"
+    adaptive_stride = max(1, int(adaptive_stride))
+    cache_path = track = None
+    if use_pose_cache:
+        cache_path = pose_cache_path(video_path, start_sec, stab_mode, stab_two_pass, end_sec=end_sec)
+        track = load_pose_track(cache_path)
+        if track is None and adaptive_stride > 1:
+            cache_path = pose_cache_path(video_path, start_sec, stab_mode, stab_two_pass,
+                                         adaptive_stride=adaptive_stride, end_sec=end_sec)
+            track = load_pose_track(cache_path)
+
+    result = {"video": video_path, "action": selected_action, "outfile": None,
+              "pose_cache": "off" if cache_path is None else ("hit" if track is not None else "miss")}
+    if start_sec > 0 or end_sec is not None:
+        result["segment"] = {"start_s": start_sec, "end_s": end_sec}
+
+    # 快取命中且不需要任何畫面 → 不解碼、不推論，直接重播關鍵點
+    if track is not None and not show and not write_video:
+        if selected_action not in DETECTOR_PARAMS:
+            print(f"未知動作: {selected_action}")
+            return None
+        t0 = time.perf_counter()
+        score = score_session(track, selected_action, make_detector(selected_action, track.fps)[0])
+        elapsed = time.perf_counter() - t0
+        if events is not None:
+            _emit_score_events(events, track, score, video=video_path, action=selected_action)
+        if "segment" in result:
+            result["segment"].update(start_frame=track.start_frame, end_frame=track.start_frame + len(track))
+        result.update({"success": score["success"], "fail": score["fail"], "total": score["total"],
+                       "frames": len(track),
+                       "elapsed_s": round(elapsed, 3),
+                       "fps_proc": round(len(track) / elapsed, 2) if elapsed > 0 else 0.0})
+        return result
 
-    cap.release(); out.release(); cv2.destroyAllWindows()
-    print(f"已儲存: {outfile}")
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"無法開啟影片: {video_path}")
+        return None
+
+    fps = _sanitize_fps(cap.get(cv2.CAP_PROP_FPS) or 30.0)
+    index = VideoIndex.load_or_build(video_path) if "segment" in result else None
+    if index is not None:
+        start_frame, end_frame = index.frame_range(start_sec, end_sec)
+        if not index.seek_verified(cap, start_frame):
+            print(f"無法定位到第 {start_frame} 幀（{_segment_tag(start_sec, end_sec)}），略過此區段")
+            cap.release()
+            return None
+        limit = max(0, end_frame - start_frame)
+        print(f"[info] 區段 {_segment_tag(start_sec, end_sec)} → 第 {start_frame}–{end_frame} 幀")
+    else:       # 後端不支援封包索引：沿用舊的定位方式，結尾以 fps 換算
+        _seek_to(cap, start_sec)
+        start_frame = int(cap.get(cv2.CAP_PROP_POS_FRAMES) or 0)
+        limit = None if end_sec is None else max(0, int(round((end_sec - start_sec) * fps)))
+    # 快取命中時關鍵點已校正好；只有 warp 模式還需要校正畫面本身，landmarks 模式略過動作估計
+    stab = None if (track is not None and stab_mode != "warp") else \
+        make_stab(stab_mode, video_path=video_path, two_pass=stab_two_pass, start_frame=start_frame)
 
+    W = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 1280)
+    H = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 720)
+    # 決定輸出大小：高度上限 720
+    out_W, out_H = W, H
+    if H > 720:
+        scale = 720.0 / H
+        out_W = int(round(W * scale))
+        out_H = 720
 
-# ==============================
-# 影片檔案處理主流程
-# ==============================
+    # 依動作建立 detector
+    detector, action_name = make_detector(selected_action, fps)
+    if detector is None:
+        print(f"未知動作: {selected_action}")
+        cap.release()
+        return None
+    log = None
+    if events is not None:
+        log = detector.events = RepEventLog(events, frame_offset=start_frame, video=video_path,
+                                            action=selected_action)
+
+    timer = StageTimer()
+    out = outfile = None
+    if write_video:
+        if out_dir is None:
+            out_dir = os.path.join(os.getcwd(), "output")
+        os.makedirs(out_dir, exist_ok=True)
+        base = os.path.splitext(os.path.basename(video_path))[0]
+        if end_sec is not None:
+            base += f"_{_segment_tag(start_sec, end_sec)}"
+        out = AsyncVideoWriter(os.path.join(out_dir, f"{base}_{action_name}.mp4"), fps, (out_W, out_H),
+                               timer=timer, **(video_opts or {}))
+        outfile = out.path
+
+    own_pose = pose is None and track is None
+    if own_pose:
+        pose = make_pose()
+
+    print(f"輸入影片: {video_path}")
+    if outfile:
+        print(f"輸出檔案: {outfile}")
+    if track is not None:
+        print(f"[cache] 使用關鍵點快取（略過推論）: {cache_path}")
+    if show:
+        print("處理中...（按 Q/ESC 中止預覽，D：耗時 HUD）")
+
+    need_pixels = show or write_video
+    recorder = sched = None
+    if track is not None:
+        pose_stage = _cached_pose_stage(track)
+    else:
+        if adaptive_stride > 1:
+            pose_stage = sched = AdaptivePoseScheduler(pose, detector, max_stride=adaptive_stride)
+        else:
+            pose_stage = _pose_stage(pose)
+        if cache_path is not None:
+            recorder = PoseTrackRecorder()
+
+    def analyze(pkt):
+        if recorder is not None:
+            recorder.add(pkt)
+        if log is not None:
+            log.at(pkt.idx, pkt.t)
+        if pkt.landmarks:
+            detector.process_frame(pkt.landmarks, None, pkt.W, pkt.H)
+        return pkt
+
+    def render(pkt):
+        if recorder is not None:
+            recorder.add(pkt)
+        if log is not None:
+            log.at(pkt.idx, pkt.t)
+        image, cur_W, cur_H = pkt.frame, pkt.W, pkt.H
+        if pkt.landmarks:
+            _draw_pose(image, pkt.raw_landmarks)
+            image = detector.process_frame(pkt.landmarks, image, cur_W, cur_H)
+
+        # Always draw detailed overlay even if pose is temporarily missing
+        image = detector.draw_overlay(image, cur_W, cur_H)
+        # 左下角底部統計 HUD（提踵/深蹲都顯示基本統計）
+        ok, ng, total = detector.get_counts()
+        rate = (ok / total * 100.0) if total > 0 else 0.0
+        image = draw_text_block(
+            image,
+            [f"{action_name} - 計數結果", f"成功: {ok}｜失敗: {ng}｜總數: {total}｜成功率: {rate:.1f}%"],
+            anchor='lb', margin=16, color=(0, 255, 0), max_font_px=18, min_font_px=14, line_gap=6, stroke=2
+        )
+
+        pkt.frame = draw_text_block(image, [f"Stab: {pkt.stab_mag:.1f}px"], anchor='rt', margin=16,
+                                    color=(255,255,255), max_font_px=16, min_font_px=12, line_gap=4, stroke=2)
+        return pkt
+
+    def encode(pkt):
+        out.write(pkt.frame)
+        return pkt
+
+    # --- stabilize frame before pose detection ---
+    stages = [("stabilize", _stab_stage(stab, max_h=720)), ("pose", pose_stage),
+              ("render", render) if need_pixels else ("analyze", analyze)]
+    if out is not None:
+        stages.append(("encode", encode))
+    source = read_packets(cap, limit=limit)
+    if sched is not None and not need_pixels:
+        # 不需畫面：閒置區段只 grab 不解碼；單執行緒讓 wants_frame() 看到的是最新的 detector 狀態
+        source = read_packets(cap, skip=lambda idx: not sched.wants_frame(idx), size=(out_W, out_H), limit=limit)
+        pipelined = False
+    pipe = StagePipeline(source, stages, threaded=pipelined, timer=timer)
+    n_frames = 0
+    aborted = False
+    t0 = time.perf_counter()
+    try:
+        for pkt in pipe:
+            n_frames += 1
+            timer.tick(pkt)
+            if show:
+                td = time.perf_counter_ns()
+                view = _draw_timing_hud(pkt.frame, timer, landmarks=pkt.landmarks) if debug_hud else pkt.frame   # encode 已寫出，不會進影片
+                cv2.imshow("Rehab Video", view)
+                key = cv2.waitKey(1) & 0xFF
+                timer.record("display", time.perf_counter_ns() - td)
+                if key in (27, ord('q'), ord('Q')):
+                    aborted = True
+                    break
+                if key in (ord('d'), ord('D')):
+                    debug_hud = not debug_hud
+    finally:
+        pipe.close()
+        elapsed = time.perf_counter() - t0
+        if own_pose:
+            pose.close()
+        if sched is not None:
+            sched.close()
+        cap.release()
+        if out is not None:
+            out.release()
+        if show:
+            cv2.destroyAllWindows()
+
+    if out is not None:
+        result["encoder"] = out.stats()
+    if outfile:
+        print(f"已儲存: {outfile}")
+
+    # 只有完整跑完才寫快取（中途中止的結果不完整）
+    if recorder is not None and not aborted:
+        try:
+            recorder.build(fps, start_frame).save(cache_path)
+            result["pose_cache"] = "saved"
+        except Exception as e:
+            print(f"[warn] 關鍵點快取寫入失敗: {e}")
+
+    ok, ng, total = detector.get_counts()
+    result.update({
+        "success": ok, "fail": ng, "total": total,
+        "frames": n_frames,
+        "elapsed_s": round(elapsed, 3),
+        "fps_proc": round(n_frames / elapsed, 2) if elapsed > 0 else 0.0,
+        "outfile": outfile,
+    })
+    if sched is not None:
+        result["inference"] = sched.stats()
+    if "segment" in result:
+        result["segment"].update(start_frame=start_frame, end_frame=start_frame + n_frames)
+    meta = dict(video=video_path, action=selected_action, src_fps=fps, size=[out_W, out_H],
+                stab_mode=stab_mode, pipelined=pipelined, pose_cache=result["pose_cache"],
+                adaptive_stride=adaptive_stride, analysis_only=bool(analysis_only),
+                encoder=result.get("encoder"))
+    if outfile:
+        prof = timer.dump(os.path.splitext(outfile)[0] + "_timing.json", **meta)
+    else:
+        prof = timer.profile(**meta)
+    result["timing"] = {k: prof[k] for k in ("bottleneck", "stages")}
+    return result
+
+
+def process_segments(video_path, selected_action, segments, **kwargs):
+    """
+    只處理長影片中的數個 [start, end) 區段（例如一次療程裡的各組動作），區段之間不解碼。
+    每段各自一個 detector、輸出檔與關鍵點快取；segments 為 parse_segments() 的結果，
+    kwargs 原樣傳給 process_video。回傳 {"segments": [各段結果], 以及 success/fail/total/frames 合計}。
+    """
+    results = []
+    for i, (start_sec, end_sec) in enumerate(segments):
+        if i and kwargs.get("pose") is not None:
+            kwargs["pose"].reset()      # 區段之間不沿用追蹤狀態
+        res = process_video(video_path, selected_action, start_sec=start_sec, end_sec=end_sec, **kwargs)
+        if res is None:
+            return None
+        results.append(res)
+    totals = {k: sum(r[k] for r in results) for k in ("success", "fail", "total", "frames")}
+    elapsed = sum(r["elapsed_s"] for r in results)
+    return dict({"video": video_path, "action": selected_action, "segments": results}, **totals,
+                elapsed_s=round(elapsed, 3),
+                fps_proc=round(totals["frames"] / elapsed, 2) if elapsed > 0 else 0.0)
 
 
 def main():
+    # 使用者在選單 / 對話框時，背景載入 mediapipe 並預熱 Pose；開始處理時直接取用
+    prewarm = PosePrewarm().start()
+    try:
+        _gui_flow(prewarm)
+    finally:
+        prewarm.close()
+
+
+def _gui_flow(prewarm):
+    from tkinter import messagebox, simpledialog
     selected_action, video_path = select_action_group()
     if not selected_action:
         print("未選擇動作，程式結束")
@@ -1177,7 +4214,12 @@ def main():
         use_cam = False
 
     if use_cam:
-        run_live_record(selected_action)
+        dialogs_s = _since_launch()
+        pose = prewarm.take()
+        try:
+            run_live_record(selected_action, pose=pose, startup=dict(prewarm.stats(), dialogs_done_s=dialogs_s))
+        finally:
+            pose.close()
         return
 
     # 若在選單未挑影片，這裡再問一次（避免沒挑到就結束）
@@ -1188,13 +4230,6 @@ def main():
             return
         video_path = value
 
-
-    cap = cv2.VideoCapture(video_path)
-    stab = GlobalStab()
-    if not cap.isOpened():
-        print(f"無法開啟影片: {video_path}")
-        return
-
     # 問 start time（只有影片模式才問）
     start_text = "0"
     root = _ensure_tk_root()
@@ -1212,121 +4247,944 @@ def main():
         print(f"[warn] 起始時間解析失敗：{_e}，將從 0 秒開始")
         start_sec = 0.0
 
-    if start_sec > 0:
-        fps_probe = cap.get(cv2.CAP_PROP_FPS) or 0
-        frame_idx = int(start_sec * fps_probe) if fps_probe > 0 else None
-        ok_seek = False
-        if cap.set(cv2.CAP_PROP_POS_MSEC, start_sec * 1000.0):
-            ok_seek = True
-        if not ok_seek and frame_idx is not None:
-            ok_seek = cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-        if not ok_seek and fps_probe > 0:
-            target = max(0, frame_idx or 0); skipped = 0
-            while skipped < target:
-                ret_skip, _ = cap.read()
-                if not ret_skip: break
-                skipped += 1
-            print(f"[info] 手動略過 {skipped} 幀以達到起始時間 {start_sec:.3f}s")
-        else:
-            print(f"[info] 起始時間已定位到 {start_sec:.3f}s")
-
-    W = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 1280)
-    H = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 720)
-    # 決定輸出大小：高度上限 720
-    out_W, out_H = W, H
-    if H > 720:
-        scale = 720.0 / H
-        out_W = int(round(W * scale))
-        out_H = 720
-        
-        
-    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    end_sec = None
+    if root:
+        try:
+            s = simpledialog.askstring("結束時間", "輸入結束時間（秒數或 MM:SS / HH:MM:SS），留空 = 到影片結尾：",
+                                       initialvalue="")
+            if s and s.strip():
+                end_sec = parse_timecode(s)
+        except Exception as _e:
+            print(f"[warn] 結束時間解析失敗：{_e}，將處理到影片結尾")
+        if end_sec is not None and end_sec <= start_sec:
+            print("[warn] 結束時間不晚於起始時間，將處理到影片結尾")
+            end_sec = None
+
+    analysis_only = False
     try:
-        fps = float(fps)
-        if fps <= 0 or fps > 120:
-            fps = 30.0
+        analysis_only = messagebox.askyesno('處理方式', '只要計數結果嗎？\n選「是」= 不預覽、不輸出影片（最快）、選「否」= 預覽並輸出標註影片')
     except Exception:
-        fps = 30.0
-    
-    # 依動作建立 detector
-    if selected_action == "squat_hip_height":
-        detector = SquatKneeAngleThresholdDetector(
-    stand_up_deg=170.0,
-    succ_min_deg=95.0, succ_max_deg=135.0,
-    fail_min_deg=136.0, fail_max_deg=162.0,
-    ema_alpha=0.35, standard_deg=135.0
-)
-        action_name = "深蹲 (角度法)"
-    elif selected_action == "calf_raise":
-        detector = CalfRaiseDetector(A_min=7.5, A_max=45.0, hold_seconds=3.0, ema_alpha=0.35, standard_deg=15.0)
-        detector.fixed_fps = fps     # ★★ 加這行：影片模式用「檔案固有 FPS」計秒 ★★
-        action_name = "提踵 (地面參考)"
-    else:
-        print(f"未知動作: {selected_action}")
+        analysis_only = False
+
+    pose = prewarm.take()
+    if not analysis_only:
+        try:
+            process_video(video_path, selected_action, start_sec=start_sec, end_sec=end_sec, show=True, pose=pose)
+        finally:
+            pose.close()
         return
-    
-    out_dir = os.path.join(os.getcwd(), "output"); os.makedirs(out_dir, exist_ok=True)
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+
     base = os.path.splitext(os.path.basename(video_path))[0]
-    outfile = os.path.join(out_dir, f"{base}_{action_name}.mp4")
-    out = cv2.VideoWriter(outfile, fourcc, fps, (out_W, out_H))
+    events_path = os.path.join(os.getcwd(), "output", "events", f"rep_events_{base}.jsonl")
+    events = RepEventSink(events_path)
+    try:
+        res = process_video(video_path, selected_action, start_sec=start_sec, end_sec=end_sec,
+                            analysis_only=True, events=events, pose=pose)
+    finally:
+        events.close()
+        pose.close()
+    if res is None:
+        return
+    summary = (f"成功: {res['success']}｜失敗: {res['fail']}｜總數: {res['total']}\n"
+               f"{res['frames']} 幀 / {res['elapsed_s']:.1f}s（{res['fps_proc']:.1f} fps）\n回合事件: {events_path}")
+    print(summary)
+    try:
+        messagebox.showinfo("計數結果", summary)
+    except Exception:
+        pass
 
 
-    pose = mp_pose.Pose(static_image_mode=False, model_complexity=1, smooth_landmarks=True,
-                        min_detection_confidence=0.5, min_tracking_confidence=0.5, enable_segmentation=False)
+# ==============================
+# 批次處理（無介面、多行程）
+# ==============================
 
-    print(f"輸入影片: {video_path}")
-    print(f"輸出檔案: {outfile}")
-    print("處理中...（按 Q/ESC 中止預覽）")
-    
-    
-    while True:
-        ret, frame = cap.read()
-        # --- stabilize frame before pose detection ---
-        _stab_mag = 0.0
-        if ret:
-            frame, _stab_mag = stab.stabilize(frame)
-        if not ret:
-            break
-        
-        # 若輸入過大，這裡縮到高度 720
-        frame, cur_W, cur_H, _scaled = resize_to_max_height(frame, max_h=720)
-        
-        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        image.flags.writeable = False
-        results = pose.process(image)
-        image.flags.writeable = True
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+_batch_pose = None   # 每個 worker 行程各自一個 Pose
+_batch_events = None  # 每個 worker 行程各自一個事件檔（未指定則為 None）
 
-        if results.pose_landmarks:
-            ld = get_landmark_dict(results.pose_landmarks.landmark)
-            mp_drawing.draw_landmarks(image, results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
-                                      mp_drawing.DrawingSpec(color=(245,117,66), thickness=2, circle_radius=2),
-                                      mp_drawing.DrawingSpec(color=(245,66,230), thickness=2, circle_radius=2))
-            image = detector.process_frame(results.pose_landmarks.landmark, image, cur_W, cur_H)
 
-        
-        # Always draw detailed overlay even if pose is temporarily missing
-        image = detector.draw_overlay(image, cur_W, cur_H)
-# 左下角底部統計 HUD（提踵/深蹲都顯示基本統計）
-        ok, ng, total = detector.get_counts()
-        rate = (ok / total * 100.0) if total > 0 else 0.0
-        image = draw_text_block(
-            image,
-            [f"{action_name} - 計數結果", f"成功: {ok}｜失敗: {ng}｜總數: {total}｜成功率: {rate:.1f}%"],
-            anchor='lb', margin=16, color=(0, 255, 0), max_font_px=18, min_font_px=14, line_gap=6, stroke=2
-        )
+def expand_video_inputs(inputs):
+    """展開影片路徑 / glob / 資料夾，去重並保持順序。"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            found = sorted(p for p in glob.glob(os.path.join(item, "*")) if p.lower().endswith(VIDEO_EXTS))
+        elif any(c in item for c in "*?["):
+            found = sorted(glob.glob(item))
+        else:
+            found = [item]
+        for p in found:
+            if p not in paths:
+                paths.append(p)
+    return paths
+
+
+def _batch_worker_init(events_path=None):
+    global _batch_pose, _batch_events
+    # 每個行程只用 1 個 OpenCV 執行緒，由行程數吃滿所有核心，避免過度訂閱
+    cv2.setNumThreads(1)
+    _batch_pose = make_pose()
+    # 每個 worker 各寫一個事件檔（檔名帶 pid），不必跨行程上鎖
+    _batch_events = None
+    if events_path:
+        root, ext = os.path.splitext(events_path)
+        _batch_events = RepEventSink(f"{root}_{os.getpid()}{ext}")
+
+
+def _batch_worker(job):
+    video_path, selected_action, segments, out_dir, opts = job
+    _batch_pose.reset()   # 不同影片之間不沿用追蹤狀態
+    try:
+        if len(segments) == 1:
+            (start_sec, end_sec), = segments
+            res = process_video(video_path, selected_action, start_sec=start_sec, end_sec=end_sec,
+                                pose=_batch_pose, out_dir=out_dir, show=False, events=_batch_events, **opts)
+        else:
+            res = process_segments(video_path, selected_action, segments,
+                                   pose=_batch_pose, out_dir=out_dir, show=False, events=_batch_events, **opts)
+    except Exception as e:
+        return {"video": video_path, "action": selected_action, "error": repr(e)}
+    finally:
+        if _batch_events is not None:
+            _batch_events.flush()   # worker 行程結束時不會跑 atexit，每支影片後寫出
+    if res is None:
+        return {"video": video_path, "action": selected_action, "error": "無法開啟影片"}
+    base = os.path.splitext(os.path.basename(video_path))[0]
+    json_path = os.path.join(out_dir, f"{base}_{ACTION_NAMES[selected_action]}.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(res, f, ensure_ascii=False, indent=2)
+    return res
+
+
+def run_batch(inputs, selected_action, out_dir=None, workers=None, start_sec=0.0, events="jsonl", end_sec=None,
+              segments=None, **opts):
+    """
+    以行程池平行處理多支影片；回傳彙總 dict 並寫入 out_dir/batch_*.json。
+    每支影片處理 [start_sec, end_sec)；segments（parse_segments 的結果）有給時改為只處理這些區段。
+    events: "jsonl" / "csv" → 回合事件寫到 out_dir/events/rep_events_<時間>_<pid>.<ext>（每 worker 一檔）；
+            None → 沿用主控台 print。
+    opts 原樣傳給 process_video（stab_mode / stab_two_pass / write_video / use_pose_cache ...）。
+    """
+    if selected_action not in ACTION_NAMES:
+        print(f"未知動作: {selected_action}")
+        return None
+    paths = expand_video_inputs(inputs)
+    if not paths:
+        print("[batch] 找不到任何影片")
+        return None
+    if out_dir is None:
+        out_dir = os.path.join(os.getcwd(), "output")
+    os.makedirs(out_dir, exist_ok=True)
+    workers = max(1, min(int(workers or os.cpu_count() or 1), len(paths)))
+
+    # 大檔先送，尾端比較不會只剩一個行程在跑
+    paths.sort(key=lambda p: os.path.getsize(p) if os.path.exists(p) else 0, reverse=True)
+    segments = list(segments or [(start_sec, end_sec)])
+    jobs = [(p, selected_action, segments, out_dir, opts) for p in paths]
+    tag = time.strftime('%Y%m%d_%H%M%S')
+    events_path = os.path.join(out_dir, "events", f"rep_events_{tag}.{events}") if events else None
+
+    print(f"[batch] {len(paths)} 支影片，{workers} 個 worker，動作={selected_action}")
+    results = []
+    t0 = time.perf_counter()
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_batch_worker_init,
+                             initargs=(events_path,)) as ex:
+        futs = [ex.submit(_batch_worker, job) for job in jobs]
+        for fut in as_completed(futs):
+            res = fut.result()
+            results.append(res)
+            if "error" in res:
+                print(f"[batch] 失敗 {res['video']}: {res['error']}")
+            else:
+                print(f"[batch] 完成 {res['video']}  成功={res['success']} 失敗={res['fail']}  "
+                      f"{res['frames']} 幀 / {res['elapsed_s']:.1f}s")
+    wall = time.perf_counter() - t0
+
+    frames_total = sum(r.get("frames", 0) for r in results)
+    summary = {
+        "action": selected_action,
+        "workers": workers,
+        "videos": len(paths),
+        "failed": sum(1 for r in results if "error" in r),
+        "frames_total": frames_total,
+        "wall_s": round(wall, 3),
+        "throughput_fps": round(frames_total / wall, 2) if wall > 0 else 0.0,
+        "videos_per_min": round(len(paths) / wall * 60.0, 2) if wall > 0 else 0.0,
+        "events": os.path.join(os.path.dirname(events_path), f"rep_events_{tag}_*.{events}") if events else None,
+        "results": sorted(results, key=lambda r: r["video"]),
+    }
+    summary_path = os.path.join(out_dir, f"batch_{selected_action}_{tag}.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"[batch] 總計 {frames_total} 幀 / {wall:.1f}s = {summary['throughput_fps']:.1f} fps"
+          f"（{summary['videos_per_min']:.1f} 支/分鐘），彙總: {summary_path}")
+    if events:
+        print(f"[batch] 回合事件: {summary['events']}")
+    return summary
+
+
+# ==============================
+# 單支長影片分塊平行處理
+# ==============================
+
+class _ListSink(list):
+    """記憶體中的事件 sink（分塊 worker 收集回合事件，回傳主行程合併）。"""
+    emit = list.append
+
+
+def _stab_plan_chunk(video_path, index, start, stop, max_h=720, proc_max_side=480):
+    """
+    兩階段軌跡的第一階段，只算 [start, stop) 這一塊（行程池內平行）：從 start - 1 起追蹤，
+    第 start 幀的位移也與整段逐幀計算時同樣是相對於前一幀。回傳 (params (n, 3), 處理尺寸, 耗時秒數)。
+    """
+    t0 = time.perf_counter()
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"無法開啟影片: {video_path}")
+    try:
+        first = max(0, start - 1)
+        if not index.seek_verified(cap, first):
+            raise IOError(f"無法定位到第 {first} 幀: {video_path}")
+        tracker = GlobalStab(proc_max_side=proc_max_side)
+        if start > 0:
+            _track_stab_params(cap, tracker, limit=1, max_h=max_h)
+        params, size = _track_stab_params(cap, tracker, limit=stop - start, max_h=max_h)
+    finally:
+        cap.release()
+    return np.asarray(params, dtype=np.float64).reshape(-1, 3), size, round(time.perf_counter() - t0, 3)
+
 
-        image = draw_text_block(image, [f"Stab: {_stab_mag:.1f}px"], anchor='rt', margin=16,
-                            color=(255,255,255), max_font_px=16, min_font_px=12, line_gap=4, stroke=2)
-        cv2.imshow("Rehab Video", image)
-        out.write(image)
-        key = cv2.waitKey(1) & 0xFF
-        if key in (27, ord('q'), ord('Q')):
+def _stab_plan_worker(job):
+    return _stab_plan_chunk(*job)
+
+
+def _chunk_pass(pose, video_path, selected_action, index, warm, start, stop, plan=None, calib=None,
+                until_calibrated=False):
+    """
+    解碼 [warm, stop) 幀並推論、計數；[warm, start) 只用來暖機（Pose 追蹤、平滑、EMA、回合狀態機），
+    其關鍵點與事件不算這一塊的。calib: 從影片開頭建立的提踵基準（seed_calibration）。
+    plan: 整支影片的 StabPlan（None = 不防手震）；以 landmarks 模式依絕對幀號校正（不 warp 畫面），
+    各塊與校正預跑都在同一個座標系，提踵基準可以直接沿用。
+    until_calibrated=True：detector 一建立基準就停（校正預跑）。
+    回傳 dict：本塊 [start, stop) 的 landmarks / present / t / stab_mag、events（幀號 >= start 的回合）、calibration。
+    """
+    t0 = time.perf_counter()
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"無法開啟影片: {video_path}")
+    if not index.seek_verified(cap, warm):
+        cap.release()
+        raise IOError(f"無法定位到第 {warm} 幀: {video_path}")
+    detector, _ = make_detector(selected_action, index.fps)
+    events = _ListSink()
+    log = detector.events = RepEventLog(events, frame_offset=warm)
+    if calib:
+        detector.seed_calibration(calib)
+    # 兩階段軌跡依絕對幀號校正，各塊的座標系一致（即時防手震則會以各塊第一幀為基準，與基準的座標系不同）
+    stab = None if plan is None else PrecomputedStab(plan, mode="landmarks", start_frame=warm)
+    recorder = PoseTrackRecorder()
+    own = start - warm
+
+    def analyze(pkt):
+        if pkt.idx >= own:
+            recorder.add(pkt)
+        log.at(pkt.idx, pkt.t)
+        if pkt.landmarks:
+            detector.process_frame(pkt.landmarks, None, pkt.W, pkt.H)
+        return pkt
+
+    stages = [("stabilize", _stab_stage(stab, max_h=720)), ("pose", _pose_stage(pose)), ("analyze", analyze)]
+    pipe = StagePipeline(read_packets(cap, limit=stop - warm), stages)
+    n = 0
+    for _pkt in pipe:
+        n += 1
+        if until_calibrated and detector.calibration() is not None:
             break
+    pipe.close()
+    cap.release()
+    track = recorder.build(index.fps, start)
+    return {"start": start, "stop": stop, "warm": warm, "frames": n, "size": track.size,
+            "landmarks": track.landmarks, "raw": track.raw, "present": track.present, "t": track.t,
+            "stab_mag": track.stab_mag, "events": [e for e in events if e["frame"] >= start], "calibration": detector.calibration(),
+            "elapsed_s": round(time.perf_counter() - t0, 3)}
+
+
+def _chunk_worker(job):
+    _batch_pose.reset()     # 每塊從頭追蹤（暖機段會把追蹤狀態帶起來）
+    return _chunk_pass(_batch_pose, *job)
+
+
+def process_video_chunked(video_path, selected_action, chunk_s=300.0, overlap_s=10.0, workers=None,
+                          stab_mode="warp", events=None, use_pose_cache=True, strict=False):
+    """
+    單支長影片切成 chunk_s 秒的區塊，交給行程池平行處理；每個 worker 各自一個 Pose 與 detector（只分析，不輸出影片）。
+    - 每塊往前多解 overlap_s 秒暖機（Pose 追蹤、平滑、EMA、回合狀態機）；暖機段的回合歸前一塊（邊界去重）
+    - 提踵：先從影片開頭預跑到建立腳底基準（行程池的第一個工作，與第一塊同時跑），
+      之後各塊沿用同一基準，不各自重新校正
+    - 防手震不是 "off" 時一律用兩階段軌跡的 landmarks 模式（依絕對幀號校正，各塊座標一致、不 warp 畫面）；
+      沒有軌跡快取時，第一階段也切成同樣的區塊在行程池內平行計算，再於主行程串接
+    各塊關鍵點依幀號串接成完整 PoseTrack（存快取）；再以 score_session 對串接後的同一份關鍵點整段重算比對。
+    這只檢查邊界合併（暖機是否足以讓各塊 detector 狀態銜接），不代表與單一行程逐幀跑一致：
+    各塊的 Pose 追蹤從暖機段重新開始，關鍵點本身就可能與逐幀跑不同。
+    不一致（例如暖機不足）時在 stderr 警告、result["chunks"]["fallback"] = "rescore" 並採用重算結果；
+    strict=True 則直接拋出 RuntimeError。events: RepEventSink。
+    """
+    if selected_action not in DETECTOR_PARAMS:
+        print(f"未知動作: {selected_action}")
+        return None
+    if not os.path.exists(video_path):
+        print(f"無法開啟影片: {video_path}")
+        return None
+    index = VideoIndex.load_or_build(video_path)
+    if stab_mode != "off":
+        stab_mode = "landmarks"
+    if index is None:
+        print("[chunked] 無法建立影格索引（後端不支援封包模式），改為單一行程處理")
+        return process_video(video_path, selected_action, show=False, write_video=False, stab_mode=stab_mode,
+                             stab_two_pass=stab_mode != "off", use_pose_cache=use_pose_cache, events=events)
+    result = {"video": video_path, "action": selected_action, "outfile": None, "pose_cache": "off"}
+    cache_path = track = None
+    if use_pose_cache:
+        cache_path = pose_cache_path(video_path, 0.0, stab_mode, stab_mode != "off",
+                                     chunking=(chunk_s, overlap_s))
+        track = load_pose_track(cache_path)
+        result["pose_cache"] = "hit" if track is not None else "miss"
+
+    t0 = time.perf_counter()
+    N, fps = len(index), index.fps
+    step = max(1, int(round(chunk_s * fps)))
+    overlap = max(0, int(round(overlap_s * fps)))
+    bounds = [(a, min(N, a + step)) for a in range(0, N, step)]
+    merged = None
+    if track is None:
+        workers = max(1, min(int(workers or os.cpu_count() or 1), len(bounds)))
+        print(f"[chunked] {video_path}: {N} 幀 → {len(bounds)} 塊 × {chunk_s:g}s（暖機 {overlap_s:g}s），"
+              f"{workers} 個 worker")
+        ctx = multiprocessing.get_context("spawn")
+        plan = None
+        if stab_mode != "off" and os.path.exists(stab_plan_path(video_path)):
+            plan = load_or_compute_stab_plan(video_path)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_batch_worker_init) as ex:
+            if stab_mode != "off" and plan is None:
+                # 第一階段分塊平行：各塊各自從前一幀起追蹤，串接後即整段的逐幀位移
+                ts = time.perf_counter()
+                plan_parts = list(ex.map(_stab_plan_worker, [(video_path, index, a, b) for a, b in bounds]))
+                plan = StabPlan(np.concatenate([p[0] for p in plan_parts]), plan_parts[0][1], fps)
+                plan.save(stab_plan_path(video_path))
+                result["stab_plan"] = {"elapsed_s": round(time.perf_counter() - ts, 3),
+                                       "chunk_elapsed_s": [p[2] for p in plan_parts]}
+                print(f"[stab] 第一階段（{len(bounds)} 塊平行）完成：{len(plan)} 幀 / "
+                      f"{result['stab_plan']['elapsed_s']:.1f}s")
+            a, b = bounds[0]
+            calib_fut = None
+            if len(bounds) > 1 and selected_action == "calf_raise":
+                # 校正預跑：與第一塊同樣從第 0 幀開始，建立基準就停；先送出，第一塊同時在另一個 worker 跑
+                calib_fut = ex.submit(_chunk_worker, (video_path, selected_action, index, 0, 0, b, plan,
+                                                      None, True))
+            futs = [ex.submit(_chunk_worker, (video_path, selected_action, index, a, a, b, plan))]
+            calib = None
+            if calib_fut is not None:
+                calib = calib_fut.result()["calibration"]
+                if calib is None:
+                    print("[chunked] 第一塊內未完成提踵校正，後續各塊各自校正（結果以整段重算為準）")
+            for a, b in bounds[1:]:
+                futs.append(ex.submit(_chunk_worker, (video_path, selected_action, index, max(0, a - overlap), a, b,
+                                                      plan, calib)))
+            parts = [f.result() for f in futs]
+        raw = None
+        if any(p["raw"] is not None for p in parts):
+            raw = np.concatenate([p["landmarks"] if p["raw"] is None else p["raw"] for p in parts])
+        track = PoseTrack(np.concatenate([p["landmarks"] for p in parts]),
+                          np.concatenate([p["present"] for p in parts]),
+                          np.concatenate([p["t"] for p in parts]),
+                          np.concatenate([p["stab_mag"] for p in parts]),
+                          parts[0]["size"], fps, 0, raw=raw)
+        # 邊界去重：各塊只回傳自己範圍內結算的回合；提踵流水號依合併後順序重編
+        merged = [dict(e) for p in parts for e in p["events"]]
+        merged.sort(key=lambda e: e["frame"])
+        if selected_action == "calf_raise":
+            for i, e in enumerate(merged, 1):
+                e["rep"] = i
+        result["chunks"] = {"count": len(bounds), "chunk_s": chunk_s, "overlap_s": overlap_s, "workers": workers,
+                            "elapsed_s": [p["elapsed_s"] for p in parts]}
+        if cache_path is not None:
+            try:
+                track.save(cache_path)
+                result["pose_cache"] = "saved"
+            except Exception as e:
+                print(f"[warn] 關鍵點快取寫入失敗: {e}")
+
+    score = score_session(track, selected_action, make_detector(selected_action, fps)[0])
+    if merged is not None:
+        # 兩邊吃的是同一份串接關鍵點：只驗證邊界合併，不驗證與逐幀跑一致
+        consistent = [(e["frame"], e["outcome"]) for e in merged] == [(r["frame"], r["outcome"]) for r in score["reps"]]
+        result["chunks"]["consistent"] = consistent
+        result["chunks"]["fallback"] = None
+        if consistent:
+            score = _score_result(merged)
+        else:
+            chunk_score = _score_result(merged)
+            result["chunks"]["chunk_counts"] = [chunk_score["success"], chunk_score["fail"]]
+            msg = (f"[chunked] 分塊計數（成功 {chunk_score['success']} / 失敗 {chunk_score['fail']}）與整段重算"
+                   f"（成功 {score['success']} / 失敗 {score['fail']}）不一致")
+            if strict:
+                raise RuntimeError(msg)
+            result["chunks"]["fallback"] = "rescore"
+            print(f"[warn] {msg}，採用整段重算；請加大 overlap_s", file=sys.stderr)
+    if events is not None:
+        if merged is not None and result["chunks"]["consistent"]:
+            for e in merged:
+                events.emit(dict(video=video_path, action=selected_action, **e))
+        else:
+            _emit_score_events(events, track, score, video=video_path, action=selected_action)
+    elapsed = time.perf_counter() - t0
+    result.update({"success": score["success"], "fail": score["fail"], "total": score["total"],
+                   "frames": len(track), "elapsed_s": round(elapsed, 3),
+                   "fps_proc": round(len(track) / elapsed, 2) if elapsed > 0 else 0.0})
+    return result
+
+
+def run_chunked(video_path, selected_action, out_dir=None, events="jsonl", **opts):
+    """CLI 用：process_video_chunked 並把結果寫到 out_dir/<影片>_<動作>_chunked.json，事件寫到 out_dir/events/。"""
+    if out_dir is None:
+        out_dir = os.path.join(os.getcwd(), "output")
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.splitext(os.path.basename(video_path))[0]
+    sink = None
+    if events:
+        sink = RepEventSink(os.path.join(out_dir, "events", f"rep_events_{base}_{time.strftime('%Y%m%d_%H%M%S')}.{events}"))
+    try:
+        res = process_video_chunked(video_path, selected_action, events=sink, **opts)
+    finally:
+        if sink is not None:
+            sink.close()
+    if res is None:
+        return None
+    json_path = os.path.join(out_dir, f"{base}_{ACTION_NAMES[selected_action]}_chunked.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(res, f, ensure_ascii=False, indent=2)
+    print(f"[chunked] 成功={res['success']} 失敗={res['fail']}  {res['frames']} 幀 / {res['elapsed_s']:.1f}s"
+          f"（{res['fps_proc']:.1f} fps），結果: {json_path}")
+    if res.get("chunks", {}).get("fallback"):
+        print("[warn] 分塊結果與整段重算不一致，以上為整段重算的計數（見 chunks.chunk_counts）", file=sys.stderr)
+    return res
+
+
+# ==============================
+# 門檻掃描 / 自動調參（重用關鍵點快取，不重跑推論）
+# ==============================
+
+def load_session_labels(path, selected_action=None):
+    """
+    治療師標註檔（JSON list）：[{"video": "a.mp4", "success": 5, "fail": 1, "action": "calf_raise"}, ...]
+    video 可為相對於標註檔的路徑；有 action 欄位時只保留與 selected_action 相符者。
+    """
+    with open(path, encoding="utf-8") as f:
+        items = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    sessions = []
+    for it in items:
+        if selected_action and it.get("action", selected_action) != selected_action:
+            continue
+        video = it["video"] if os.path.isabs(it["video"]) else os.path.join(base, it["video"])
+        sessions.append({"video": video, "success": int(it["success"]), "fail": int(it["fail"])})
+    return sessions
+
+
+def _param_value(text):
+    """格點值：數字轉 float，其餘（如 smooth_mode=one_euro）保留字串。"""
+    try:
+        return float(text)
+    except ValueError:
+        return text.strip()
+
+
+def parse_param_grid(specs):
+    """["A_min=6:9:0.5", "hold_seconds=2.5,3,3.5"] → {"A_min": [6.0, 6.5, ..., 9.0], "hold_seconds": [...]}"""
+    grid = {}
+    for spec in specs:
+        name, _, vals = spec.partition("=")
+        if not vals:
+            raise ValueError(f"參數格式錯誤（應為 NAME=v1,v2 或 NAME=start:stop:step）: {spec}")
+        if ":" in vals:
+            start, stop, step = (float(x) for x in vals.split(":"))
+            n = int(math.floor((stop - start) / step + 1e-9)) + 1
+            grid[name.strip()] = [round(start + i * step, 6) for i in range(n)]
+        else:
+            grid[name.strip()] = [_param_value(x) for x in vals.split(",")]
+    return grid
+
+
+def sweep_configs(grid, n_random=0, seed=0):
+    """
+    網格全組合；n_random > 0 時改為在各參數 [min, max] 範圍內均勻抽樣 n_random 組
+    （範圍值全為整數的參數，如 calib_frames，只抽整數）。
+    """
+    names = sorted(grid)
+    if n_random > 0:
+        rng = np.random.default_rng(seed)
+
+        def draw(vals):
+            if any(isinstance(v, str) for v in vals):     # 非數值參數：從列出的值中抽一個
+                return vals[int(rng.integers(len(vals)))]
+            lo, hi = min(vals), max(vals)
+            if all(float(v).is_integer() for v in vals):
+                return float(rng.integers(int(lo), int(hi) + 1))
+            return round(float(rng.uniform(lo, hi)), 4)
+        return [{k: draw(grid[k]) for k in names} for _ in range(n_random)]
+    return [dict(zip(names, combo)) for combo in itertools.product(*(grid[k] for k in names))]
+
+
+_sweep_tracks = None
+
+
+def _sweep_worker_init(track_paths):
+    global _sweep_tracks
+    _sweep_tracks = [PoseTrack.load(p) for p in track_paths]
+
+
+def _sweep_eval(job):
+    """一批參數組合 × 全部 session；回傳 [(params, [(success, fail), ...]), ...]。"""
+    selected_action, configs = job
+    out = []
+    for params in configs:
+        preds = []
+        for track in _sweep_tracks:
+            detector, _ = make_detector(selected_action, track.fps, params)
+            score = score_session(track, selected_action, detector)
+            preds.append((score["success"], score["fail"]))
+        out.append((params, preds))
+    return out
+
+
+def run_sweep(labels_path, selected_action, grid, n_random=0, seed=0, top=10, workers=None, out_dir=None,
+              start_sec=0.0, stab_mode="warp", stab_two_pass=False, end_sec=None):
+    """
+    在標註過的 session 上搜尋 detector 參數，使預測計數最接近治療師計數。
+    誤差 = Σ(|Δ成功| + |Δ失敗|)。缺關鍵點快取的影片先以 run_batch（不輸出影片）補齊。
+    回傳彙總 dict 並寫入 out_dir/sweep_*.json。
+    """
+    if selected_action not in DETECTOR_PARAMS:
+        print(f"未知動作: {selected_action}")
+        return None
+    unknown = sorted(set(grid) - set(DETECTOR_PARAMS[selected_action]))
+    if unknown:
+        print(f"[sweep] 未知參數: {', '.join(unknown)}（可用: {', '.join(DETECTOR_PARAMS[selected_action])}）")
+        return None
+    sessions = load_session_labels(labels_path, selected_action)
+    if not sessions:
+        print("[sweep] 標註檔中沒有此動作的 session")
+        return None
+    if out_dir is None:
+        out_dir = os.path.join(os.getcwd(), "output")
+    os.makedirs(out_dir, exist_ok=True)
+
+    for s in sessions:
+        s["cache"] = pose_cache_path(s["video"], start_sec, stab_mode, stab_two_pass, end_sec=end_sec)
+    missing = [s["video"] for s in sessions if not os.path.exists(s["cache"])]
+    if missing:
+        print(f"[sweep] {len(missing)} 支影片尚無關鍵點快取，先推論一次")
+        run_batch(missing, selected_action, out_dir=os.path.join(out_dir, "sweep_fill"), workers=workers,
+                  start_sec=start_sec, end_sec=end_sec, stab_mode=stab_mode, stab_two_pass=stab_two_pass,
+                  write_video=False, events=None)
+    for s in sessions:
+        if not os.path.exists(s["cache"]):
+            print(f"[sweep] 略過（無法取得關鍵點）: {s['video']}")
+    sessions = [s for s in sessions if os.path.exists(s["cache"])]
+    if not sessions:
+        return None
+
+    configs = [{}] + sweep_configs(grid, n_random, seed)     # 第一組 = 目前預設值（基準）
+    workers = max(1, int(workers or os.cpu_count() or 1))
+    chunk = max(1, len(configs) // (workers * 8))
+    jobs = [(selected_action, configs[i:i + chunk]) for i in range(0, len(configs), chunk)]
+    truth = [(s["success"], s["fail"]) for s in sessions]
+
+    print(f"[sweep] {len(sessions)} 個 session × {len(configs)} 組參數，{workers} 個 worker")
+    evaluated = []
+    t0 = time.perf_counter()
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_sweep_worker_init,
+                             initargs=([s["cache"] for s in sessions],)) as ex:
+        for fut in as_completed([ex.submit(_sweep_eval, job) for job in jobs]):
+            for params, preds in fut.result():
+                err = sum(abs(p[0] - t[0]) + abs(p[1] - t[1]) for p, t in zip(preds, truth))
+                exact = sum(1 for p, t in zip(preds, truth) if tuple(p) == t)
+                evaluated.append({"params": dict(DETECTOR_PARAMS[selected_action], **params),
+                                  "overrides": params, "error": err, "exact_sessions": exact,
+                                  "predicted": [list(p) for p in preds]})
+    wall = time.perf_counter() - t0
+
+    baseline = next(e for e in evaluated if not e["overrides"])
+    ranked = sorted(evaluated, key=lambda e: (e["error"], -e["exact_sessions"]))
+    summary = {
+        "action": selected_action,
+        "sessions": [{"video": s["video"], "success": s["success"], "fail": s["fail"]} for s in sessions],
+        "configs": len(configs),
+        "wall_s": round(wall, 3),
+        "configs_per_s": round(len(configs) / wall, 2) if wall > 0 else 0.0,
+        "baseline": baseline,
+        "top": ranked[:top],
+    }
+    summary_path = os.path.join(out_dir, f"sweep_{selected_action}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    print(f"[sweep] 預設參數：誤差 {baseline['error']}，完全相符 {baseline['exact_sessions']}/{len(sessions)}")
+    for i, e in enumerate(ranked[:top], 1):
+        print(f"[sweep] #{i:02d} 誤差 {e['error']}  相符 {e['exact_sessions']}/{len(sessions)}  {e['overrides'] or '(預設)'}")
+    print(f"[sweep] {len(configs)} 組 / {wall:.1f}s（{summary['configs_per_s']:.1f} 組/秒），彙總: {summary_path}")
+    return summary
+
+
+# ==============================
+# 基準測試（離線；合成畫面 + 合成關鍵點，結果存 JSON 以便跨 commit 比較）
+# ==============================
+
+BENCH_SIZES = {"720p": (1280, 720), "1080p": (1920, 1080), "4k": (3840, 2160)}
+
+
+def synthetic_pose_stream(n, action="squat_hip_height", seed=0):
+    """
+    合成 (n, 33, 4) 關鍵點：站姿人形，squat 膝角在 175°↔100° 間往返，
+    calf_raise 先靜止 2 秒（讓基準建立）再反覆墊腳 30°、停留約 3.5 秒
+    （經 detector 平滑後峰值仍須高於 raise_enter_deg 才會計次，每 150 幀一下）。
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n)
+    lm = np.zeros((n, 33, 4), np.float32)
+    lm[:, :, 3] = 0.9
+    lm[:, 0::2, 3] = 0.95                                  # 左側略高，選邊穩定
+    for side, dx in ((0, -0.04), (1, 0.04)):               # 0=左（偶數索引的右邊 +1）
+        knee = np.stack([np.full(n, 0.5 + dx), np.full(n, 0.70)], 1)
+        ankle = knee + [0.0, 0.18]
+        if action == "squat_hip_height":
+            th = np.radians(137.5 + 37.5 * np.cos(2 * np.pi * t / 90.0))
+        else:
+            th = np.full(n, np.pi)
+        hip = knee + 0.18 * np.stack([np.sin(th), np.cos(th)], 1)
+        shoulder = hip + [0.0, -0.25]
+        foot_len = 0.06
+        lift = np.zeros(n)
+        if action == "calf_raise":
+            phase = (t - 60) % 150
+            lift = np.where((t >= 60) & (phase < 110), np.radians(30.0), 0.0)
+        toe = ankle + [foot_len, 0.02]
+        heel = toe + 2 * foot_len * np.stack([-np.cos(lift), -np.sin(lift)], 1)    # 以腳尖為支點抬起腳跟
+        for idx, pt in ((11, shoulder), (13, shoulder + [dx, 0.12]), (15, shoulder + [dx, 0.24]),
+                        (17, shoulder + [dx, 0.26]), (19, shoulder + [dx, 0.27]), (21, shoulder + [dx, 0.25]),
+                        (23, hip), (25, knee), (27, ankle), (29, heel), (31, toe)):
+            lm[:, idx + side, :2] = pt
+    head = (lm[:, 11, :2] + lm[:, 12, :2]) / 2 + [0.0, -0.12]
+    for i in range(11):
+        lm[:, i, :2] = head + [0.01 * (i % 5 - 2), 0.005 * (i // 5)]
+    lm[:, :, :2] += rng.normal(0.0, 0.001, (n, 33, 2))
+    return lm
+
+
+def synthetic_frames(W, H, count=30, seed=0, shake_px=6.0):
+    """有紋理的合成畫面，每幀隨機平移/微旋轉（給防手震用）。"""
+    rng = np.random.default_rng(seed)
+    base = cv2.GaussianBlur(rng.integers(0, 256, (H // 4, W // 4), dtype=np.uint8), (0, 0), 1.5)
+    base = cv2.cvtColor(cv2.resize(base, (W, H), interpolation=cv2.INTER_CUBIC), cv2.COLOR_GRAY2BGR)
+    for _ in range(40):
+        p = tuple(int(v) for v in rng.integers(0, (W, H)))
+        cv2.rectangle(base, p, (p[0] + int(rng.integers(20, W // 8)), p[1] + int(rng.integers(20, H // 8))),
+                      tuple(int(c) for c in rng.integers(0, 256, 3)), -1)
+    frames = []
+    for _ in range(count):
+        dx, dy = rng.normal(0.0, shake_px, 2)
+        M = cv2.getRotationMatrix2D((W / 2, H / 2), float(rng.normal(0.0, 0.3)), 1.0)
+        M[:, 2] += (dx, dy)
+        frames.append(cv2.warpAffine(base, M, (W, H), borderMode=cv2.BORDER_REFLECT))
+    return frames
+
+
+def _bench_stats(samples_ns):
+    ms = np.asarray(samples_ns, dtype=np.float64) / 1e6
+    mean = float(ms.mean())
+    return {
+        "n": int(len(ms)),
+        "mean_ms": round(mean, 4),
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p90_ms": round(float(np.percentile(ms, 90)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(ms, 99)), 4),
+        "max_ms": round(float(ms.max()), 4),
+        "fps": round(1000.0 / mean, 1) if mean > 0 else None,
+    }
+
+
+def _bench_case(fn, n, warmup=10):
+    """fn(i) 呼叫 n 次（前 warmup 次不計），回傳每次耗時（ns）。"""
+    for i in range(warmup):
+        fn(i)
+    samples = []
+    for i in range(n):
+        t0 = time.perf_counter_ns()
+        fn(i)
+        samples.append(time.perf_counter_ns() - t0)
+    return samples
+
+
+def _bench_cases(n, seed, sizes, wanted=lambda name: True):
+    """
+    回傳 [(name, fn)]；fn(i) 為一次被測呼叫（i 依序遞增，detector 會看到連續的關鍵點）。
+    wanted(name) 為 False 的防手震解析度不產生合成畫面（4K 幀的產生本身就要數秒）。
+    """
+    W, H = BENCH_SIZES["720p"]
+    canvas = synthetic_frames(W, H, count=1, seed=seed)[0]
+    squat_arr = synthetic_pose_stream(n + 20, "squat_hip_height", seed)
+    calf_arr = synthetic_pose_stream(n + 20, "calf_raise", seed)
+    squat_lms = [LandmarkFrame(a, W, H) for a in squat_arr]
+    calf_lms = [LandmarkFrame(a, W, H) for a in calf_arr]
+    if any(wanted(f"CalfRaiseDetector.process_frame[{k}]") for k in ("draw", "no-draw")) \
+            and score_calf(calf_arr[:n], W, H, 30.0)["total"] == 0:
+        # 合成資料若一下都計不到，detector 只走 idle 分支，量到的不是真實負載
+        raise ValueError(f"bench 的合成提踵資料在 n={n} 幀內沒有任何一下計次，請加大 --n（至少約 180）")
+    squat_pb = [landmarks_from_array(a) for a in squat_arr]
+    hud = ["深蹲（膝角法）", "膝角：142.3°   成功：3  失敗：1  總數：4  成功率：75.0%",
+           "規則：回合最低角達 95–135°，站回 ≥170° 計成；若只到 136–162° 後站回則判失敗"]
+
+    cases = [
+        ("draw_text_block[cached]", lambda i: draw_text_block(canvas, hud, anchor='lt', margin=16)),
+        ("draw_text_block[changing]", lambda i: draw_text_block(
+            canvas, [hud[0], f"膝角：{100 + (i % 800) / 10:.1f}°   成功：{i}"], anchor='lt', margin=16)),
+        ("put_chinese_text", lambda i: put_chinese_text(canvas, f"成功: {i}", (20, 40))),
+        ("LandmarkFrame.from_landmarks", lambda i: LandmarkFrame.from_landmarks(squat_pb[i], W, H)),
+        ("calculate_angle", lambda i: calculate_angle([0.50, 0.52], [0.50, 0.70], [0.52 + i * 1e-5, 0.88])),
+        ("pose_joint_angles[1 frame]", lambda i: pose_joint_angles(squat_arr[i])),
+        (f"pose_joint_angles[{n} frames]", lambda i: pose_joint_angles(squat_arr)),
+    ]
+    for mode in LandmarkSmoother.MODES:
+        smoother = LandmarkSmoother(mode=mode)
+        cases.append((f"LandmarkSmoother[{mode}]", (lambda sm: (lambda i: sm.smooth(
+            "left", [[0.5, 0.52 + i * 1e-5], [0.5, 0.7], [0.5, 0.88]])))(smoother)))
+
+    for action, lms, label in (("squat_hip_height", squat_lms, "SquatKneeAngleThresholdDetector"),
+                               ("calf_raise", calf_lms, "CalfRaiseDetector")):
+        for with_frame in (True, False):
+            det, _ = make_detector(action, 30.0)
+            frame = canvas.copy() if with_frame else None
+            cases.append((f"{label}.process_frame[{'draw' if with_frame else 'no-draw'}]",
+                          (lambda d, f, L: (lambda i: d.process_frame(L[i], f, W, H)))(det, frame, lms)))
+
+    cases.append(("draw_pose", lambda i: _draw_pose(canvas, squat_lms[i])))
+
+    for size in sizes:
+        if not wanted(f"GlobalStab.stabilize[{size}]"):
+            continue
+        sw, sh = BENCH_SIZES[size]
+        frames = synthetic_frames(sw, sh, count=30, seed=seed)
+        stab = GlobalStab()
+        cases.append((f"GlobalStab.stabilize[{size}]",
+                      (lambda st, fr: (lambda i: st.stabilize(fr[i % len(fr)])))(stab, frames)))
+    return cases
+
+
+def _git_revision():
+    try:
+        here = os.path.dirname(os.path.abspath(__file__))
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True,
+                             text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_bench(out_dir=None, n=300, seed=0, sizes=("720p", "1080p", "4k"), only=None, compare=None):
+    """
+    逐項計時各階段（每次呼叫的延遲百分位與換算 fps），寫入 out_dir/bench_<ts>.json。
+    only: 名稱子字串過濾；compare: 先前的 bench JSON，列出 p50 變化。
+    """
+    if out_dir is None:
+        out_dir = os.path.join(os.getcwd(), "output")
+    os.makedirs(out_dir, exist_ok=True)
+    def wanted(name):
+        return not only or any(k.lower() in name.lower() for k in only)
+
+    results = {}
+    for name, fn in _bench_cases(n, seed, sizes, wanted):
+        if not wanted(name):
+            continue
+        calls = max(30, n // 5) if name.startswith("GlobalStab") else n
+        with contextlib.redirect_stdout(io.StringIO()):    # detector 的 [... LOG] 不洗版
+            results[name] = _bench_stats(_bench_case(fn, calls))
+        r = results[name]
+        print(f"[bench] {name:<56s} p50 {r['p50_ms']:9.3f} ms  p95 {r['p95_ms']:9.3f}  "
+              f"p99 {r['p99_ms']:9.3f}  {r['fps']:>10} fps")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": _git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "mediapipe": _mediapipe_version(),
+            "cv2_threads": cv2.getNumThreads(),
+            "n": n, "seed": seed,
+        },
+        "results": results,
+    }
+    path = os.path.join(out_dir, f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[bench] 結果: {path}")
+
+    if compare:
+        with open(compare, encoding="utf-8") as f:
+            old = json.load(f)
+        print(f"[bench] 與 {compare}（git {old.get('meta', {}).get('git')}）比較 p50：")
+        for name, r in results.items():
+            o = old.get("results", {}).get(name)
+            if o and o.get("p50_ms"):
+                print(f"[bench]   {name:<56s} {o['p50_ms']:9.3f} → {r['p50_ms']:9.3f} ms  "
+                      f"（×{r['p50_ms'] / o['p50_ms']:.2f}）")
+    return report
+
+
+# ==============================
+# 命令列入口
+# ==============================
+
+def _add_video_args(p):
+    p.add_argument("--codec", default="mp4v", choices=sorted(VIDEO_CODECS),
+                   help="輸出影片編碼（h264 檔案最小，不支援時退回 mp4v；mjpg 可調 --quality；ffv1 無損）")
+    p.add_argument("--quality", type=int, default=None, help="編碼品質 0–100（僅 mjpg 有效）")
+    p.add_argument("--out-scale", type=float, default=1.0, help="輸出影片縮放（如 0.5）")
+    p.add_argument("--out-every", type=int, default=1, metavar="N", help="每 N 幀寫一幀（審閱用副本）")
+
+
+def _video_opts(args):
+    return {"codec": args.codec, "quality": args.quality, "scale": args.out_scale, "every": args.out_every}
+
+
+def build_arg_parser():
+    p = argparse.ArgumentParser(description="Rehab Counter — 深蹲 / 提踵（無參數時開啟 GUI 流程）")
+    sub = p.add_subparsers(dest="cmd")
+
+    b = sub.add_parser("batch", help="無介面批次處理多支影片（行程池平行）")
+    b.add_argument("inputs", nargs="+", help="影片路徑、glob（如 videos/*.mp4）或資料夾")
+    b.add_argument("--action", required=True, choices=sorted(ACTION_NAMES), help="squat_hip_height / calf_raise")
+    b.add_argument("--workers", type=int, default=None, help="worker 行程數（預設 = CPU 核心數）")
+    b.add_argument("--out-dir", default=None, help="輸出資料夾（預設 ./output）")
+    b.add_argument("--start", default="0", help="每支影片的起始時間（秒數或 MM:SS / HH:MM:SS）")
+    b.add_argument("--end", default=None, help="每支影片的結束時間（不含；預設到結尾）")
+    b.add_argument("--segment", action="append", default=None, metavar="START-END",
+                   help="只處理這些區段（如 1:00-2:30，結尾可留空；可重複或以逗號分隔），取代 --start/--end")
+    b.add_argument("--stab", default="warp", choices=STAB_MODES,
+                   help="防手震：warp=校正整張畫面、landmarks=只校正關鍵點（較快）、off=關閉")
+    b.add_argument("--stab-two-pass", action="store_true",
+                   help="兩階段防手震：先估計並平滑整支影片的相機軌跡（依內容雜湊快取於 output/cache）")
+    b.add_argument("--no-video", action="store_true", help="不輸出標註影片（只寫 JSON；關鍵點快取命中時連解碼都略過）")
+    b.add_argument("--analysis-only", action="store_true",
+                   help="只計數：同 --no-video，且 --stab warp 改為只換算關鍵點（不 warp 畫面）")
+    b.add_argument("--no-pose-cache", action="store_true", help="不讀寫關鍵點快取")
+    b.add_argument("--events", default="jsonl", choices=("jsonl", "csv", "none"),
+                   help="回合事件檔格式（寫到 out-dir/events/，每 worker 一檔；none = 印到主控台）")
+    b.add_argument("--adaptive", type=int, default=1, metavar="N",
+                   help="依動作狀態調整推論頻率：閒置時每 N 幀推論一次、其餘內插（預設 1 = 每幀）")
+    _add_video_args(b)
+
+    ch = sub.add_parser("chunked", help="單支長影片切塊，以行程池平行推論與計數")
+    ch.add_argument("video", help="影片路徑")
+    ch.add_argument("--action", required=True, choices=sorted(ACTION_NAMES), help="squat_hip_height / calf_raise")
+    ch.add_argument("--chunk", type=float, default=300.0, help="每塊秒數（預設 300）")
+    ch.add_argument("--overlap", type=float, default=10.0, help="每塊往前暖機的秒數（預設 10）")
+    ch.add_argument("--workers", type=int, default=None, help="worker 行程數（預設 = CPU 核心數）")
+    ch.add_argument("--stab", default="landmarks", choices=STAB_MODES,
+                    help="防手震模式（非 off 時用兩階段軌跡的 landmarks 模式；第一階段也分塊平行）")
+    ch.add_argument("--out-dir", default=None, help="輸出資料夾（預設 ./output）")
+    ch.add_argument("--no-pose-cache", action="store_true", help="不讀寫關鍵點快取")
+    ch.add_argument("--events", default="jsonl", choices=("jsonl", "csv", "none"), help="回合事件檔格式")
+    ch.add_argument("--strict", action="store_true", help="分塊計數與整段重算不一致時直接報錯（不改用重算結果）")
+
+    lv = sub.add_parser("live", help="多個攝影機 / 串流同時即時錄影計數（每站各自的 Pose 圖，限制同時推論數）")
+    lv.add_argument("--source", action="append", required=True, metavar="SRC",
+                    help="攝影機索引（0, 1, ...）、影片檔或 rtsp:// 等 URL；可重複，每個來源一個工作站")
+    lv.add_argument("--action", required=True, choices=sorted(ACTION_NAMES), help="squat_hip_height / calf_raise")
+    lv.add_argument("--pose-workers", type=int, default=None, help="同時推論的執行緒數（預設 = CPU 核心數 / 2；各站的 Pose 圖不共用）")
+    lv.add_argument("--stab", default="warp", choices=STAB_MODES, help="防手震模式")
+    lv.add_argument("--out-dir", default=None, help="輸出資料夾（預設 ./output）")
+    lv.add_argument("--no-show", action="store_true", help="不開預覽視窗（搭配 --duration）")
+    lv.add_argument("--duration", type=float, default=None, help="錄製秒數（預設直到 Q/ESC 或來源結束）")
+    lv.add_argument("--debug-hud", action="store_true", help="預覽顯示各站 FPS / 延遲（預覽中按 D 切換）")
+    lv.add_argument("--defer-overlay", action="store_true",
+                    help="只錄原始畫面 + 疊圖側檔（*_overlay.npz），標註影片事後用 render 產生")
+    _add_video_args(lv)
+
+    rd = sub.add_parser("render", help="以原始錄影 + 疊圖側檔產生標註影片（不推論，快於即時）")
+    rd.add_argument("video", help="--defer-overlay 錄下的原始影片（*_raw.mp4）")
+    rd.add_argument("--sidecar", default=None, help="側檔路徑（預設 <影片>_overlay.npz）")
+    rd.add_argument("--out", default=None, help="輸出影片（預設 <影片>_rendered.mp4）")
+    rd.add_argument("--height", type=int, default=None, help="輸出高度（預設 = 錄影解析度）")
+    rd.add_argument("--show", action="store_true", help="同時預覽")
+    _add_video_args(rd)
+
+    s = sub.add_parser("sweep", help="以關鍵點快取掃描 detector 門檻，找出最接近治療師計數的參數")
+    s.add_argument("labels", help="標註檔 JSON：[{\"video\": ..., \"success\": n, \"fail\": m}, ...]")
+    s.add_argument("--action", required=True, choices=sorted(ACTION_NAMES), help="squat_hip_height / calf_raise")
+    s.add_argument("--grid", action="append", default=[], metavar="NAME=SPEC",
+                   help="參數範圍：v1,v2,... 或 start:stop:step（可重複，如 --grid A_min=6:9:0.5）")
+    s.add_argument("--random", type=int, default=0, metavar="N", help="改為在 --grid 範圍內隨機抽樣 N 組")
+    s.add_argument("--seed", type=int, default=0, help="隨機抽樣種子")
+    s.add_argument("--top", type=int, default=10, help="列出前幾名")
+    s.add_argument("--workers", type=int, default=None, help="worker 行程數（預設 = CPU 核心數）")
+    s.add_argument("--out-dir", default=None, help="輸出資料夾（預設 ./output）")
+    s.add_argument("--start", default="0", help="快取對應的起始時間（需與產生快取時相同）")
+    s.add_argument("--end", default=None, help="快取對應的結束時間（需與產生快取時相同）")
+    s.add_argument("--stab", default="warp", choices=STAB_MODES, help="快取對應的防手震模式")
+    s.add_argument("--stab-two-pass", action="store_true", help="快取對應的兩階段防手震設定")
+
+    bn = sub.add_parser("bench", help="離線基準測試各階段（合成資料），結果存 JSON")
+    bn.add_argument("--n", type=int, default=300, help="每項呼叫次數（防手震為 n/5，至少 30）")
+    bn.add_argument("--seed", type=int, default=0, help="合成資料種子")
+    bn.add_argument("--sizes", default="720p,1080p,4k", help="防手震測試解析度（逗號分隔：720p,1080p,4k）")
+    bn.add_argument("--only", action="append", default=None, metavar="NAME", help="只跑名稱含此字串的項目（可重複）")
+    bn.add_argument("--compare", default=None, metavar="JSON", help="與先前的 bench 結果比較 p50")
+    bn.add_argument("--threads", type=int, default=None, help="cv2.setNumThreads（預設不變）")
+    bn.add_argument("--out-dir", default=None, help="輸出資料夾（預設 ./output）")
+    return p
+
+
+def cli(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.cmd == "batch":
+        run_batch(args.inputs, args.action, out_dir=args.out_dir, workers=args.workers,
+                  start_sec=parse_timecode(args.start), stab_mode=args.stab, stab_two_pass=args.stab_two_pass,
+                  end_sec=None if args.end is None else parse_timecode(args.end),
+                  segments=parse_segments(args.segment) if args.segment else None,
+                  write_video=not (args.no_video or args.analysis_only), analysis_only=args.analysis_only, use_pose_cache=not args.no_pose_cache,
+                  adaptive_stride=args.adaptive, events=None if args.events == "none" else args.events,
+                  video_opts=_video_opts(args))
+    elif args.cmd == "chunked":
+        run_chunked(args.video, args.action, out_dir=args.out_dir, events=None if args.events == "none" else args.events,
+                    chunk_s=args.chunk, overlap_s=args.overlap, workers=args.workers, stab_mode=args.stab,
+                    use_pose_cache=not args.no_pose_cache, strict=args.strict)
+    elif args.cmd == "live":
+        run_live_stations(args.source, args.action, pose_workers=args.pose_workers, stab_mode=args.stab,
+                          out_dir=args.out_dir, show=not args.no_show, debug_hud=args.debug_hud,
+                          duration=args.duration, defer_overlay=args.defer_overlay, video_opts=_video_opts(args))
+    elif args.cmd == "render":
+        render_overlay(args.video, sidecar_path=args.sidecar, out_path=args.out, height=args.height, show=args.show,
+                       video_opts=_video_opts(args))
+    elif args.cmd == "sweep":
+        run_sweep(args.labels, args.action, parse_param_grid(args.grid), n_random=args.random, seed=args.seed,
+                  top=args.top, workers=args.workers, out_dir=args.out_dir, start_sec=parse_timecode(args.start),
+                  end_sec=None if args.end is None else parse_timecode(args.end),
+                  stab_mode=args.stab, stab_two_pass=args.stab_two_pass)
+    elif args.cmd == "bench":
+        if args.threads is not None:
+            cv2.setNumThreads(args.threads)
+        run_bench(out_dir=args.out_dir, n=args.n, seed=args.seed,
+                  sizes=[s.strip() for s in args.sizes.split(",") if s.strip()], only=args.only,
+                  compare=args.compare)
+    else:
+        main()
 
-    cap.release(); out.release(); cv2.destroyAllWindows()
-    print(f"已儲存: {outfile}")
 
 if __name__ == "__main__":
-    main()
+    cli()